@@ -2,26 +2,140 @@ import os
 from dotenv import load_dotenv
 
 load_dotenv()
+import asyncio
 import io
-from typing import Optional, List
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+import json
+import math
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, Awaitable, BinaryIO, Callable
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Response, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 
 # Import existing services
 from services import (
-    lifestyle_shot_by_image,
-    lifestyle_shot_by_text,
-    add_shadow,
-    create_packshot,
-    enhance_prompt,
-    generative_fill,
-    generate_hd_image,
-    erase_foreground
+    lifestyle_shot_by_image_async,
+    lifestyle_shot_by_text_async,
+    add_shadow_async,
+    create_packshot_async,
+    enhance_prompt_async,
+    generative_expand_async,
+    generative_fill_masked_async,
+    generative_fill_prepared_async,
+    generate_hd_image_async,
+    erase_foreground_async,
+    remove_background_async,
+    warm_prompt_cache_async,
+    prepare_fill_async,
+    fan_out,
+    collect
 )
+from services.background import cutout_cache
+from services.compositor import ENGINES, compositor_stats
+from services.masks import MaskError, mask_stats
+from services.prompt_enhancement import prompt_cache
+from services.variants import MAX_RESULTS_PER_CALL, random_seed
+from services.preprocess import preprocess_stats, preprocess_upload, report_headers
+from core.assets import ASSET_ID, asset_store, etag_matches, parse_range
+from core.cache import result_cache
+from core.config import (
+    API_WORKERS,
+    ASSET_BASE_URL,
+    BATCH_CONCURRENCY,
+    BATCH_MAX_CONCURRENCY,
+    FANOUT_MAX_RESULTS,
+    FANOUT_RESULTS_PER_CALL,
+    JOB_POLL_INTERVAL,
+    JOB_POLL_TIMEOUT,
+)
+from core.cpu import cpu_pool
+from core.http import close_client
+from core.jobs import QueueFullError, job_manager
+from core.keypool import key_pool
+from core.log import get_logger
+from core.metrics import (
+    CONTENT_TYPE_LATEST,
+    STAGE_LATENCY,
+    MetricsMiddleware,
+    register_stats,
+    release_process_metrics,
+    render_metrics,
+    reset_multiprocess_metrics
+)
+from core.ratelimit import rate_limiter
+from core.resilience import resilience_stats
+from core.scheduler import BATCH, INTERACTIVE, current_priority, current_tenant, scheduler_stats, tenant_id
+from core.singleflight import single_flight
+from core.state import shared_state
+from core.tracing import TracingMiddleware
+from core.results import extract_result_urls, wait_for_urls
+from workflows.catalog_batch import BATCH_OPERATIONS, checkpoint_path, run_catalog_batch
+from workflows.generate_ad_set import generate_ad_set_async
+
+logger = get_logger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if API_WORKERS > 1 and shared_state is None:
+        logger.warning("state.per_process", workers=API_WORKERS,
+                       detail="jobs, caches and rate limits are not shared between workers, set STATE_BACKEND=redis")
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    if shared_state is not None:
+        await shared_state.close()
+    # Release pooled upstream connections on shutdown
+    await close_client()
+    cpu_pool.shutdown()
+    release_process_metrics()
+
+# Bulk endpoints whose upstream calls yield to interactive traffic
+BATCH_PATHS = ("/batch/catalog", "/enhance-prompt/warm")
+# Longest Retry-After we send; a bucket with a zero rate never refills
+MAX_RETRY_AFTER = 3600
+
+async def admit_request(request: Request) -> None:
+    """
+    Identify the tenant of a request, pick its scheduling priority and apply
+    the per-tenant, per-endpoint rate limit before the endpoint runs.
+    """
+    if request.method != "POST":
+        return
+    # FastAPI has received and parsed the whole body by the time dependencies run
+    started_at = getattr(request.state, "started_at", None)
+    if started_at is not None:
+        STAGE_LATENCY.labels("upload_read").observe(time.perf_counter() - started_at)
+    api_key = None
+    if request.headers.get("content-type", "").startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+        # Already parsed (and cached on the request) by FastAPI for the endpoint's Form fields
+        api_key = (await request.form()).get("api_key")
+    tenant = tenant_id(api_key if isinstance(api_key, str) else None, request.client.host if request.client else None)
+    priority = BATCH if request.url.path in BATCH_PATHS else INTERACTIVE
+    # Clients may demote their own requests, e.g. scripted bulk generation
+    if request.headers.get("x-priority", "").lower() == BATCH:
+        priority = BATCH
+    # Inherited by the endpoint and every task it starts
+    current_tenant.set(tenant)
+    current_priority.set(priority)
+
+    retry_after = await rate_limiter.check(tenant, request.url.path)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded, slow down",
+            headers={"Retry-After": str(max(1, math.ceil(min(retry_after, MAX_RETRY_AFTER))))}
+        )
 
-app = FastAPI(title="Visionary API", description="Backend API for Visionary AI Studio")
+app = FastAPI(
+    title="Visionary API",
+    description="Backend API for Visionary AI Studio",
+    lifespan=lifespan,
+    dependencies=[Depends(admit_request)]
+)
 
 # CORS Configuration
 # In production, replace ["*"] with specific frontend domains
@@ -31,7 +145,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Upload-Bytes", "X-Upload-Bytes-Sent", "X-Preprocess-Ms"],
 )
+app.add_middleware(MetricsMiddleware)
+# Outermost, so the server span covers everything else
+app.add_middleware(TracingMiddleware)
+
+register_stats("result_cache", result_cache.stats)
+register_stats("prompt_cache", prompt_cache.stats)
+register_stats("asset_store", asset_store.stats)
+register_stats("cutout_cache", cutout_cache.stats)
+register_stats("single_flight", single_flight.stats)
+register_stats("preprocess", preprocess_stats)
+register_stats("masks", mask_stats)
+register_stats("compositor", compositor_stats)
+register_stats("cpu_pool", cpu_pool.stats)
+register_stats("scheduler", scheduler_stats)
+register_stats("rate_limiter", rate_limiter.stats)
+register_stats("retry_budget", lambda: resilience_stats()["retry_budget"])
+register_stats("key_pool", key_pool.stats)
+register_stats("jobs", lambda: {"queue_depth": job_manager.queue_depth()})
 
 # --- Helper Models ---
 
@@ -47,13 +180,120 @@ class EnhancePromptRequest(BaseModel):
     prompt: str
     api_key: Optional[str] = None
 
+class WarmPromptsRequest(BaseModel):
+    prompts: List[str]
+    api_key: Optional[str] = None
+    concurrency: int = 8
+
 def get_api_key(api_key: Optional[str] = None) -> str:
     if api_key:
         return api_key
-    env_key = os.getenv("BRIA_API_KEY")
-    if env_key:
-        return env_key
-    raise HTTPException(status_code=401, detail="API Key not found. Please provide it in the request or set BRIA_API_KEY environment variable.")
+    # Any pooled key will do: upstream calls are routed across the whole pool
+    pooled_key = key_pool.default_key()
+    if pooled_key:
+        return pooled_key
+    raise HTTPException(status_code=401, detail="API Key not found. Please provide it in the request or set the BRIA_API_KEY (or BRIA_API_KEYS) environment variable.")
+
+def hd_image_options(style: str, prompt: str, enhance_image: bool) -> Dict[str, Any]:
+    """Map the studio style picker onto generate_hd_image arguments."""
+    final_prompt = prompt
+    is_realistic = style == "Realistic"
+    
+    if style and not is_realistic:
+        # For artistic styles, put the style first to have stronger effect
+        final_prompt = f"{style} style artwork: {prompt}"
+        # Disable automatic enhancement for artistic styles to preserve the look
+        enhance_image = False
+    
+    return {
+        "prompt": final_prompt,
+        "enhance_image": enhance_image,
+        "medium": "art" if style != "Realistic" else "photography"
+    }
+
+def published(result: Any, request: Request) -> Any:
+    """Point the result URLs at our /assets route when the asset store is enabled."""
+    return asset_store.publish(result, ASSET_BASE_URL or str(request.base_url))
+
+def parse_positions(manual_positions: Optional[str]) -> List[str]:
+    """Turn a comma separated list like 'Upper Left, Bottom' into placement keys."""
+    if not manual_positions:
+        return []
+    return [p.strip().lower().replace(" ", "_") for p in manual_positions.split(",")]
+
+def check_engine(engine: Optional[str]) -> None:
+    if engine is not None and engine.strip().lower() not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of {', '.join(ENGINES)}")
+
+def check_num_results(num_results: int) -> None:
+    if not 1 <= num_results <= FANOUT_MAX_RESULTS:
+        raise HTTPException(status_code=400, detail=f"num_results must be between 1 and {FANOUT_MAX_RESULTS}")
+
+def fans_out(num_results: int, stream: bool) -> bool:
+    """Whether ``variants`` splits the request into concurrent upstream calls."""
+    return stream or num_results > MAX_RESULTS_PER_CALL
+
+def _read_upload(upload: BinaryIO) -> bytes:
+    upload.seek(0)
+    return upload.read()
+
+async def shared_input(data: Any) -> Any:
+    """
+    An input of concurrent calls as bytes. A file object has one position,
+    so calls streaming it at the same time would interleave their reads.
+    """
+    if data is None or isinstance(data, (bytes, bytearray)):
+        return data
+    return await asyncio.get_running_loop().run_in_executor(None, _read_upload, data)
+
+async def variants(
+    request: Request,
+    generate: Callable[[int, Optional[int]], Awaitable[Dict[str, Any]]],
+    num_results: int,
+    stream: bool = False,
+    seed: Optional[int] = None,
+    seeded: bool = True,
+    headers: Optional[Dict[str, str]] = None
+) -> Any:
+    """
+    Produce ``num_results`` images with ``generate(num_results, seed)``.
+
+    Up to four images without ``stream`` are a single upstream call, answered
+    as before. Larger requests fan out into concurrent calls with distinct
+    seeds (``seeded=False`` for endpoints that take none) and are answered
+    with ``result_urls``. With ``stream`` every image is sent as soon as its
+    call returns, as NDJSON lines or, when the client accepts
+    ``text/event-stream``, as Server-Sent Events, and a final ``done`` record.
+    """
+    if not fans_out(num_results, stream):
+        return published(await generate(num_results, seed), request)
+    if not seeded:
+        seed = None
+    elif seed is None:
+        # Distinct, reported seeds make any single variant reproducible
+        seed = random_seed(num_results)
+    records = fan_out(generate, num_results, FANOUT_RESULTS_PER_CALL if stream else MAX_RESULTS_PER_CALL, seed)
+    if not stream:
+        return published(await collect(records), request)
+
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    def frame(event: str, record: Dict[str, Any]) -> str:
+        return f"event: {event}\ndata: {json.dumps(record)}\n\n" if sse else json.dumps(record) + "\n"
+
+    async def record_stream():
+        done = {"done": True, "results": 0, "errors": 0}
+        async for record in records:
+            failed = "error" in record
+            done["errors" if failed else "results"] += 1
+            yield frame("error" if failed else "result", published(record, request))
+        yield frame("done", done)
+
+    return StreamingResponse(
+        record_stream(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={**(headers or {}), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # --- Endpoints ---
 
@@ -61,41 +301,98 @@ def get_api_key(api_key: Optional[str] = None) -> str:
 async def root():
     return {"message": "Visionary API is running"}
 
+@app.get("/metrics")
+async def api_metrics():
+    """
+    Prometheus metrics: latency histograms per endpoint, upstream route and
+    processing stage, payload sizes, in-flight gauges, retries, errors and
+    cache counters.
+    """
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/cache/stats")
+async def api_cache_stats():
+    """
+    Hit/miss counters of the upstream result cache, the prompt cache and
+    the cutout cache, and what the asset store has downloaded.
+    """
+    return {
+        **result_cache.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "cutout_cache": cutout_cache.stats(),
+        "asset_store": asset_store.stats(),
+    }
+
+@app.get("/upstream/status")
+async def api_upstream_status():
+    """
+    Circuit breaker state per upstream endpoint, retry budget usage and
+    how many calls were coalesced with an identical one in flight.
+    """
+    return {**resilience_stats(), "single_flight": single_flight.stats()}
+
+@app.get("/keys/status")
+async def api_keys_status():
+    """
+    Per-key load, 429 and 401/403 counts and state (available, cooling_down
+    or quarantined) of the server-side key pool. Keys are shown hashed.
+    """
+    return key_pool.stats()
+
+@app.get("/scheduler/status")
+async def api_scheduler_status():
+    """
+    Upstream calls in flight and queued, per priority class and tenant,
+    plus rate limiter counters and the background job queue depth.
+    """
+    return {
+        **scheduler_stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "job_queue_depth": job_manager.queue_depth()
+    }
+
+@app.get("/preprocess/stats")
+async def api_preprocess_stats():
+    """
+    Upload bytes saved by image pre-processing since startup, and how many
+    masks were validated, rejected locally or sent as a crop, and the
+    load of the CPU pool that does that work.
+    """
+    return {**preprocess_stats(), "masks": mask_stats(), "cpu_pool": cpu_pool.stats()}
+
 @app.post("/generate-image")
 async def api_generate_image(
+    request: Request,
     prompt: str = Form(...),
     api_key: Optional[str] = Form(None),
     num_results: int = Form(1),
     aspect_ratio: str = Form("1:1"),
     enhance_image: bool = Form(True),
-    style: str = Form("Realistic")
+    style: str = Form("Realistic"),
+    seed: Optional[int] = Form(None),
+    stream: bool = Form(False) # send each image as soon as it is ready
 ):
     """
     Generate HD images from text prompt.
     """
+    check_num_results(num_results)
     try:
-        final_prompt = prompt
-        is_realistic = style == "Realistic"
-        
-        if style and not is_realistic:
-            # For artistic styles, put the style first to have stronger effect
-            final_prompt = f"{style} style artwork: {prompt}"
-            # Disable automatic enhancement for artistic styles to preserve the look
-            enhance_image = False
-            
         final_key = get_api_key(api_key)
-        result = generate_hd_image(
-            prompt=final_prompt,
-            api_key=final_key,
-            num_results=num_results,
-            aspect_ratio=aspect_ratio,
-            sync=True,
-            enhance_image=enhance_image,
-            medium="art" if style != "Realistic" else "photography",
-            prompt_enhancement=False,
-            content_moderation=True
-        )
-        return result
+        options = hd_image_options(style, prompt, enhance_image)
+
+        def generate(count: int, call_seed: Optional[int]):
+            return generate_hd_image_async(
+                api_key=final_key,
+                num_results=count,
+                aspect_ratio=aspect_ratio,
+                seed=call_seed,
+                sync=True,
+                prompt_enhancement=False,
+                content_moderation=True,
+                **options
+            )
+
+        return await variants(request, generate, num_results, stream, seed)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -109,52 +406,94 @@ async def api_enhance_prompt(
     """
     try:
         final_key = get_api_key(api_key)
-        result = enhance_prompt(final_key, prompt)
+        result = await enhance_prompt_async(final_key, prompt)
         return {"enhanced_prompt": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/enhance-prompt/warm")
+async def api_warm_prompt_cache(request: WarmPromptsRequest):
+    """
+    Pre-compute enhancements for a list of prompts so later requests are cache hits.
+    """
+    try:
+        final_key = get_api_key(request.api_key)
+        return await warm_prompt_cache_async(final_key, request.prompts, concurrency=request.concurrency)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/product/packshot")
 async def api_create_packshot(
+    request: Request,
+    response: Response,
     file: UploadFile = File(...),
     api_key: Optional[str] = Form(None),
     background_color: str = Form("#FFFFFF"),
     sku: Optional[str] = Form(None),
     force_rmbg: bool = Form(False),
-    content_moderation: bool = Form(False)
+    content_moderation: bool = Form(False),
+    engine: Optional[str] = Form(None) # local, remote or auto (default COMPOSITOR_ENGINE)
 ):
     """
     Create a clean packshot from a product image.
     """
+    check_engine(engine)
     try:
-        image_data = await file.read()
+        # Downscaled/re-encoded when that pays off, otherwise streamed from the spooled upload
+        image_data, _, report = await preprocess_upload("packshot", file.file)
+        response.headers.update(report_headers(report))
         
-        # If force_rmbg is True, we might need to handle it here or let the service handle it.
-        # Based on app.py, app.py calls remove_background explicitly if force_rmbg is True.
-        # However, create_packshot service might have that logic or we might need to import remove_background.
-        # Let's check if create_packshot handles it. In app.py it calls remove_background SEPARATELY.
-        # For simplicity in this API v1, we will trust create_packshot or add logic if needed.
-        # Looking at app.py: 
-        # width st.spinner... if force_rmbg: remove_background(...) then create_packshot(...)
-        
-        # We'll stick to calling create_packshot directly for now. 
-        # If the user needs explicit background removal, we should expose that service too.
+        # Background removal (force_rmbg, or any image without transparency) goes through
+        # the cutout cache, so shadow and lifestyle shots of the same image reuse it
         
         final_key = get_api_key(api_key)
-        result = create_packshot(
+        result = await create_packshot_async(
             api_key=final_key,
             image_data=image_data,
             background_color=background_color,
             sku=sku,
             force_rmbg=force_rmbg,
+            content_moderation=content_moderation,
+            engine=engine
+        )
+        return published(result, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/product/remove-background")
+async def api_remove_background(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    api_key: Optional[str] = Form(None),
+    content_moderation: bool = Form(False)
+):
+    """
+    Remove the background of a product image (transparent PNG result).
+    """
+    try:
+        # Downscaled/re-encoded when that pays off, otherwise streamed from the spooled upload
+        image_data, _, report = await preprocess_upload("remove-background", file.file)
+        response.headers.update(report_headers(report))
+        
+        final_key = get_api_key(api_key)
+        result = await remove_background_async(
+            api_key=final_key,
+            image_data=image_data,
             content_moderation=content_moderation
         )
-        return result
+        return published(result, request)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/product/shadow")
 async def api_add_shadow(
+    request: Request,
+    response: Response,
     file: UploadFile = File(...),
     api_key: Optional[str] = Form(None),
     shadow_type: str = Form("regular"), # 'regular' or 'float'
@@ -166,16 +505,20 @@ async def api_add_shadow(
     y_offset: float = Form(15),
     width_scale: float = Form(0), # Only for float
     height_scale: float = Form(70), # Only for float
-    force_rmbg: bool = Form(True)
+    force_rmbg: bool = Form(True),
+    engine: Optional[str] = Form(None) # local, remote or auto (default COMPOSITOR_ENGINE)
 ):
     """
     Add shadow to a product image.
     """
+    check_engine(engine)
     try:
-        image_data = await file.read()
+        # Downscaled/re-encoded when that pays off, otherwise streamed from the spooled upload
+        image_data, _, report = await preprocess_upload("shadow", file.file)
+        response.headers.update(report_headers(report))
         
         final_key = get_api_key(api_key)
-        result = add_shadow(
+        result = await add_shadow_async(
             api_key=final_key,
             image_data=image_data,
             shadow_type=shadow_type,
@@ -186,115 +529,172 @@ async def api_add_shadow(
             shadow_blur=shadow_blur,
             shadow_width=width_scale if shadow_type == "float" else None,
             shadow_height=height_scale if shadow_type == "float" else None,
-            force_rmbg=force_rmbg
+            force_rmbg=force_rmbg,
+            engine=engine
         )
-        return result
+        return published(result, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/product/lifestyle-text")
 async def api_lifestyle_text(
+    request: Request,
+    response: Response,
     file: UploadFile = File(...),
     api_key: Optional[str] = Form(None),
     scene_description: str = Form(...),
     placement_type: str = Form("original"), # original, automatic, manual_placement
-    manual_positions: Optional[str] = Form(None) # Comma separated list
+    manual_positions: Optional[str] = Form(None), # Comma separated list
+    num_results: int = Form(1),
+    stream: bool = Form(False) # send each image as soon as it is ready
 ):
     """
     Generate lifestyle shot from text description.
     """
+    check_num_results(num_results)
     try:
-        image_data = await file.read()
+        # Downscaled/re-encoded when that pays off, otherwise streamed from the spooled upload
+        image_data, _, report = await preprocess_upload("lifestyle-text", file.file)
+        response.headers.update(report_headers(report))
+        if fans_out(num_results, stream):
+            image_data = await shared_input(image_data)
+        
+        positions = parse_positions(manual_positions)
         
-        positions = []
-        if manual_positions:
-            positions = [p.strip().lower().replace(" ", "_") for p in manual_positions.split(",")]
-            
         final_key = get_api_key(api_key)
-        result = lifestyle_shot_by_text(
-            api_key=final_key,
-            image_data=image_data,
-            scene_description=scene_description,
-            placement_type=placement_type,
-            num_results=1,
-            sync=True,
-            manual_placement_selection=positions,
-            force_rmbg=True
-        )
-        return result
+
+        def generate(count: int, _seed: Optional[int]):
+            # Calls after the first reuse the cached cutout of the product
+            return lifestyle_shot_by_text_async(
+                api_key=final_key,
+                image_data=image_data,
+                scene_description=scene_description,
+                placement_type=placement_type,
+                num_results=count,
+                sync=True,
+                manual_placement_selection=positions,
+                force_rmbg=True
+            )
+
+        return await variants(request, generate, num_results, stream, seeded=False, headers=report_headers(report))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/product/lifestyle-image")
 async def api_lifestyle_image(
+    request: Request,
+    response: Response,
     product_file: UploadFile = File(...),
     ref_file: UploadFile = File(...),
     api_key: Optional[str] = Form(None),
     placement_type: str = Form("original"),
-    manual_positions: Optional[str] = Form(None)
+    manual_positions: Optional[str] = Form(None),
+    num_results: int = Form(1),
+    stream: bool = Form(False) # send each image as soon as it is ready
 ):
     """
     Generate lifestyle shot using a reference image.
     """
+    check_num_results(num_results)
     try:
-        product_data = await product_file.read()
-        ref_data = await ref_file.read()
+        # Downscaled/re-encoded when that pays off, otherwise streamed from the spooled uploads
+        product_data, _, report = await preprocess_upload("lifestyle-image", product_file.file)
+        ref_data, _, ref_report = await preprocess_upload("lifestyle-image", ref_file.file)
+        for key in ("original_bytes", "sent_bytes", "elapsed_ms"):
+            report[key] += ref_report[key]
+        response.headers.update(report_headers(report))
+        if fans_out(num_results, stream):
+            product_data, ref_data = await shared_input(product_data), await shared_input(ref_data)
+        
+        positions = parse_positions(manual_positions)
         
-        positions = []
-        if manual_positions:
-            positions = [p.strip().lower().replace(" ", "_") for p in manual_positions.split(",")]
-            
         final_key = get_api_key(api_key)
-        result = lifestyle_shot_by_image(
-            api_key=final_key,
-            image_data=product_data,
-            reference_image=ref_data,
-            placement_type=placement_type,
-            num_results=1,
-            sync=True,
-            manual_placement_selection=positions,
-            force_rmbg=True,
-            enhance_ref_image=True,
-            ref_image_influence=0.6
-        )
-        return result
+
+        def generate(count: int, _seed: Optional[int]):
+            return lifestyle_shot_by_image_async(
+                api_key=final_key,
+                image_data=product_data,
+                reference_image=ref_data,
+                placement_type=placement_type,
+                num_results=count,
+                sync=True,
+                manual_placement_selection=positions,
+                force_rmbg=True,
+                enhance_ref_image=True,
+                ref_image_influence=0.6
+            )
+
+        return await variants(request, generate, num_results, stream, seeded=False, headers=report_headers(report))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/edit/generative-fill")
 async def api_generative_fill(
+    request: Request,
+    response: Response,
     file: UploadFile = File(...),
-    mask_file: UploadFile = File(...),
+    mask_file: Optional[UploadFile] = File(None),
     api_key: Optional[str] = Form(None),
     prompt: str = Form(...),
-    expansion_amount: int = Form(0)
+    expansion_amount: int = Form(0), # pixels added on every side of the (pre-processed) image
+    num_results: int = Form(1),
+    seed: Optional[int] = Form(None),
+    stream: bool = Form(False) # send each image as soon as it is ready
 ):
     """
     Generative fill or expand image.
     """
+    if mask_file is None and expansion_amount <= 0:
+        raise HTTPException(status_code=400, detail="mask_file is required unless expansion_amount is set")
+    check_num_results(num_results)
     try:
-        image_data = await file.read()
-        mask_data = await mask_file.read()
-        
-        # The service expects mask as bytes? or file path? 
-        # Checking imports: services.generative_fill
-        # Usually these take bytes.
+        # Downscaled/re-encoded when that pays off (the mask follows the image), otherwise streamed
+        image_data, mask_data, report = await preprocess_upload(
+            "generative-fill", file.file, mask_file.file if mask_file is not None else None
+        )
+        response.headers.update(report_headers(report))
+        if fans_out(num_results, stream):
+            image_data, mask_data = await shared_input(image_data), await shared_input(mask_data)
         
         final_key = get_api_key(api_key)
-        result = generative_fill(
-            api_key=final_key,
-            image_data=image_data,
-            mask_data=mask_data,
-            prompt=prompt,
-            num_results=1,
-            sync=True
-        )
-        return result
+        if expansion_amount > 0:
+            # The border mask is generated; a painted mask is filled in the same pass
+            def generate(count: int, call_seed: Optional[int]):
+                return generative_expand_async(
+                    api_key=final_key,
+                    image_data=image_data,
+                    expansion_amount=expansion_amount,
+                    prompt=prompt,
+                    mask_data=mask_data,
+                    num_results=count,
+                    seed=call_seed
+                )
+        else:
+            # Empty or misaligned masks are rejected here, once for every variant; small ones are sent as a crop
+            plan = await prepare_fill_async(image_data, mask_data, sync=True)
+
+            def generate(count: int, call_seed: Optional[int]):
+                return generative_fill_prepared_async(
+                    api_key=final_key,
+                    plan=plan,
+                    prompt=prompt,
+                    num_results=count,
+                    seed=call_seed,
+                    sync=True
+                )
+
+        return await variants(request, generate, num_results, stream, seed, headers=report_headers(report))
+    except MaskError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
         
 @app.post("/edit/erase")
 async def api_erase(
+    request: Request,
+    response: Response,
     file: UploadFile = File(...),
     mask_file: UploadFile = File(...),
     api_key: Optional[str] = Form(None)
@@ -303,12 +703,13 @@ async def api_erase(
     Erase objects from image using mask.
     """
     try:
-        image_data = await file.read()
-        mask_data = await mask_file.read()
+        # Downscaled/re-encoded when that pays off (the mask follows the image), otherwise streamed
+        image_data, mask_data, report = await preprocess_upload("erase", file.file, mask_file.file)
+        response.headers.update(report_headers(report))
         
         final_key = get_api_key(api_key)
         # Use generative fill with a removal prompt to act as an object eraser
-        result = generative_fill(
+        result = await generative_fill_masked_async(
             api_key=final_key,
             image_data=image_data,
             mask_data=mask_data,
@@ -316,10 +717,364 @@ async def api_erase(
             num_results=1,
             sync=True
         )
-        return result
+        return published(result, request)
+    except MaskError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/edit/erase-foreground")
+async def api_erase_foreground(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    api_key: Optional[str] = Form(None),
+    content_moderation: bool = Form(False)
+):
+    """
+    Erase the main subject of an image and fill in the background behind it.
+    """
+    try:
+        # Downscaled/re-encoded when that pays off, otherwise streamed from the spooled upload
+        image_data, _, report = await preprocess_upload("erase-foreground", file.file)
+        response.headers.update(report_headers(report))
+        
+        final_key = get_api_key(api_key)
+        result = await erase_foreground_async(
+            api_key=final_key,
+            image_data=image_data,
+            content_moderation=content_moderation
+        )
+        return published(result, request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/workflows/ad-set")
+async def api_generate_ad_set(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    prompt: Optional[str] = Form(None),
+    api_key: Optional[str] = Form(None),
+    config: str = Form("{}") # JSON object, see workflows.generate_ad_set
+):
+    """
+    Generate packshot, shadow and lifestyle variants of one product in parallel.
+    """
+    try:
+        workflow_config = json.loads(config)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="config must be a JSON object")
+    if not isinstance(workflow_config, dict):
+        raise HTTPException(status_code=400, detail="config must be a JSON object")
+    max_concurrency = workflow_config.get("max_concurrency")
+    if max_concurrency is not None and (type(max_concurrency) is not int or max_concurrency < 1):
+        raise HTTPException(status_code=400, detail="config.max_concurrency must be a positive integer")
+    step_timeout = workflow_config.get("step_timeout")
+    if step_timeout is not None and (type(step_timeout) not in (int, float) or step_timeout <= 0):
+        raise HTTPException(status_code=400, detail="config.step_timeout must be a positive number of seconds")
+    if file is None and not prompt:
+        raise HTTPException(status_code=400, detail="Provide either an image file or a prompt")
+
+    try:
+        image_data = await file.read() if file is not None else None
+        
+        final_key = get_api_key(api_key)
+        result = await generate_ad_set_async(
+            api_key=final_key,
+            image=image_data,
+            prompt=prompt,
+            config=workflow_config
+        )
+        return published(result, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _spool_upload(upload: UploadFile) -> str:
+    # Copy to a file we own: the upload is closed once the endpoint returns,
+    # while the streamed batch keeps reading from it
+    suffix = os.path.splitext(upload.filename or "")[1]
+    fd, path = tempfile.mkstemp(prefix="catalog-", suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        upload.file.seek(0)
+        shutil.copyfileobj(upload.file, f, length=1024 * 1024)
+    return path
+
+class _SpooledStreamingResponse(StreamingResponse):
+    """Streams a body read from a spooled file, and removes the file however the response ends."""
+
+    def __init__(self, content: Any, source_path: str, **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.source_path = source_path
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # The body may never have started (client gone before the first chunk)
+            try:
+                os.remove(self.source_path)
+            except OSError:
+                pass
+
+@app.post("/batch/catalog")
+async def api_catalog_batch(
+    file: UploadFile = File(...), # .zip of images or .ndjson manifest
+    operation: str = Form("packshot"), # packshot, shadow or lifestyle-text
+    params: str = Form("{}"), # JSON object shared by all items
+    api_key: Optional[str] = Form(None),
+    batch_id: Optional[str] = Form(None), # set to make the batch resumable
+    concurrency: Optional[int] = Form(None)
+):
+    """
+    Process a whole catalog and stream one NDJSON line per SKU as it finishes.
+    """
+    if operation not in BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown operation '{operation}'. Expected one of: {', '.join(BATCH_OPERATIONS)}")
+    try:
+        batch_params = json.loads(params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+    if not isinstance(batch_params, dict):
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+    if batch_id:
+        try:
+            checkpoint_path(batch_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    name = (file.filename or "").lower()
+    if name.endswith(".zip") or file.content_type in ("application/zip", "application/x-zip-compressed"):
+        source_format = "zip"
+    elif name.endswith((".ndjson", ".jsonl")) or file.content_type in ("application/x-ndjson", "application/jsonl"):
+        source_format = "ndjson"
+    else:
+        raise HTTPException(status_code=400, detail="Upload a .zip of images or an .ndjson manifest")
+
+    final_key = get_api_key(api_key)
+    concurrency = min(max(1, concurrency or BATCH_CONCURRENCY), BATCH_MAX_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    source_path = await loop.run_in_executor(None, _spool_upload, file)
+
+    async def record_stream():
+        async for record in run_catalog_batch(
+            api_key=final_key,
+            source_path=source_path,
+            source_format=source_format,
+            operation=operation,
+            params=batch_params,
+            batch_id=batch_id,
+            concurrency=concurrency
+        ):
+            yield json.dumps(record) + "\n"
+
+    return _SpooledStreamingResponse(record_stream(), source_path, media_type="application/x-ndjson")
+
+# --- Background Jobs ---
+# Long generations run on the job manager's worker pool using the upstream
+# asynchronous mode (sync=False); we poll the result URLs server-side so the
+# client only holds a short request open.
+
+async def _await_results(result: Dict[str, Any]) -> Dict[str, Any]:
+    await wait_for_urls(extract_result_urls(result), JOB_POLL_INTERVAL, JOB_POLL_TIMEOUT)
+    return result
+
+async def _job_generate_image(params: Dict[str, Any], files: Dict[str, BinaryIO], api_key: str) -> Dict[str, Any]:
+    result = await generate_hd_image_async(
+        api_key=api_key,
+        num_results=params.get("num_results", 1),
+        aspect_ratio=params.get("aspect_ratio", "1:1"),
+        sync=False,
+        prompt_enhancement=False,
+        content_moderation=True,
+        **hd_image_options(params.get("style", "Realistic"), params["prompt"], params.get("enhance_image", True))
+    )
+    return await _await_results(result)
+
+async def _job_lifestyle_text(params: Dict[str, Any], files: Dict[str, BinaryIO], api_key: str) -> Dict[str, Any]:
+    result = await lifestyle_shot_by_text_async(
+        api_key=api_key,
+        image_data=files["file"],
+        scene_description=params["scene_description"],
+        placement_type=params.get("placement_type", "original"),
+        num_results=params.get("num_results", 1),
+        sync=False,
+        manual_placement_selection=parse_positions(params.get("manual_positions")),
+        force_rmbg=True,
+        sku=params.get("sku")
+    )
+    return await _await_results(result)
+
+async def _job_lifestyle_image(params: Dict[str, Any], files: Dict[str, BinaryIO], api_key: str) -> Dict[str, Any]:
+    result = await lifestyle_shot_by_image_async(
+        api_key=api_key,
+        image_data=files["file"],
+        reference_image=files["ref_file"],
+        placement_type=params.get("placement_type", "original"),
+        num_results=params.get("num_results", 1),
+        sync=False,
+        manual_placement_selection=parse_positions(params.get("manual_positions")),
+        force_rmbg=True,
+        enhance_ref_image=True,
+        ref_image_influence=params.get("ref_image_influence", 0.6),
+        sku=params.get("sku")
+    )
+    return await _await_results(result)
+
+async def _job_generative_fill(params: Dict[str, Any], files: Dict[str, BinaryIO], api_key: str) -> Dict[str, Any]:
+    result = await generative_fill_masked_async(
+        api_key=api_key,
+        image_data=files["file"],
+        mask_data=files["mask_file"],
+        prompt=params["prompt"],
+        num_results=params.get("num_results", 1),
+        sync=False,
+        seed=params.get("seed")
+    )
+    return await _await_results(result)
+
+job_manager.register("generate-image", _job_generate_image)
+job_manager.register("lifestyle-text", _job_lifestyle_text)
+job_manager.register("lifestyle-image", _job_lifestyle_image)
+job_manager.register("generative-fill", _job_generative_fill)
+
+# Uploads each operation needs, and the params it cannot do without
+JOB_REQUIREMENTS = {
+    "generate-image": ([], ["prompt"]),
+    "lifestyle-text": (["file"], ["scene_description"]),
+    "lifestyle-image": (["file", "ref_file"], []),
+    "generative-fill": (["file", "mask_file"], ["prompt"]),
+}
+
+@app.post("/jobs", status_code=202)
+async def api_submit_job(
+    operation: str = Form(...),
+    params: str = Form("{}"), # JSON object with the operation's fields
+    api_key: Optional[str] = Form(None),
+    file: Optional[UploadFile] = File(None),
+    ref_file: Optional[UploadFile] = File(None),
+    mask_file: Optional[UploadFile] = File(None)
+):
+    """
+    Queue a long-running generation and return its job ID immediately.
+    """
+    if operation not in JOB_REQUIREMENTS:
+        raise HTTPException(status_code=400, detail=f"Unknown operation '{operation}'. Expected one of: {', '.join(JOB_REQUIREMENTS)}")
+    try:
+        job_params = json.loads(params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+    if not isinstance(job_params, dict):
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+
+    uploads = {"file": file, "ref_file": ref_file, "mask_file": mask_file}
+    required_files, required_params = JOB_REQUIREMENTS[operation]
+    missing = [name for name in required_files if uploads[name] is None]
+    missing += [name for name in required_params if not job_params.get(name)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing fields for '{operation}': {', '.join(missing)}")
+
+    final_key = get_api_key(api_key)
+    files = {name: uploads[name].file for name in required_files}
+    try:
+        job = await job_manager.submit(operation, job_params, final_key, files)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {
+        "id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+def _job_view(job, request: Request) -> Dict[str, Any]:
+    view = job.to_dict()
+    view["result"] = published(view["result"], request)
+    return view
+
+@app.get("/jobs/{job_id}")
+async def api_get_job(job_id: str, request: Request):
+    """
+    Current status of a job, with its result once it has finished.
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_view(job, request)
+
+@app.get("/jobs/{job_id}/events")
+async def api_job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events stream of a job's status until it finishes.
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        seen_version = -1
+        while True:
+            if await job_manager.wait_for_update(job, seen_version, timeout=15):
+                seen_version = job.version
+                yield f"event: {job.status}\ndata: {json.dumps(_job_view(job, request))}\n\n"
+                if job.done:
+                    return
+            else:
+                # Keep proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# --- Assets ---
+# Result images downloaded by the asset store. Content never changes for a
+# given ID, so responses are cacheable forever by browsers and CDNs.
+
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@app.api_route("/assets/{asset_id}", methods=["GET", "HEAD"])
+async def api_get_asset(asset_id: str, request: Request):
+    """
+    Serve a stored result image, with a strong ETag and byte-range support.
+    """
+    ref = await asset_store.open(asset_id) if ASSET_ID.fullmatch(asset_id) else None
+    if ref is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    if "sha256" not in ref:
+        # Could not be downloaded (yet): send the client to the upstream copy
+        return RedirectResponse(ref["source"], status_code=307, headers={"Cache-Control": "no-store"})
+
+    size = ref["size"]
+    etag = f'"{ref["sha256"]}"'
+    headers = {"ETag": etag, "Cache-Control": ASSET_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    content = b"" if request.method == "HEAD" or size == 0 else await asset_store.read(ref, start, end)
+    return Response(content=content, status_code=status_code, headers=headers, media_type=ref["content_type"])
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    reset_multiprocess_metrics()
+    # Worker processes are started from the import string; WEB_CONCURRENCY sets how many
+    uvicorn.run("api:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")), workers=API_WORKERS)
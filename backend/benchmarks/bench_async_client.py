@@ -0,0 +1,63 @@
+"""
+Concurrent throughput of the blocking vs. asyncio service path.
+
+Fires ``--requests`` packshot calls at once from a single event loop against
+the mock Bria server. The "blocking" mode calls the sync service function
+inside a coroutine, which is what the API handlers used to do; the "async"
+mode awaits the ``*_async`` variant.
+
+    cd backend && python -m benchmarks.bench_async_client --requests 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_bria import start_mock_server
+
+IMAGE = b"\x89PNG\r\n\x1a\n" + os.urandom(64 * 1024)
+
+
+async def _run(mode: str, requests: int) -> float:
+    from services import create_packshot, create_packshot_async
+
+    async def blocking_call():
+        return create_packshot("bench-key", IMAGE)
+
+    async def async_call():
+        return await create_packshot_async("bench-key", IMAGE)
+
+    call = blocking_call if mode == "blocking" else async_call
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="mock upstream latency in seconds")
+    args = parser.parse_args()
+
+    # Must be set before the services import their configuration
+    os.environ["BRIA_API_BASE"] = start_mock_server(latency=args.latency)
+    # Keep per-request logging out of the measurements
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Every call sends the same image from one tenant: measure the client, not
+    # the cache, request coalescing or the per-tenant concurrency cap
+    os.environ["RESULT_CACHE_ENABLED"] = "false"
+    os.environ["SINGLE_FLIGHT_ENABLED"] = "false"
+    os.environ["SCHEDULER_MAX_CONCURRENCY"] = "0"
+
+    results = {mode: asyncio.run(_run(mode, args.requests)) for mode in ("blocking", "async")}
+
+    print(f"{args.requests} requests, upstream latency {args.latency * 1000:.0f} ms")
+    for mode, elapsed in results.items():
+        print(f"  {mode:<9} {elapsed:8.2f} s  {args.requests / elapsed:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
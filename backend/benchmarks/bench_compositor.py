@@ -0,0 +1,92 @@
+"""
+Latency of the local compositor vs. the remote engine.
+
+Renders ``--requests`` packshots, regular shadows and float shadows of a
+synthetic RGBA product with ``engine="local"`` and with ``engine="remote"``
+against the mock Bria server, one call at a time, and prints the median and
+95th percentile per operation. The remote figures are the mock's latency
+plus our request overhead; real Bria calls take seconds.
+
+    cd backend && python -m benchmarks.bench_compositor --size 1000 --latency 0.5
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_bria import start_mock_server
+
+
+def _product(size: int) -> bytes:
+    """A soft-edged RGBA bottle shape on transparency."""
+    import numpy as np
+    from PIL import Image, ImageFilter
+
+    y, x = np.ogrid[:size, :size]
+    body = ((x - size / 2) / (size * 0.22)) ** 2 + ((y - size * 0.58) / (size * 0.32)) ** 2 <= 1
+    neck = (abs(x - size / 2) < size * 0.06) & (y > size * 0.12) & (y < size * 0.3)
+    alpha = Image.fromarray(((body | neck) * 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(1.5))
+    rgb = np.zeros((size, size, 3), dtype=np.uint8)
+    rgb[..., 0] = (x * 200 // size).astype(np.uint8)
+    rgb[..., 1] = 90
+    rgb[..., 2] = (y * 200 // size).astype(np.uint8)
+    image = Image.fromarray(rgb)
+    image.putalpha(alpha)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def _run(engine: str, image: bytes, requests: int):
+    from services import add_shadow_async, create_packshot_async
+
+    operations = {
+        "packshot": lambda: create_packshot_async("bench-key", image, background_color="#F4F4F4", engine=engine),
+        "shadow": lambda: add_shadow_async("bench-key", image, shadow_type="regular", shadow_blur=20, engine=engine),
+        "float-shadow": lambda: add_shadow_async(
+            "bench-key", image, shadow_type="float", shadow_width=10, shadow_height=70, engine=engine
+        ),
+    }
+    timings = {}
+    for name, call in operations.items():
+        await call()  # warm-up: imports, connection pool
+        samples = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            await call()
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[name] = samples
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--size", type=int, default=1500, help="side of the product image in pixels")
+    parser.add_argument("--latency", type=float, default=1.0, help="mock upstream latency in seconds")
+    args = parser.parse_args()
+
+    # Must be set before the services import their configuration
+    os.environ["BRIA_API_BASE"] = start_mock_server(latency=args.latency)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Every call sends the same image: measure the engines, not the result cache
+    os.environ["RESULT_CACHE_ENABLED"] = "false"
+    os.environ["SINGLE_FLIGHT_ENABLED"] = "false"
+
+    image = _product(args.size)
+    print(f"{args.size}x{args.size} RGBA product, {args.requests} calls per operation, "
+          f"mock upstream latency {args.latency * 1000:.0f} ms")
+    print(f"  {'operation':<13} {'engine':<7} {'p50 ms':>9} {'p95 ms':>9}")
+    for engine in ("local", "remote"):
+        for name, samples in asyncio.run(_run(engine, image, args.requests)).items():
+            p95 = statistics.quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0]
+            print(f"  {name:<13} {engine:<7} {statistics.median(samples):9.1f} {p95:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
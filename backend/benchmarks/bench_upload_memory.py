@@ -0,0 +1,76 @@
+"""
+Peak memory of building an upstream request body for one uploaded image.
+
+Compares the previous approach (read the upload, base64 it into the payload
+dict, let the HTTP client serialize the dict to JSON) with the streaming
+encoder in ``core.payload``, using tracemalloc on a spooled upload.
+
+    cd backend && python -m benchmarks.bench_upload_memory --size-mb 20
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.payload import iter_json_body, json_body_length
+
+
+def _spooled_upload(size: int) -> tempfile.SpooledTemporaryFile:
+    # Same spooling FastAPI uses for UploadFile (rolls over to disk at 1 MB)
+    upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    chunk = os.urandom(1024 * 1024)
+    for _ in range(size // len(chunk)):
+        upload.write(chunk)
+    upload.seek(0)
+    return upload
+
+
+def _buffered(upload) -> int:
+    image_data = upload.read()
+    data = {"file": base64.b64encode(image_data).decode("utf-8"), "sync": True}
+    body = json.dumps(data).encode("utf-8")
+    return len(body)
+
+
+def _streamed(upload) -> int:
+    data = {"file": upload, "sync": True}
+
+    async def consume() -> int:
+        sent = 0
+        async for chunk in iter_json_body(data):
+            sent += len(chunk)
+        return sent
+
+    sent = asyncio.run(consume())
+    assert sent == json_body_length(data)
+    return sent
+
+
+def _measure(fn, upload) -> float:
+    tracemalloc.start()
+    fn(upload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{args.size_mb} MB upload, peak allocations while building the request body")
+    for name, fn in (("buffered", _buffered), ("streamed", _streamed)):
+        upload = _spooled_upload(args.size_mb * 1024 * 1024)
+        print(f"  {name:<9} {_measure(fn, upload):8.1f} MB")
+        upload.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Minimal stand-in for the Bria engine, used by the benchmarks.
+
+Every route takes ``latency`` seconds and answers with a response shaped like
+the real API, so the services can be exercised without an API key.
+
+    python -m benchmarks.mock_bria --port 9000 --latency 0.5
+"""
+import argparse
+import asyncio
+import io
+import socket
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from PIL import Image
+
+
+def _png(size: int = 64) -> bytes:
+    buffer = io.BytesIO()
+    # A product on transparency, so results also work as background-removal cutouts
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    image.paste((200, 120, 40, 255), (size // 8, size // 8, size - size // 8, size - size // 8))
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def create_mock_app(latency: float = 0.5) -> FastAPI:
+    """
+    Build the mock engine. Requests with ``sync: false`` return immediately
+    and their result URLs only start answering once ``latency`` has passed,
+    like the real asynchronous mode.
+    """
+    app = FastAPI(title="Mock Bria")
+    result_png = _png()
+    ready_at = {}
+
+    def _result_url(request: Request, available_at: float) -> str:
+        name = f"{uuid.uuid4().hex}.png"
+        ready_at[name] = available_at
+        return f"{request.base_url}results/{name}"
+
+    async def _respond(request: Request, shape: str):
+        body = await request.json()
+        if body.get("sync", True) is False:
+            available_at = time.monotonic() + latency
+        else:
+            await asyncio.sleep(latency)
+            available_at = 0.0
+        num_results = int(body.get("num_results", 1))
+        if shape == "prompt":
+            return {"prompt variations": f"{body.get('prompt', '')}, highly detailed"}
+        if shape == "urls":
+            return {"urls": [_result_url(request, available_at) for _ in range(num_results)]}
+        if shape == "hd":
+            return {"result": [{"urls": [_result_url(request, available_at)], "seed": i} for i in range(num_results)]}
+        if shape == "lifestyle":
+            return {"result": [[_result_url(request, available_at), i, body.get("sku")] for i in range(num_results)]}
+        return {"result_url": _result_url(request, available_at)}
+
+    @app.post("/v1/product/packshot")
+    async def packshot(request: Request):
+        return await _respond(request, "single")
+
+    @app.post("/v1/product/shadow")
+    async def shadow(request: Request):
+        return await _respond(request, "single")
+
+    @app.post("/v1/erase_foreground")
+    async def erase(request: Request):
+        return await _respond(request, "single")
+
+    @app.post("/v1/background/remove")
+    async def remove_background(request: Request):
+        return await _respond(request, "single")
+
+    @app.post("/v1/gen_fill")
+    async def gen_fill(request: Request):
+        return await _respond(request, "urls")
+
+    @app.post("/v1/text-to-image/hd/{model_version}")
+    async def hd(model_version: str, request: Request):
+        return await _respond(request, "hd")
+
+    @app.post("/v1/product/lifestyle_shot_by_text")
+    async def lifestyle_text(request: Request):
+        return await _respond(request, "lifestyle")
+
+    @app.post("/v1/product/lifestyle_shot_by_image")
+    async def lifestyle_image(request: Request):
+        return await _respond(request, "lifestyle")
+
+    @app.post("/v1/prompt_enhancer")
+    async def prompt_enhancer(request: Request):
+        return await _respond(request, "prompt")
+
+    @app.api_route("/results/{name}", methods=["GET", "HEAD"])
+    async def result(name: str):
+        available_at = ready_at.get(name)
+        if available_at is None or time.monotonic() < available_at:
+            return Response(status_code=404)
+        return Response(result_png, media_type="image/png")
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(latency: float = 0.5, port: int = 0) -> str:
+    """Start the mock server on a background thread and return its base URL."""
+    port = port or _free_port()
+    config = uvicorn.Config(create_mock_app(latency), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    uvicorn.run(create_mock_app(args.latency), host="127.0.0.1", port=args.port)
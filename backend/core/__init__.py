@@ -0,0 +1 @@
+"""Shared infrastructure used by the API, services and workflows."""
@@ -0,0 +1,434 @@
+"""
+Local copies of generated images, served from ``/assets/{asset_id}``.
+
+Upstream result URLs expire and are fetched again on every view. With
+``ASSET_STORE_ENABLED``, ``publish`` rewrites the URLs of a response to our
+own asset route and downloads the images in the background. Images are
+stored content-addressed (``blobs/<sha256>``), in a local directory or an
+S3-compatible bucket. A small ref (``refs/<asset_id>.json``) maps each asset
+to its blob. The asset ID is derived from the upstream URL, so the rewritten
+URL can be returned before the download has finished. An asset requested
+before then waits for the download, or is redirected upstream if it fails.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .config import (
+    ASSET_STORE_BACKEND,
+    ASSET_STORE_DIR,
+    ASSET_STORE_ENABLED,
+    ASSET_STORE_S3_BUCKET,
+    ASSET_STORE_S3_ENDPOINT,
+    ASSET_STORE_S3_PREFIX,
+)
+from .http import stream_get
+from .log import get_logger
+from .results import from_data_url, map_result_urls
+from .singleflight import SingleFlight
+from .tracing import span
+
+logger = get_logger(__name__)
+
+ASSET_ID = re.compile(r"[0-9a-f]{32}")
+
+# Downloads are written to their staging file in batches of about this size
+STAGE_WRITE_BYTES = 1024 * 1024
+
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_content_type(data: bytes) -> str:
+    for signature, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class LocalAssetStore:
+    """Blobs and refs as files under ``root``; writes are atomic renames."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    def _ref_path(self, asset_id: str) -> str:
+        return os.path.join(self.root, "refs", f"{asset_id}.json")
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def has_blob(self, sha256: str) -> bool:
+        return os.path.exists(self._blob_path(sha256))
+
+    def put_blob(self, sha256: str, data: bytes, content_type: str) -> None:
+        self._write(self._blob_path(sha256), data)
+
+    def staging_dir(self) -> str:
+        # Same filesystem as the blobs, so a staged download is moved in with a rename
+        path = os.path.join(self.root, "blobs")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def put_blob_file(self, sha256: str, path: str, content_type: str) -> None:
+        """Move a staged file into place as the blob ``sha256``."""
+        blob_path = self._blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(path, blob_path)
+
+    def read_blob(self, sha256: str, start: int, end: int) -> bytes:
+        with open(self._blob_path(sha256), "rb") as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def get_ref(self, asset_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._ref_path(asset_id), "rb") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put_ref(self, asset_id: str, ref: Dict[str, Any]) -> None:
+        self._write(self._ref_path(asset_id), json.dumps(ref).encode("utf-8"))
+
+
+class S3AssetStore:
+    """The same layout in an S3-compatible bucket (AWS, MinIO...); needs boto3."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        # Credentials and region come from the usual AWS_* variables
+        self._client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self._client_error = ClientError
+
+    def _missing(self, error: Exception) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def has_blob(self, sha256: str) -> bool:
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=f"{self.prefix}blobs/{sha256}")
+            return True
+        except self._client_error as e:
+            if self._missing(e):
+                return False
+            raise
+
+    def put_blob(self, sha256: str, data: bytes, content_type: str) -> None:
+        self._client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}blobs/{sha256}",
+            Body=data,
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable",
+        )
+
+    def staging_dir(self) -> Optional[str]:
+        return None
+
+    def put_blob_file(self, sha256: str, path: str, content_type: str) -> None:
+        """Upload a staged file (in parts when large) as the blob ``sha256``."""
+        self._client.upload_file(
+            path,
+            self.bucket,
+            f"{self.prefix}blobs/{sha256}",
+            ExtraArgs={"ContentType": content_type, "CacheControl": "public, max-age=31536000, immutable"},
+        )
+
+    def read_blob(self, sha256: str, start: int, end: int) -> bytes:
+        response = self._client.get_object(
+            Bucket=self.bucket, Key=f"{self.prefix}blobs/{sha256}", Range=f"bytes={start}-{end}"
+        )
+        return response["Body"].read()
+
+    def get_ref(self, asset_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=f"{self.prefix}refs/{asset_id}.json")
+        except self._client_error as e:
+            if self._missing(e):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def put_ref(self, asset_id: str, ref: Dict[str, Any]) -> None:
+        self._client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}refs/{asset_id}.json",
+            Body=json.dumps(ref).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+
+class AssetStore:
+    """Rewrites result URLs and materializes them into a backend store."""
+
+    def __init__(self, backend: Any = None, max_known: int = 4096):
+        self.backend = backend
+        self.max_known = max_known
+        # Refs of stored assets never change, so they can be kept in memory
+        self._known: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Assets published by this process whose download has not finished
+        self._sources: Dict[str, str] = {}
+        self._downloads = SingleFlight()
+        self._background: set = set()
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.bytes_stored = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @staticmethod
+    def asset_id(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+    def publish(self, payload: Any, base_url: str) -> Any:
+        """
+        Return a copy of ``payload`` with every upstream URL pointing at
+        ``{base_url}/assets/{asset_id}``, and start downloading those URLs.
+        Images inlined as ``data:`` URLs (local results) are stored the same way.
+        """
+        if not self.enabled or payload is None:
+            return payload
+        prefix = base_url.rstrip("/") + "/assets/"
+
+        def rewrite(url: str) -> str:
+            if url.startswith(prefix):
+                return url
+            asset_id = self.asset_id(url)
+            self._schedule(asset_id, url)
+            return prefix + asset_id
+
+        return map_result_urls(payload, rewrite, ("http://", "https://", "data:"))
+
+    def _schedule(self, asset_id: str, url: str) -> None:
+        with self._lock:
+            if asset_id in self._known or asset_id in self._sources:
+                return
+            self._sources[asset_id] = url
+        task = asyncio.get_running_loop().create_task(self._materialize(asset_id, url))
+        # Keep a reference until done, the loop only holds weak ones
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _materialize(self, asset_id: str, url: str) -> None:
+        try:
+            await self._downloads.do(asset_id, lambda: self._download(asset_id, url))
+        except Exception as e:
+            logger.warning("assets.download_failed", asset_id=asset_id, error=str(e))
+        finally:
+            with self._lock:
+                self._sources.pop(asset_id, None)
+
+    async def _download(self, asset_id: str, url: str) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        with span("assets.materialize", **{"asset.id": asset_id}) as current:
+            ref = await loop.run_in_executor(None, self.backend.get_ref, asset_id)
+            if ref and ref.get("sha256"):
+                self._remember(asset_id, ref)
+                return ref
+            staged = None
+            if url.startswith("data:"):
+                # Local results carry their bytes, no base64 to decode
+                data = from_data_url(url)
+                sha256, size, content_type = hashlib.sha256(data).hexdigest(), len(data), sniff_content_type(data)
+            else:
+                if ref is None:
+                    # Lets another worker (or this one after a restart) finish the job
+                    await loop.run_in_executor(None, self.backend.put_ref, asset_id, {"source": url})
+                try:
+                    staged, sha256, size, content_type = await self._stage(url)
+                except Exception:
+                    with self._lock:
+                        self.failed += 1
+                    raise
+            try:
+                if await loop.run_in_executor(None, self.backend.has_blob, sha256):
+                    with self._lock:
+                        self.deduplicated += 1
+                else:
+                    if staged is None:
+                        await loop.run_in_executor(None, self.backend.put_blob, sha256, data, content_type)
+                    else:
+                        await loop.run_in_executor(None, self.backend.put_blob_file, sha256, staged, content_type)
+                    with self._lock:
+                        self.stored += 1
+                        self.bytes_stored += size
+            finally:
+                # Moved into place by a local store, copied by a bucket
+                if staged is not None and os.path.exists(staged):
+                    os.remove(staged)
+            ref = {
+                # Inlined images have no upstream copy to point back to
+                "source": "" if url.startswith("data:") else url,
+                "sha256": sha256,
+                "size": size,
+                "content_type": content_type,
+                "stored_at": time.time(),
+            }
+            await loop.run_in_executor(None, self.backend.put_ref, asset_id, ref)
+            current.set_attribute("asset.size", size)
+        self._remember(asset_id, ref)
+        return ref
+
+    async def _stage(self, url: str) -> Tuple[str, str, int, str]:
+        """
+        Download ``url`` into a staging file chunk by chunk, hashing as it
+        arrives, so a large image is never held in memory whole. Returns the
+        file's path, SHA-256, size and content type.
+        """
+        loop = asyncio.get_running_loop()
+        fd, path = tempfile.mkstemp(dir=self.backend.staging_dir(), prefix=".download-")
+        digest = hashlib.sha256()
+        head = b""
+        size = 0
+        pending = bytearray()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async with stream_get(url) as response:
+                    async for chunk in response.aiter_bytes():
+                        digest.update(chunk)
+                        if len(head) < 16:
+                            head += chunk[:16]
+                        size += len(chunk)
+                        pending += chunk
+                        # Network chunks are small: write in batches to spare thread hand-offs
+                        if len(pending) >= STAGE_WRITE_BYTES:
+                            await loop.run_in_executor(None, f.write, pending)
+                            pending = bytearray()
+                if pending:
+                    await loop.run_in_executor(None, f.write, pending)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, digest.hexdigest(), size, sniff_content_type(head)
+
+    def _remember(self, asset_id: str, ref: Dict[str, Any]) -> None:
+        with self._lock:
+            self._known[asset_id] = ref
+            self._known.move_to_end(asset_id)
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+
+    async def open(self, asset_id: str) -> Optional[Dict[str, Any]]:
+        """
+        The ref of an asset, waiting for its download if needed. None for an
+        unknown asset; a ref without ``sha256`` if the download failed.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            ref = self._known.get(asset_id)
+            source = self._sources.get(asset_id)
+        if ref is not None:
+            return ref
+        if source is None:
+            ref = await asyncio.get_running_loop().run_in_executor(None, self.backend.get_ref, asset_id)
+            if ref is None:
+                return None
+            if ref.get("sha256"):
+                self._remember(asset_id, ref)
+                return ref
+            source = ref["source"]
+        try:
+            return await self._downloads.do(asset_id, lambda: self._download(asset_id, source))
+        except Exception as e:
+            logger.warning("assets.download_failed", asset_id=asset_id, error=str(e))
+            return {"source": source} if source.startswith(("http://", "https://")) else None
+
+    async def read(self, ref: Dict[str, Any], start: int, end: int) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(None, self.backend.read_blob, ref["sha256"], start, end)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stored": self.stored,
+                "deduplicated": self.deduplicated,
+                "failed": self.failed,
+                "bytes_stored": self.bytes_stored,
+                "pending": len(self._sources),
+            }
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches ``etag``."""
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The inclusive byte range asked for by a Range header, None to send the
+    whole body. Raises ValueError for a range that cannot be satisfied.
+    Only single ranges are honoured; multipart ranges get the whole body.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, separator, last = header[len("bytes="):].strip().partition("-")
+    # Malformed ranges are ignored rather than rejected (RFC 9110, 14.2)
+    if not separator or not (first or last) or not (first.isdigit() or not first) or not (last.isdigit() or not last):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError(f"range {header} not satisfiable for {size} bytes")
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(f"range {header} not satisfiable for {size} bytes")
+    return start, end
+
+
+def _create_backend() -> Any:
+    if not ASSET_STORE_ENABLED:
+        return None
+    if ASSET_STORE_BACKEND == "s3":
+        if not ASSET_STORE_S3_BUCKET:
+            logger.warning("assets.unavailable", detail="ASSET_STORE_BACKEND is s3 but ASSET_STORE_S3_BUCKET is not set, asset store is off")
+            return None
+        try:
+            return S3AssetStore(ASSET_STORE_S3_BUCKET, ASSET_STORE_S3_PREFIX, ASSET_STORE_S3_ENDPOINT)
+        except ImportError as e:
+            logger.warning("assets.unavailable", detail=f"ASSET_STORE_BACKEND is s3 but {e.name or e} is missing, asset store is off")
+            return None
+    return LocalAssetStore(ASSET_STORE_DIR)
+
+
+asset_store = AssetStore(_create_backend())
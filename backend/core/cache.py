@@ -0,0 +1,341 @@
+"""
+Content-addressed cache for deterministic upstream results.
+
+Entries are keyed by a SHA-256 of the endpoint URL, the caller's API key, the
+image bytes and the normalized request payload, so the same product photo
+sent with the same parameters under the same key maps to the same entry.
+Lookups go through an in-memory LRU first, the shared state backend (when
+configured, so all workers see each other's results) second and an on-disk
+JSON tier last; every tier honours a TTL, and the disk tier is trimmed
+oldest-first once it grows past its byte budget.
+
+Hashing an upload and touching the disk tier take milliseconds, so they run
+off the event loop: use ``request_key_async`` for payloads with images.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .config import (
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_MAX_DISK_BYTES,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_TTL,
+)
+from .cpu import cpu_pool
+from .log import get_logger
+from .payload import binary_digest, is_binary
+from .state import SharedState, StateError, shared_state
+
+logger = get_logger(__name__)
+
+
+def _normalize(value: Any) -> Any:
+    # Images are represented by their digest rather than their (base64) content
+    if is_binary(value):
+        return {"sha256": binary_digest(value)}
+    # 60 and 60.0 describe the same request; strip the float form so they hash alike
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def request_key(url: str, data: Dict[str, Any], api_key: str) -> str:
+    """
+    Return the cache key for a request to ``url`` with payload ``data``.
+
+    The API key is part of the key: a result is only served again to the
+    key that paid for it, and an unknown key always reaches upstream auth.
+    """
+    digest = hashlib.sha256(url.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(api_key.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(json.dumps(_normalize(data), sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return digest.hexdigest()
+
+
+async def request_key_async(url: str, data: Dict[str, Any], api_key: str) -> str:
+    """``request_key`` with the images of ``data`` hashed on the CPU pool's threads."""
+    if not any(is_binary(value) for value in data.values()):
+        return request_key(url, data, api_key)
+    return await cpu_pool.run_thread(request_key, url, data, api_key)
+
+
+class DiskStore:
+    """
+    One file per key under ``directory``, trimmed oldest-first once the
+    files pass ``max_bytes``.
+
+    Sizes are indexed by a single scan of the directory on first use and
+    kept current by writes and removals, so writes never walk the tree.
+    Every method does file I/O: call them off the event loop.
+    """
+
+    def __init__(self, directory: str, suffix: str, max_bytes: int):
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        # path -> size, oldest first
+        self._index: "Optional[OrderedDict[str, int]]" = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @property
+    def size(self) -> Optional[int]:
+        """Bytes on disk, or None before the first write has indexed the directory."""
+        return self._bytes if self._index is not None else None
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}{self.suffix}")
+
+    def _scan(self) -> "OrderedDict[str, int]":
+        if self._index is None:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(self.suffix):
+                        path = os.path.join(root, name)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue
+                        files.append((stat.st_mtime, path, stat.st_size))
+            files.sort()
+            self._index = OrderedDict((path, size) for _, path, size in files)
+            self._bytes = sum(self._index.values())
+        return self._index
+
+    def read(self, key: str, ttl: float, now: float) -> Optional[Tuple[float, bytes]]:
+        """``(stored_at, data)`` of a key written less than ``ttl`` seconds ago."""
+        path = self.path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > ttl:
+                self.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return stored_at, f.read()
+        except OSError:
+            return None
+
+    def write(self, key: str, data: bytes) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            index = self._scan()
+            self._bytes += len(data) - index.pop(path, 0)
+            index[path] = len(data)
+            if self._bytes > self.max_bytes:
+                self._trim()
+
+    def _trim(self) -> None:
+        # Drop the oldest files until we are comfortably under the budget
+        target = self.max_bytes * 0.9
+        while self._bytes > target and self._index:
+            path, size = self._index.popitem(last=False)
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed by another worker, or not ours to remove: stop tracking it either way
+                pass
+            self._bytes -= size
+            self.evictions += 1
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._index is not None:
+                self._bytes -= self._index.pop(path, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self._scan():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._index.clear()
+            self._bytes = 0
+
+
+class ResultCache:
+    """Tiered (memory LRU, shared state, disk) cache of JSON-serializable results."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        enabled: bool = True,
+        shared: Optional[SharedState] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = DiskStore(disk_dir, ".json", max_disk_bytes) if disk_dir else None
+        self.enabled = enabled
+        self.shared = shared
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    # --- Memory tier ---
+
+    def _memory_get(self, key: str, now: float) -> Optional[Any]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if now - stored_at > self.ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: Any, stored_at: float) -> None:
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    # --- Shared tier ---
+
+    async def _shared_get(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        try:
+            raw = await self.shared.get(f"result:{key}")
+        except StateError as e:
+            logger.warning("cache.shared_unavailable", error=str(e))
+            return None
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        if now - entry["stored_at"] > self.ttl:
+            return None
+        return entry["stored_at"], entry["value"]
+
+    async def _shared_set(self, key: str, value: Any, stored_at: float) -> None:
+        try:
+            await self.shared.set(f"result:{key}", json.dumps({"stored_at": stored_at, "value": value}).encode("utf-8"), self.ttl)
+        except (StateError, TypeError, ValueError) as e:
+            logger.warning("cache.shared_unavailable", error=str(e))
+
+    # --- Disk tier (runs on the default executor) ---
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        entry = self.disk.read(key, self.ttl, now)
+        if entry is None:
+            return None
+        try:
+            return entry[0], json.loads(entry[1])
+        except ValueError:
+            return None
+
+    def _disk_set(self, key: str, value: Any) -> None:
+        self.disk.write(key, json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+    # --- Public API ---
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for ``key`` or None on a miss."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            value = self._memory_get(key, now)
+            if value is not None:
+                self.hits += 1
+                self.memory_hits += 1
+                return value
+        # Outside the lock: a network round trip must not serialize lookups
+        if self.shared is not None:
+            entry = await self._shared_get(key, now)
+            if entry is not None:
+                stored_at, value = entry
+                with self._lock:
+                    self._memory_set(key, value, stored_at)
+                    self.hits += 1
+                    self.shared_hits += 1
+                return value
+        if self.disk is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self._disk_get, key, now)
+            if entry is not None:
+                stored_at, value = entry
+                with self._lock:
+                    self._memory_set(key, value, stored_at)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value under ``key`` in every tier."""
+        if not self.enabled:
+            return
+        stored_at = time.time()
+        if self.shared is not None:
+            await self._shared_set(key, value, stored_at)
+        with self._lock:
+            self._memory_set(key, value, stored_at)
+        if self.disk is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._disk_set, key, value)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning("cache.disk_write_failed", error=str(e))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "shared_hits": self.shared_hits,
+            "disk_hits": self.disk_hits,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions + (self.disk.evictions if self.disk is not None else 0),
+            "memory_entries": len(self._memory),
+            "disk_bytes": self.disk.size if self.disk is not None else None,
+        }
+
+
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    ttl=RESULT_CACHE_TTL,
+    disk_dir=RESULT_CACHE_DIR,
+    max_disk_bytes=RESULT_CACHE_MAX_DISK_BYTES,
+    enabled=RESULT_CACHE_ENABLED,
+    shared=shared_state,
+)
@@ -0,0 +1,200 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Base URL of the Bria engine. Override to point the services at a mock server.
+BRIA_API_BASE = os.getenv("BRIA_API_BASE", "https://engine.prod.bria-api.com").rstrip("/")
+
+# Generations can take tens of seconds, so the read timeout is generous.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("BRIA_HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("BRIA_HTTP_READ_TIMEOUT", "120"))
+
+# Connection pool shared by every service call (one pool per event loop)
+HTTP_MAX_CONNECTIONS = int(os.getenv("BRIA_HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("BRIA_HTTP_MAX_KEEPALIVE", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("BRIA_HTTP_KEEPALIVE_EXPIRY", "30"))
+# Cap on concurrent requests to a single host; 0 disables the cap
+HTTP_MAX_PER_HOST = int(os.getenv("BRIA_HTTP_MAX_PER_HOST", "100"))
+# HTTP/2 multiplexing needs the optional ``h2`` package (pip install httpx[http2])
+HTTP2_ENABLED = _env_bool("BRIA_HTTP2", False)
+
+# Identical deterministic calls in flight at the same time share one upstream request
+SINGLE_FLIGHT_ENABLED = _env_bool("SINGLE_FLIGHT_ENABLED", True)
+
+# Result cache for deterministic operations (packshot, shadow, seeded generations)
+RESULT_CACHE_ENABLED = _env_bool("RESULT_CACHE_ENABLED", True)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+# Empty string disables the on-disk tier
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(".cache", "results"))
+RESULT_CACHE_MAX_DISK_BYTES = int(os.getenv("RESULT_CACHE_MAX_DISK_MB", "256")) * 1024 * 1024
+
+# Prompt enhancement cache: in-memory front backed by SQLite (empty path keeps it in memory only)
+PROMPT_CACHE_ENABLED = _env_bool("PROMPT_CACHE_ENABLED", True)
+PROMPT_CACHE_PATH = os.getenv("PROMPT_CACHE_PATH", os.path.join(".cache", "prompts.sqlite3"))
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "10000"))
+# Seconds an enhancement stays valid; 0 keeps entries forever
+PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", "604800"))
+
+# Background job subsystem (POST /jobs)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "32"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "10000"))
+# Finished jobs are forgotten after this many seconds
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+# Uploaded inputs of queued jobs wait here instead of in memory
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", os.path.join(".cache", "jobs"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_POLL_TIMEOUT = float(os.getenv("JOB_POLL_TIMEOUT", "300"))
+
+# Workflow DAG executor (/workflows/ad-set)
+WORKFLOW_MAX_CONCURRENCY = int(os.getenv("WORKFLOW_MAX_CONCURRENCY", "4"))
+WORKFLOW_STEP_TIMEOUT = float(os.getenv("WORKFLOW_STEP_TIMEOUT", "180"))
+
+# Catalog batches (/batch/catalog)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+# Upper bound on the concurrency a client may ask for
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "64"))
+# Per-batch checkpoint files used to resume an interrupted batch
+BATCH_CHECKPOINT_DIR = os.getenv("BATCH_CHECKPOINT_DIR", os.path.join(".cache", "batches"))
+
+# Structured logging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for log shippers, "text" for reading in a terminal
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Fraction of routine per-request events (sampled debug/info) that are written
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Longer string fields are truncated; binary values are never written
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "256"))
+
+# Retries, backoff and circuit breaking for upstream calls
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+# Retries may add at most this fraction of extra load over RETRY_BUDGET_WINDOW seconds...
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_WINDOW = float(os.getenv("RETRY_BUDGET_WINDOW", "10"))
+# ...but this many retries per window are always allowed
+RETRY_BUDGET_MIN = int(os.getenv("RETRY_BUDGET_MIN", "10"))
+# Consecutive failures that open an endpoint's breaker, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Upload pre-processing (EXIF-aware downscale, lossless re-encode, 1-bit masks)
+PREPROCESS_ENABLED = _env_bool("PREPROCESS_ENABLED", True)
+PREPROCESS_MAX_SIDE = int(os.getenv("PREPROCESS_MAX_SIDE", "2048"))
+# webp and png are lossless, jpeg uses PREPROCESS_JPEG_QUALITY, auto keeps JPEG uploads JPEG
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "auto").lower()
+PREPROCESS_JPEG_QUALITY = int(os.getenv("PREPROCESS_JPEG_QUALITY", "95"))
+# JSON object of per-endpoint overrides, e.g. {"packshot": {"max_side": 1500}, "erase": {"enabled": false}}
+PREPROCESS_PROFILES = os.getenv("PREPROCESS_PROFILES", "{}")
+
+# Per-tenant, per-endpoint token buckets in front of the API (429 + Retry-After when empty)
+# Off by default: behind a proxy that uvicorn does not trust, anonymous clients all share its host's bucket
+RATE_LIMIT_ENABLED = _env_bool("RATE_LIMIT_ENABLED", False)
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "5"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+# JSON object of per-endpoint overrides, e.g. {"/generate-image": {"rate": 1, "burst": 5}}
+RATE_LIMITS = os.getenv("RATE_LIMITS", "{}")
+
+# Weighted fair-queueing of upstream calls across tenants; 0 disables the scheduler
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "64"))
+SCHEDULER_TENANT_CONCURRENCY = int(os.getenv("SCHEDULER_TENANT_CONCURRENCY", "16"))
+SCHEDULER_INTERACTIVE_WEIGHT = float(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", "8"))
+SCHEDULER_BATCH_WEIGHT = float(os.getenv("SCHEDULER_BATCH_WEIGHT", "1"))
+
+# Optional OpenTelemetry tracing (needs opentelemetry-sdk; OTLP export also needs
+# opentelemetry-exporter-otlp-proto-http, configured with the usual OTEL_EXPORTER_OTLP_* variables)
+TRACING_ENABLED = _env_bool("TRACING_ENABLED", False)
+# "otlp", "file" (one JSON span per line) or "console"
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "otlp").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", os.path.join(".cache", "traces.jsonl"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "visionary-api")
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+
+# Local copies of result images, served from /assets/{id} instead of the expiring upstream URLs
+ASSET_STORE_ENABLED = _env_bool("ASSET_STORE_ENABLED", False)
+# "local" (files under ASSET_STORE_DIR) or "s3" (any S3-compatible bucket, needs boto3;
+# credentials come from the usual AWS_* variables)
+ASSET_STORE_BACKEND = os.getenv("ASSET_STORE_BACKEND", "local").lower()
+ASSET_STORE_DIR = os.getenv("ASSET_STORE_DIR", os.path.join(".cache", "assets"))
+ASSET_STORE_S3_BUCKET = os.getenv("ASSET_STORE_S3_BUCKET", "")
+ASSET_STORE_S3_PREFIX = os.getenv("ASSET_STORE_S3_PREFIX", "")
+# e.g. http://localhost:9000 for MinIO
+ASSET_STORE_S3_ENDPOINT = os.getenv("ASSET_STORE_S3_ENDPOINT", "")
+# Public origin of the asset URLs (a CDN in front of the API); defaults to the request's own origin
+ASSET_BASE_URL = os.getenv("ASSET_BASE_URL", "")
+
+# Pool of Bria keys used when a request does not bring its own (comma separated;
+# BRIA_API_KEY is included). Each upstream call goes to the key with the most headroom.
+BRIA_API_KEYS = list(dict.fromkeys(
+    key.strip() for key in f"{os.getenv('BRIA_API_KEYS', '')},{os.getenv('BRIA_API_KEY', '')}".split(",") if key.strip()
+))
+# How long a key answering 401/403 is taken out of rotation
+KEY_POOL_QUARANTINE_TIME = float(os.getenv("KEY_POOL_QUARANTINE_TIME", "600"))
+# Cool-down after a 429 without Retry-After
+KEY_POOL_THROTTLE_COOLDOWN = float(os.getenv("KEY_POOL_THROTTLE_COOLDOWN", "5"))
+
+# Worker processes started by ``python api.py`` (uvicorn reads the same variable)
+API_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# State shared by all workers (jobs, result/prompt caches, rate limits): "memory"
+# keeps it per-process, "redis" shares it through REDIS_URL (needs the redis package)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "visionary:")
+# Seconds before a shared-state call gives up and the worker falls back to its own state
+STATE_TIMEOUT = float(os.getenv("STATE_TIMEOUT", "0.5"))
+# Seconds a worker keeps using its own state after a shared-state call fails
+STATE_COOLDOWN = float(os.getenv("STATE_COOLDOWN", "5"))
+
+# Local mask handling for generative fill and erase
+# Mask edges are grown by MASK_DILATE pixels and blended back over MASK_FEATHER pixels
+MASK_DILATE = int(os.getenv("MASK_DILATE", "4"))
+MASK_FEATHER = float(os.getenv("MASK_FEATHER", "6"))
+# Small masks send only a padded crop around them upstream and composite the result back
+MASK_CROP_ENABLED = _env_bool("MASK_CROP_ENABLED", True)
+# Crop only when the padded region is at most this fraction of the image
+MASK_CROP_MAX_AREA = float(os.getenv("MASK_CROP_MAX_AREA", "0.35"))
+# Context around the mask, as a fraction of the mask's larger side, and the smallest crop side
+MASK_CROP_PADDING = float(os.getenv("MASK_CROP_PADDING", "0.5"))
+MASK_CROP_MIN_SIDE = int(os.getenv("MASK_CROP_MIN_SIDE", "512"))
+
+# Outpainting (expansion_amount of generative fill)
+# Canvases up to this longest side are filled in one call, larger ones in tiles filled concurrently
+OUTPAINT_TILE_THRESHOLD = int(os.getenv("OUTPAINT_TILE_THRESHOLD", "2048"))
+OUTPAINT_TILE_SIZE = int(os.getenv("OUTPAINT_TILE_SIZE", "1024"))
+# Pixels of surrounding canvas sent with each tile as context
+OUTPAINT_TILE_CONTEXT = int(os.getenv("OUTPAINT_TILE_CONTEXT", "256"))
+OUTPAINT_MAX_SIDE = int(os.getenv("OUTPAINT_MAX_SIDE", "8192"))
+
+# Background-removed cutouts (RGBA PNG) keyed by image hash, reused by packshot, shadow and lifestyle
+CUTOUT_CACHE_ENABLED = _env_bool("CUTOUT_CACHE_ENABLED", True)
+CUTOUT_CACHE_TTL = float(os.getenv("CUTOUT_CACHE_TTL", "604800"))
+CUTOUT_CACHE_MAX_MEMORY_BYTES = int(os.getenv("CUTOUT_CACHE_MAX_MEMORY_MB", "128")) * 1024 * 1024
+# Empty disables the on-disk tier
+CUTOUT_CACHE_DIR = os.getenv("CUTOUT_CACHE_DIR", os.path.join(".cache", "cutouts"))
+CUTOUT_CACHE_MAX_DISK_BYTES = int(os.getenv("CUTOUT_CACHE_MAX_DISK_MB", "1024")) * 1024 * 1024
+
+# Engine for packshots and shadows when a request does not choose one:
+# remote (Bria), local (Pillow/NumPy compositor) or auto (local when the request allows it)
+COMPOSITOR_ENGINE = os.getenv("COMPOSITOR_ENGINE", "remote").strip().lower()
+
+# Pool for CPU-bound image work (pre-processing, local compositing, mask preparation):
+# "process" runs it in worker processes, free of the GIL; "thread" in a thread pool
+CPU_POOL_MODE = os.getenv("CPU_POOL_MODE", "process").strip().lower()
+# 0 shares the machine's cores between the API workers
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // max(1, API_WORKERS))
+# Tasks admitted to the pool at once (running or queued); later callers wait. 0 means twice the workers
+CPU_POOL_MAX_PENDING = int(os.getenv("CPU_POOL_MAX_PENDING", "0")) or 2 * CPU_POOL_WORKERS
+# Buffers at least this large cross to worker processes through shared memory instead of a pipe
+CPU_POOL_SHM_MIN_BYTES = int(os.getenv("CPU_POOL_SHM_MIN_KB", "64")) * 1024
+
+# Fan-out of num_results: larger requests are split into concurrent upstream calls with their own seeds
+FANOUT_MAX_RESULTS = int(os.getenv("FANOUT_MAX_RESULTS", "16"))
+# Images per upstream call when results are streamed (1 gives the earliest first image)
+FANOUT_RESULTS_PER_CALL = int(os.getenv("FANOUT_RESULTS_PER_CALL", "1"))
@@ -0,0 +1,299 @@
+"""
+Managed pool for CPU-bound image work.
+
+Decoding, resizing, compositing and re-encoding images hold the GIL for
+long stretches, so running them on the event loop's default thread pool
+makes concurrent requests contend for one core. ``cpu_pool`` runs them in
+``CPU_POOL_WORKERS`` worker processes instead (``CPU_POOL_MODE=process``),
+or in a dedicated thread pool (``CPU_POOL_MODE=thread``).
+
+Functions sent to worker processes must be importable module-level
+functions. Image buffers among their arguments (bytes or file objects) and
+in their results (bytes, or bytes inside a returned tuple or list) cross the
+process boundary through ``multiprocessing.shared_memory`` once they reach
+``CPU_POOL_SHM_MIN_BYTES``, rather than being pickled through a pipe.
+Work on objects that only live in this process (decoded images, mask
+plans) goes through ``run_thread``, which shares the pool's limits.
+
+At most ``CPU_POOL_MAX_PENDING`` tasks are handed to the pool at once;
+further callers wait for a slot without holding a thread, so a burst of
+uploads queues in the API instead of piling up in the executor.
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+import weakref
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from .config import CPU_POOL_MAX_PENDING, CPU_POOL_MODE, CPU_POOL_SHM_MIN_BYTES, CPU_POOL_WORKERS
+from .log import get_logger
+from .payload import binary_size, is_binary, iter_binary
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+MODES = ("process", "thread")
+
+
+class _Shared:
+    """A buffer left in a named shared memory segment, in place of its bytes."""
+
+    __slots__ = ("name", "size")
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+    def __getstate__(self):
+        return self.name, self.size
+
+    def __setstate__(self, state):
+        self.name, self.size = state
+
+
+def _share(value: Any, segments: List[shared_memory.SharedMemory], min_bytes: int) -> Any:
+    """Copy a large buffer into a new shared memory segment; file objects become bytes."""
+    if not is_binary(value):
+        return value
+    size = binary_size(value)
+    if size < min_bytes or size == 0:
+        return value if isinstance(value, bytes) else b"".join(iter_binary(value))
+    segment = shared_memory.SharedMemory(create=True, size=size)
+    segments.append(segment)
+    offset = 0
+    for chunk in iter_binary(value):
+        segment.buf[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    return _Shared(segment.name, size)
+
+
+def _take(value: Any) -> Any:
+    """The bytes behind a ``_Shared`` reference; anything else as is."""
+    if not isinstance(value, _Shared):
+        return value
+    segment = shared_memory.SharedMemory(name=value.name)
+    try:
+        return bytes(segment.buf[:value.size])
+    finally:
+        segment.close()
+
+
+def _share_result(value: Any, min_bytes: int) -> Any:
+    """In a worker: move large bytes of a result (or of a returned tuple/list) to shared memory."""
+    if isinstance(value, (tuple, list)):
+        return type(value)(_share_result(item, min_bytes) for item in value)
+    if not isinstance(value, (bytes, bytearray)) or len(value) < min_bytes:
+        return value
+    segment = shared_memory.SharedMemory(create=True, size=len(value))
+    try:
+        segment.buf[:len(value)] = value
+        return _Shared(segment.name, len(value))
+    finally:
+        # The caller unlinks it once read
+        segment.close()
+
+
+def _take_result(value: Any) -> Any:
+    """In the API process: read back and unlink the segments of a worker's result."""
+    if isinstance(value, (tuple, list)):
+        return type(value)(_take_result(item) for item in value)
+    if not isinstance(value, _Shared):
+        return value
+    segment = shared_memory.SharedMemory(name=value.name)
+    try:
+        return bytes(segment.buf[:value.size])
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def _discard(future: "concurrent.futures.Future") -> None:
+    if not future.cancelled() and future.exception() is None:
+        _take_result(future.result())
+
+
+def _invoke(fn: Callable[..., Any], args: Tuple[Any, ...], kwargs: Dict[str, Any], min_bytes: int) -> Any:
+    """Entry point in a worker process."""
+    args = tuple(_take(arg) for arg in args)
+    kwargs = {name: _take(value) for name, value in kwargs.items()}
+    return _share_result(fn(*args, **kwargs), min_bytes)
+
+
+class CpuPool:
+    def __init__(
+        self,
+        mode: str = "process",
+        workers: int = 1,
+        max_pending: int = 2,
+        shm_min_bytes: int = 64 * 1024
+    ):
+        if mode not in MODES:
+            logger.warning("cpu_pool.unknown_mode", mode=mode, detail="using threads")
+            mode = "thread"
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.shm_min_bytes = shm_min_bytes
+        self._processes: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._threads: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        # Semaphores are bound to their loop, so the limit applies per event loop
+        self._slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.tasks = 0
+        self.running = 0
+        self.waiting = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.shared_bytes = 0
+        self.restarts = 0
+
+    def _process_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._processes is None:
+                # Forking a process that runs an event loop and client threads is unsafe
+                self._processes = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._processes
+
+    def _thread_pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._threads is None:
+                self._threads = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu")
+            return self._threads
+
+    async def _slot(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots.setdefault(loop, asyncio.Semaphore(self.max_pending))
+        if slots.locked():
+            start = time.perf_counter()
+            with self._lock:
+                self.waiting += 1
+            try:
+                await slots.acquire()
+            finally:
+                waited = time.perf_counter() - start
+                with self._lock:
+                    self.waiting -= 1
+                    self.waited += 1
+                    self.wait_seconds += waited
+                    self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        else:
+            await slots.acquire()
+        return slots
+
+    async def _submit(self, call: Callable[[], "asyncio.Future[T]"]) -> T:
+        slots = await self._slot()
+        with self._lock:
+            self.tasks += 1
+            self.running += 1
+        try:
+            return await call()
+        finally:
+            with self._lock:
+                self.running -= 1
+            slots.release()
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run ``fn(*args, **kwargs)`` in the pool and return its result.
+
+        In process mode ``fn`` must be a module-level function; binary
+        arguments reach it as ``bytes``.
+        """
+        if self.mode == "thread":
+            return await self.run_thread(fn, *args, **kwargs)
+
+        async def call() -> T:
+            loop = asyncio.get_running_loop()
+            segments: List[shared_memory.SharedMemory] = []
+            try:
+                # Filling the segments reads the uploads, which may be spooled to disk
+                shared_args, shared_kwargs = await loop.run_in_executor(None, self._share_arguments, args, kwargs, segments)
+                future = self._process_pool().submit(_invoke, fn, shared_args, shared_kwargs, self.shm_min_bytes)
+                try:
+                    result = await asyncio.wrap_future(future)
+                except asyncio.CancelledError:
+                    # The worker may still finish: unlink the result nobody will read
+                    future.add_done_callback(_discard)
+                    raise
+                except BrokenProcessPool:
+                    # A worker died (killed, out of memory): start a fresh pool for later calls
+                    self._restart()
+                    raise
+                return _take_result(result)
+            finally:
+                for segment in segments:
+                    segment.close()
+                    segment.unlink()
+
+        return await self._submit(call)
+
+    def _share_arguments(
+        self,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        segments: List[shared_memory.SharedMemory]
+    ) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+        shared_args = tuple(_share(arg, segments, self.shm_min_bytes) for arg in args)
+        shared_kwargs = {name: _share(value, segments, self.shm_min_bytes) for name, value in kwargs.items()}
+        with self._lock:
+            self.shared_bytes += sum(segment.size for segment in segments)
+        return shared_args, shared_kwargs
+
+    async def run_thread(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run ``fn(*args, **kwargs)`` on the pool's threads, for work on in-process objects."""
+        async def call() -> T:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._thread_pool(), lambda: fn(*args, **kwargs))
+
+        return await self._submit(call)
+
+    def _restart(self) -> None:
+        with self._lock:
+            broken, self._processes = self._processes, None
+            self.restarts += 1
+        logger.warning("cpu_pool.restarted", workers=self.workers)
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            processes, self._processes = self._processes, None
+            threads, self._threads = self._threads, None
+        if processes is not None:
+            processes.shutdown(wait=True, cancel_futures=True)
+        if threads is not None:
+            threads.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "tasks": self.tasks,
+                "running": self.running,
+                "waiting": self.waiting,
+                "waited": self.waited,
+                "avg_wait_ms": round(self.wait_seconds / self.waited * 1000, 1) if self.waited else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 1),
+                "shared_bytes": self.shared_bytes,
+                "restarts": self.restarts,
+            }
+
+
+cpu_pool = CpuPool(
+    mode=CPU_POOL_MODE,
+    workers=CPU_POOL_WORKERS,
+    max_pending=CPU_POOL_MAX_PENDING,
+    shm_min_bytes=CPU_POOL_SHM_MIN_BYTES,
+)
@@ -0,0 +1,338 @@
+"""
+Asyncio HTTP client shared by all Bria service calls.
+
+Each event loop gets one pooled ``httpx.AsyncClient`` with keep-alive (and
+optionally HTTP/2), so upstream calls reuse connections instead of paying a
+TCP+TLS handshake every time. Synchronous callers (scripts, the old workflow
+code) go through ``run_sync``, which executes the coroutine on a single
+background loop and therefore shares that loop's pool.
+"""
+import asyncio
+import functools
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+from .config import (
+    BRIA_API_BASE,
+    SINGLE_FLIGHT_ENABLED,
+    HTTP2_ENABLED,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE,
+    HTTP_MAX_PER_HOST,
+    HTTP_READ_TIMEOUT,
+)
+from .keypool import key_pool
+from .log import get_logger
+from .metrics import (
+    STAGE_LATENCY,
+    UPSTREAM_ERRORS,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_LATENCY,
+    UPSTREAM_REQUEST_BYTES,
+    UPSTREAM_RESPONSE_BYTES,
+    observe_stage,
+)
+from .payload import iter_json_body, json_body_length
+from .resilience import CircuitOpenError, call_with_retries
+from .scheduler import upstream_slot
+from .singleflight import single_flight
+from .tracing import span
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class _LoopState:
+    """Client and per-host semaphores owned by one event loop."""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.host_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+_bridge_loop: Optional[asyncio.AbstractEventLoop] = None
+_bridge_lock = threading.Lock()
+
+
+def bria_url(path: str) -> str:
+    """Build a full Bria engine URL from an API path like ``/v1/gen_fill``."""
+    return f"{BRIA_API_BASE}{path}"
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _create_client() -> httpx.AsyncClient:
+    http2 = HTTP2_ENABLED and _http2_available()
+    if HTTP2_ENABLED and not http2:
+        logger.warning("http.http2_unavailable", detail="BRIA_HTTP2 is set but the 'h2' package is missing, using HTTP/1.1")
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        http2=http2,
+    )
+
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _states.get(loop)
+    if state is None or state.client.is_closed:
+        state = _LoopState(_create_client())
+        _states[loop] = state
+    return state
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the pooled HTTP client bound to the running event loop."""
+    return _loop_state().client
+
+
+async def close_client() -> None:
+    """Close the client bound to the running event loop, if any."""
+    state = _states.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state.client.aclose()
+
+
+@asynccontextmanager
+async def host_slot(url: str) -> AsyncIterator[None]:
+    """Hold one of the ``HTTP_MAX_PER_HOST`` request slots for the URL's host."""
+    if HTTP_MAX_PER_HOST <= 0:
+        yield
+        return
+    state = _loop_state()
+    host = httpx.URL(url).host
+    slot = state.host_slots.get(host)
+    if slot is None:
+        slot = state.host_slots[host] = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+    async with slot:
+        yield
+
+
+def endpoint_name(url: str) -> str:
+    """Breaker key for a URL: the API path for Bria calls, the host otherwise."""
+    if url.startswith(BRIA_API_BASE):
+        return url[len(BRIA_API_BASE):] or "/"
+    return httpx.URL(url).host
+
+
+def bria_headers(api_key: str) -> Dict[str, str]:
+    return {
+        'api_token': api_key,
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
+
+
+async def post_json(
+    url: str,
+    api_key: str,
+    data: Dict[str, Any],
+    coalesce_key: Optional[str] = None
+) -> httpx.Response:
+    """
+    POST a JSON body to a Bria endpoint and return the raw response.
+
+    Binary values in ``data`` (bytes or file objects) are streamed into the
+    body as base64 strings, see ``core.payload``. Transient failures are
+    retried by ``core.resilience``; the body is re-encoded for every attempt.
+
+    Calls that pass the same ``coalesce_key`` (normally ``request_key`` of the
+    payload) with the same API key while one is in flight share its response.
+    Only pass it for deterministic operations.
+
+    When ``api_key`` belongs to the key pool (``core.keypool``), each attempt
+    is sent with whichever pooled key has the most headroom.
+    """
+    if coalesce_key and SINGLE_FLIGHT_ENABLED:
+        return await single_flight.do((coalesce_key, api_key), lambda: _post_json(url, api_key, data))
+    return await _post_json(url, api_key, data)
+
+
+async def _timed_body(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Pass the body through, recording the time spent producing (encoding) it."""
+    spent = 0.0
+    iterator = chunks.__aiter__()
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+        spent += time.perf_counter() - start
+        yield chunk
+    STAGE_LATENCY.labels("body_encode").observe(spent)
+
+
+async def _post_json(url: str, api_key: str, data: Dict[str, Any]) -> httpx.Response:
+    body_length = json_body_length(data)
+    route = endpoint_name(url)
+    logger.debug("upstream.request", url=url, payload=data, bytes=body_length)
+    UPSTREAM_REQUEST_BYTES.labels(route).observe(body_length)
+
+    async def send() -> httpx.Response:
+        queued_at = time.perf_counter()
+        # Each attempt waits for the tenant's turn; backoff between retries holds no slot
+        async with upstream_slot(), host_slot(url):
+            queue_wait = time.perf_counter() - queued_at
+            STAGE_LATENCY.labels("queue_wait").observe(queue_wait)
+
+            def post(key: str) -> Awaitable[httpx.Response]:
+                headers = {**bria_headers(key), 'Content-Length': str(body_length)}
+                return _observed(route, get_client().post(url, headers=headers, content=_timed_body(iter_json_body(data))),
+                                 queue_wait=queue_wait)
+
+            # Pooled keys are picked per attempt and fail over on 401/403/429
+            return await key_pool.call(api_key, post)
+
+    start = time.perf_counter()
+    with span("upstream.call", **{"upstream.route": route, "http.request.method": "POST",
+                                  "http.request.body.size": body_length}):
+        try:
+            response = await call_with_retries(route, send)
+        except CircuitOpenError:
+            UPSTREAM_ERRORS.labels(route, "circuit_open").inc()
+            raise
+        except httpx.TransportError as e:
+            UPSTREAM_ERRORS.labels(route, type(e).__name__).inc()
+            raise
+    elapsed = time.perf_counter() - start
+    elapsed_ms = round(elapsed * 1000, 1)
+    STAGE_LATENCY.labels("upstream").observe(elapsed)
+
+    if response.is_success:
+        logger.info("upstream.response", sample=True, url=url, status=response.status_code,
+                    bytes=len(response.content), elapsed_ms=elapsed_ms)
+    else:
+        UPSTREAM_ERRORS.labels(route, str(response.status_code)).inc()
+        logger.warning("upstream.error", url=url, status=response.status_code,
+                       elapsed_ms=elapsed_ms, body=response.text)
+    return response
+
+
+async def _observed(route: str, request: Awaitable[httpx.Response], queue_wait: float = 0.0) -> httpx.Response:
+    """Await one upstream attempt, recording its latency, size and in-flight count."""
+    in_flight = UPSTREAM_IN_FLIGHT.labels(route)
+    in_flight.inc()
+    start = time.perf_counter()
+    with span("upstream.attempt", **{"upstream.route": route, "upstream.queue_wait_ms": round(queue_wait * 1000, 1)}) as current:
+        try:
+            response = await request
+        except httpx.TransportError:
+            UPSTREAM_LATENCY.labels(route, "error").observe(time.perf_counter() - start)
+            raise
+        finally:
+            in_flight.dec()
+        size = _body_size(response)
+        current.set_attribute("http.response.status_code", response.status_code)
+        current.set_attribute("http.response.body.size", size)
+    UPSTREAM_LATENCY.labels(route, str(response.status_code)).observe(time.perf_counter() - start)
+    UPSTREAM_RESPONSE_BYTES.labels(route).observe(size)
+    return response
+
+
+def _body_size(response: httpx.Response) -> int:
+    """Size of a read body, or the announced size of one still being streamed."""
+    try:
+        return len(response.content)
+    except httpx.ResponseNotRead:
+        return int(response.headers.get("Content-Length") or 0)
+
+
+def parse_json(response: httpx.Response) -> Any:
+    """``response.json()``, timed as the json_parse stage."""
+    with observe_stage("json_parse"):
+        return response.json()
+
+
+async def fetch_bytes(url: str) -> bytes:
+    """Download a result image (or any URL) through the shared client."""
+    route = endpoint_name(url)
+
+    async def send() -> httpx.Response:
+        async with host_slot(url):
+            return await _observed(route, get_client().get(url))
+
+    response = await call_with_retries(route, send)
+    response.raise_for_status()
+    return response.content
+
+
+@asynccontextmanager
+async def stream_get(url: str) -> AsyncIterator[httpx.Response]:
+    """
+    GET a result image (or any URL) and yield the response with its body
+    unread, for callers that consume it in chunks with ``aiter_bytes()``
+    instead of holding it whole. Retries and errors are as in ``fetch_bytes``;
+    the connection is released when the block exits.
+    """
+    route = endpoint_name(url)
+
+    async def send() -> httpx.Response:
+        async with host_slot(url):
+            client = get_client()
+            response = await _observed(route, client.send(client.build_request("GET", url), stream=True))
+            if not response.is_success:
+                # Retried or raised: only a successful body is streamed
+                await response.aread()
+            return response
+
+    response = await call_with_retries(route, send)
+    try:
+        response.raise_for_status()
+        yield response
+    finally:
+        await response.aclose()
+
+
+def _get_bridge_loop() -> asyncio.AbstractEventLoop:
+    global _bridge_loop
+    with _bridge_lock:
+        if _bridge_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="bria-sync-bridge", daemon=True)
+            thread.start()
+            _bridge_loop = loop
+    return _bridge_loop
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine to completion from synchronous code.
+
+    The coroutine runs on a dedicated background loop, so this is safe to call
+    whether or not the calling thread already has a running loop, and the
+    connection pool of that loop is reused across calls.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_bridge_loop()).result()
+
+
+def make_sync(async_fn: Callable[..., Awaitable[T]]) -> Callable[..., T]:
+    """Build the blocking variant of an ``*_async`` service function."""
+    @functools.wraps(async_fn)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        return run_sync(async_fn(*args, **kwargs))
+
+    name = async_fn.__name__
+    wrapper.__name__ = name[:-len("_async")] if name.endswith("_async") else name
+    wrapper.__qualname__ = wrapper.__name__
+    return wrapper
@@ -0,0 +1,293 @@
+"""
+Background job subsystem behind ``POST /jobs``.
+
+Submitting a job copies its uploaded files to a spool directory and enqueues
+only the job ID, so thousands of pending jobs cost a small record each rather
+than a copy of every image. A fixed pool of worker tasks picks jobs off the
+queue and hands the spooled files to the registered handler, which streams
+them into the upstream request.
+Status changes wake anyone waiting in ``wait_for_update`` (the SSE stream).
+
+A job runs on the worker process that accepted it. With a shared state
+backend every status change is also published there, so any worker can
+answer ``GET /jobs/{id}`` and stream its events.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, List, Optional
+
+from .config import JOB_MAX_PENDING, JOB_RESULT_TTL, JOB_SPOOL_DIR, JOB_WORKERS
+from .log import get_logger
+from .scheduler import BATCH, current_tenant, scheduling
+from .state import SharedState, StateError, shared_state
+
+logger = get_logger(__name__)
+
+# Handlers receive the job params, the spooled input files (opened for reading) and the API key
+JobHandler = Callable[[Dict[str, Any], Dict[str, BinaryIO], str], Awaitable[Dict[str, Any]]]
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+# Shared records of unfinished jobs outlive a worker that died running them, but not forever
+ACTIVE_RECORD_TTL = 24 * 3600
+# How often another worker's job is re-read while streaming its events
+REMOTE_POLL_INTERVAL = 1.0
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    __slots__ = (
+        "id", "operation", "params", "api_key", "tenant", "file_names", "status",
+        "result", "error", "created_at", "started_at", "finished_at", "version"
+    )
+
+    def __init__(self, operation: str, params: Dict[str, Any], api_key: str, file_names: List[str]):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.params = params
+        self.api_key = api_key
+        # Submitting request's tenant; the job's upstream calls are scheduled as batch work
+        self.tenant = current_tenant.get()
+        self.file_names = file_names
+        self.status = "queued"
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.version = 0
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "operation": self.operation,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def _load(self, record: Dict[str, Any]) -> None:
+        for key in ("status", "result", "error", "started_at", "finished_at", "version"):
+            setattr(self, key, record[key])
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Job":
+        """Rebuild a job published by another worker (without its key or files)."""
+        job = cls(record["operation"], {}, "", [])
+        job.id = record["id"]
+        job.created_at = record["created_at"]
+        job._load(record)
+        return job
+
+
+class JobManager:
+    def __init__(
+        self,
+        workers: int = 32,
+        max_pending: int = 10000,
+        result_ttl: float = 3600,
+        spool_dir: str = os.path.join(".cache", "jobs"),
+        shared: Optional[SharedState] = None
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.spool_dir = spool_dir
+        self.shared = shared
+        self._handlers: Dict[str, JobHandler] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._waiters: Dict[str, asyncio.Event] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, operation: str, handler: JobHandler) -> None:
+        """Register the coroutine that runs jobs of the given operation."""
+        self._handlers[operation] = handler
+
+    @property
+    def operations(self) -> List[str]:
+        return sorted(self._handlers)
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._janitor()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None and self.shared is not None:
+            record = await self._read_record(job_id)
+            if record is not None:
+                job = Job.from_record(record)
+        return job
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(
+        self,
+        operation: str,
+        params: Dict[str, Any],
+        api_key: str,
+        files: Dict[str, BinaryIO]
+    ) -> Job:
+        """Copy the input files to the spool directory and queue a new job."""
+        if operation not in self._handlers:
+            raise ValueError(f"Unknown operation '{operation}'. Expected one of: {', '.join(self.operations)}")
+        if self._queue is None:
+            raise RuntimeError("Job manager is not running")
+        if self._queue.full():
+            raise QueueFullError("Too many pending jobs, try again later")
+
+        job = Job(operation, params, api_key, list(files))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_files, job.id, files)
+
+        try:
+            self._queue.put_nowait(job.id)
+        except asyncio.QueueFull:
+            shutil.rmtree(self._job_dir(job.id), ignore_errors=True)
+            raise QueueFullError("Too many pending jobs, try again later")
+        self._jobs[job.id] = job
+        await self._publish(job)
+        return job
+
+    async def wait_for_update(self, job: Job, seen_version: int, timeout: float) -> bool:
+        """Wait until the job changes past ``seen_version``; False on timeout."""
+        if job.version > seen_version:
+            return True
+        if job.id not in self._jobs:
+            return await self._wait_for_remote_update(job, seen_version, timeout)
+        event = self._waiters.setdefault(job.id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    # --- Internals ---
+
+    async def _publish(self, job: Job) -> None:
+        if self.shared is None:
+            return
+        record = {**job.to_dict(), "version": job.version}
+        try:
+            await self.shared.set(f"job:{job.id}", json.dumps(record).encode("utf-8"),
+                            self.result_ttl if job.done else ACTIVE_RECORD_TTL)
+        except (StateError, TypeError, ValueError) as e:
+            logger.warning("jobs.publish_failed", job_id=job.id, error=str(e))
+
+    async def _read_record(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = await self.shared.get(f"job:{job_id}")
+        except StateError as e:
+            logger.warning("jobs.shared_unavailable", error=str(e))
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def _wait_for_remote_update(self, job: Job, seen_version: int, timeout: float) -> bool:
+        # Another worker runs the job: poll its published record
+        if self.shared is None:
+            return False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(REMOTE_POLL_INTERVAL, remaining))
+            record = await self._read_record(job.id)
+            if record is not None and record["version"] > seen_version:
+                job._load(record)
+                return True
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, job_id)
+
+    def _write_files(self, job_id: str, files: Dict[str, BinaryIO]) -> None:
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        for name, source in files.items():
+            source.seek(0)
+            with open(os.path.join(job_dir, name), "wb") as f:
+                shutil.copyfileobj(source, f, length=1024 * 1024)
+
+    def _open_files(self, job: Job) -> Dict[str, BinaryIO]:
+        return {name: open(os.path.join(self._job_dir(job.id), name), "rb") for name in job.file_names}
+
+    async def _update(self, job: Job, **changes: Any) -> None:
+        for key, value in changes.items():
+            setattr(job, key, value)
+        job.version += 1
+        await self._publish(job)
+        event = self._waiters.pop(job.id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            try:
+                if job is not None:
+                    await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        await self._update(job, status="running", started_at=time.time())
+        files: Dict[str, BinaryIO] = {}
+        try:
+            files = self._open_files(job)
+            with scheduling(job.tenant, BATCH):
+                result = await self._handlers[job.operation](job.params, files, job.api_key)
+            await self._update(job, status="succeeded", result=result, finished_at=time.time())
+        except Exception as e:
+            await self._update(job, status="failed", error=str(e), finished_at=time.time())
+        finally:
+            for f in files.values():
+                f.close()
+            # Inputs are no longer needed, and the key should not outlive the job
+            job.api_key = ""
+            shutil.rmtree(self._job_dir(job.id), ignore_errors=True)
+
+    async def _janitor(self) -> None:
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.time() - self.result_ttl
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.done and job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                self._jobs.pop(job_id, None)
+
+
+job_manager = JobManager(
+    workers=JOB_WORKERS,
+    max_pending=JOB_MAX_PENDING,
+    result_ttl=JOB_RESULT_TTL,
+    spool_dir=JOB_SPOOL_DIR,
+    shared=shared_state,
+)
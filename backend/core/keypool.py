@@ -0,0 +1,190 @@
+"""
+Pool of Bria API keys with least-loaded routing and failover.
+
+Calls made with a pooled key (``BRIA_API_KEYS``) are not tied to that key:
+every attempt goes to the key with the most headroom, i.e. the fewest calls
+in flight plus a penalty for recent 429s. A key answering 429 cools down for
+its Retry-After; one answering 401/403 is quarantined for
+``KEY_POOL_QUARANTINE_TIME``. Either way the call fails over straight away
+to another key with headroom left. Keys that clients send themselves are
+used as-is.
+"""
+import hashlib
+import math
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import httpx
+
+from .config import BRIA_API_KEYS, KEY_POOL_QUARANTINE_TIME, KEY_POOL_THROTTLE_COOLDOWN
+from .log import get_logger
+from .resilience import parse_retry_after
+from .tracing import current_span
+
+logger = get_logger(__name__)
+
+FAILOVER_STATUSES = {401, 403, 429}
+# Recent 429s weigh like this many calls in flight, fading over THROTTLE_DECAY seconds
+THROTTLE_WEIGHT = 4.0
+THROTTLE_DECAY = 60.0
+
+
+def key_label(api_key: str) -> str:
+    """Name a key in logs and stats without revealing it."""
+    return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class _KeyState:
+    __slots__ = (
+        "key", "label", "in_flight", "requests", "throttled", "auth_failures",
+        "throttle_score", "throttle_at", "cooldown_until", "quarantined_until"
+    )
+
+    def __init__(self, key: str):
+        self.key = key
+        self.label = key_label(key)
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.auth_failures = 0
+        self.throttle_score = 0.0
+        self.throttle_at = 0.0
+        self.cooldown_until = 0.0
+        self.quarantined_until = 0.0
+
+    def decayed_throttle(self, now: float) -> float:
+        return self.throttle_score * math.exp(-(now - self.throttle_at) / THROTTLE_DECAY)
+
+    def load(self, now: float) -> float:
+        return self.in_flight + THROTTLE_WEIGHT * self.decayed_throttle(now)
+
+    def state(self, now: float) -> str:
+        if self.quarantined_until > now:
+            return "quarantined"
+        if self.cooldown_until > now:
+            return "cooling_down"
+        return "available"
+
+
+class KeyPool:
+    def __init__(self, keys: List[str], quarantine_time: float, throttle_cooldown: float):
+        self._keys: Dict[str, _KeyState] = {key: _KeyState(key) for key in keys}
+        self.quarantine_time = quarantine_time
+        self.throttle_cooldown = throttle_cooldown
+        self._lock = threading.Lock()
+        self.failovers = 0
+
+    def default_key(self) -> Optional[str]:
+        """A pooled key for requests without one (calls are routed per attempt anyway)."""
+        return next(iter(self._keys), None)
+
+    def owns(self, api_key: str) -> bool:
+        return api_key in self._keys
+
+    def _pick(self, now: float, exclude: Set[str], available_only: bool) -> Optional[_KeyState]:
+        best = None
+        best_rank = None
+        for state in self._keys.values():
+            if state.key in exclude:
+                continue
+            status = state.state(now)
+            if status == "quarantined" or (available_only and status != "available"):
+                continue
+            # Keys cooling down come after every available key
+            rank = (status != "available", state.load(now), state.requests)
+            if best_rank is None or rank < best_rank:
+                best, best_rank = state, rank
+        return best
+
+    def _acquire(self, api_key: str, tried: Set[str]) -> str:
+        if not self.owns(api_key):
+            return api_key
+        now = time.monotonic()
+        with self._lock:
+            state = self._pick(now, tried, available_only=False)
+            if state is None:
+                # Every key is quarantined or already tried: let the upstream answer
+                state = self._keys[api_key]
+            state.in_flight += 1
+            state.requests += 1
+            return state.key
+
+    def _release(self, key: str, response: Optional[httpx.Response]) -> None:
+        state = self._keys.get(key)
+        if state is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state.in_flight -= 1
+            if response is None:
+                return
+            status = response.status_code
+            if status == 429:
+                state.throttled += 1
+                state.throttle_score = state.decayed_throttle(now) + 1
+                state.throttle_at = now
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                state.cooldown_until = now + (retry_after if retry_after is not None else self.throttle_cooldown)
+            elif status in (401, 403):
+                state.auth_failures += 1
+                state.quarantined_until = now + self.quarantine_time
+            elif response.is_success:
+                # A key whose quarantine ran out is trusted again once it works
+                state.quarantined_until = 0.0
+        if status in (401, 403):
+            logger.warning("keypool.quarantined", key=state.label, status=status, seconds=self.quarantine_time)
+
+    async def call(self, api_key: str, send: Callable[[str], Awaitable[httpx.Response]]) -> httpx.Response:
+        """
+        Run ``send(key)`` with the pooled key that has the most headroom,
+        failing over to the next one on 401, 403 and 429. Keys outside the
+        pool are passed through untouched.
+        """
+        tried: Set[str] = set()
+        while True:
+            key = self._acquire(api_key, tried)
+            try:
+                response = await send(key)
+            except BaseException:
+                self._release(key, None)
+                raise
+            self._release(key, response)
+            if not self.owns(key) or response.status_code not in FAILOVER_STATUSES:
+                return response
+            tried.add(key)
+            with self._lock:
+                next_key = self._pick(time.monotonic(), tried, available_only=True)
+                if next_key is None:
+                    return response
+                self.failovers += 1
+            current_span().add_event("key_failover", {"status": response.status_code, "to": next_key.label})
+            logger.info("keypool.failover", status=response.status_code, key=key_label(key), to=next_key.label)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            keys = {
+                state.label: {
+                    "state": state.state(now),
+                    "in_flight": state.in_flight,
+                    "requests": state.requests,
+                    "throttled": state.throttled,
+                    "auth_failures": state.auth_failures,
+                    "load": round(state.load(now), 3),
+                    "cooldown_s": round(max(0.0, state.cooldown_until - now), 1),
+                    "quarantine_s": round(max(0.0, state.quarantined_until - now), 1),
+                }
+                for state in self._keys.values()
+            }
+        return {
+            "keys": len(keys),
+            "available": sum(1 for key in keys.values() if key["state"] == "available"),
+            "quarantined": sum(1 for key in keys.values() if key["state"] == "quarantined"),
+            "in_flight": sum(key["in_flight"] for key in keys.values()),
+            "failovers": self.failovers,
+            "by_key": keys,
+        }
+
+
+key_pool = KeyPool(BRIA_API_KEYS, KEY_POOL_QUARANTINE_TIME, KEY_POOL_THROTTLE_COOLDOWN)
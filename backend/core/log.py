@@ -0,0 +1,130 @@
+"""
+Structured logging for the backend.
+
+Log calls take an event name plus keyword fields:
+
+    logger = get_logger(__name__)
+    logger.info("upstream.response", url=url, status=200, elapsed_ms=812.4)
+
+Fields are sanitized before they are written: credential-like keys are
+redacted, image bytes and file objects are replaced by their size and long
+strings are truncated to ``LOG_MAX_FIELD_CHARS``. Routine per-request events
+can be sampled with ``LOG_SAMPLE_RATE``; warnings and errors never are.
+Nothing is formatted unless the level is enabled.
+"""
+import json
+import logging
+import random
+import sys
+import time
+from typing import Any, Dict
+
+from .config import LOG_FORMAT, LOG_LEVEL, LOG_MAX_FIELD_CHARS, LOG_SAMPLE_RATE
+from .payload import binary_size, is_binary
+
+ROOT_LOGGER = "visionary"
+
+REDACTED_KEYS = ("api_token", "api_key", "authorization", "password", "secret", "token", "cookie")
+
+
+def _redacted(key: str) -> bool:
+    key = key.lower()
+    return any(part in key for part in REDACTED_KEYS)
+
+
+def sanitize(value: Any, max_chars: int = LOG_MAX_FIELD_CHARS, depth: int = 0) -> Any:
+    """Make a value safe and small enough to log."""
+    if is_binary(value):
+        try:
+            return f"<{binary_size(value)} bytes>"
+        except (OSError, ValueError):
+            return "<binary>"
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return f"{value[:max_chars]}...(+{len(value) - max_chars} chars)"
+        return value
+    if depth >= 4:
+        return "<nested>"
+    if isinstance(value, dict):
+        return {
+            str(k): "***" if _redacted(str(k)) else sanitize(v, max_chars, depth + 1)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        items = [sanitize(v, max_chars, depth + 1) for v in value[:20]]
+        if len(value) > 20:
+            items.append(f"...(+{len(value) - 20} items)")
+        return items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return sanitize(str(value), max_chars, depth)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = time.strftime("%H:%M:%S", time.localtime(record.created))
+        fields = " ".join(f"{k}={json.dumps(v, default=str)}" for k, v in getattr(record, "fields", {}).items())
+        line = f"{timestamp} {record.levelname:<7} {record.name} {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class StructuredLogger:
+    """Thin wrapper over a stdlib logger that takes ``event, **fields``."""
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def is_enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], sample: bool = False, exc_info: bool = False) -> None:
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample and LOG_SAMPLE_RATE < 1.0 and random.random() >= LOG_SAMPLE_RATE:
+            return
+        self._logger.log(level, event, extra={"fields": sanitize(fields)}, exc_info=exc_info)
+
+    def debug(self, event: str, sample: bool = True, **fields: Any) -> None:
+        self._log(logging.DEBUG, event, fields, sample)
+
+    def info(self, event: str, sample: bool = False, **fields: Any) -> None:
+        self._log(logging.INFO, event, fields, sample)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, exc_info: bool = False, **fields: Any) -> None:
+        self._log(logging.ERROR, event, fields, exc_info=exc_info)
+
+
+def configure_logging() -> None:
+    """Attach the configured handler to the backend's logger tree (idempotent)."""
+    root = logging.getLogger(ROOT_LOGGER)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+def get_logger(name: str) -> StructuredLogger:
+    configure_logging()
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
@@ -0,0 +1,188 @@
+"""
+Prometheus metrics for the API and its upstream calls, served at ``/metrics``.
+
+Request metrics are recorded by ``MetricsMiddleware`` and labelled with the
+route template (``/jobs/{job_id}``), never the raw path. Upstream metrics are
+labelled with the Bria route (see ``core.http.endpoint_name``). Counters that
+already live elsewhere (caches, single-flight, scheduler queues) are read at
+scrape time through ``register_stats`` instead of being updated twice.
+
+With several worker processes, set ``PROMETHEUS_MULTIPROC_DIR`` to an empty
+directory: every worker then writes its samples there and a scrape of any
+worker returns the sum over all of them. The ``register_stats`` gauges still
+describe only the worker that answered.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    # Samples are written there as soon as the metrics below are created
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Upstream generations take seconds to minutes, API-local work milliseconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+HTTP_REQUESTS = Counter(
+    "visionary_http_requests_total", "API requests", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "visionary_http_request_duration_seconds", "API request latency until the response starts",
+    ["method", "route"], buckets=LATENCY_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge(
+    "visionary_http_requests_in_flight", "API requests being handled", multiprocess_mode="livesum"
+)
+REQUEST_BYTES = Histogram(
+    "visionary_http_request_bytes", "API request body sizes", ["route"], buckets=SIZE_BUCKETS
+)
+
+UPSTREAM_LATENCY = Histogram(
+    "visionary_upstream_request_duration_seconds", "Latency of one upstream attempt",
+    ["route", "status"], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "visionary_upstream_requests_in_flight", "Upstream requests on the wire", ["route"],
+    multiprocess_mode="livesum"
+)
+UPSTREAM_REQUEST_BYTES = Histogram(
+    "visionary_upstream_request_bytes", "Upstream request body sizes", ["route"], buckets=SIZE_BUCKETS
+)
+UPSTREAM_RESPONSE_BYTES = Histogram(
+    "visionary_upstream_response_bytes", "Upstream response body sizes", ["route"], buckets=SIZE_BUCKETS
+)
+UPSTREAM_RETRIES = Counter(
+    "visionary_upstream_retries_total", "Upstream attempts that were retried", ["route", "reason"]
+)
+UPSTREAM_ERRORS = Counter(
+    "visionary_upstream_errors_total", "Upstream calls that failed for good", ["route", "reason"]
+)
+
+STAGE_LATENCY = Histogram(
+    "visionary_stage_duration_seconds",
+    "Time spent per processing stage (upload_read, preprocess, queue_wait, body_encode, upstream, json_parse)",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+
+
+@contextmanager
+def observe_stage(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+class _StatsCollector:
+    """Expose numeric fields of existing ``stats()`` dicts as gauges."""
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        for name, source in list(self._sources.items()):
+            try:
+                stats = source()
+            except Exception:
+                continue
+            family = GaugeMetricFamily(f"visionary_{name}", f"Counters of {name.replace('_', ' ')}", labels=["field"])
+            for field, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    family.add_metric([field], float(value))
+            yield family
+
+
+_stats_collector = _StatsCollector()
+REGISTRY.register(_stats_collector)
+
+
+def register_stats(name: str, source: Callable[[], Dict[str, Any]]) -> None:
+    """Publish a ``stats()`` callable as the ``visionary_<name>{field=...}`` gauge."""
+    _stats_collector._sources[name] = source
+
+
+def _multiprocess() -> bool:
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def render_metrics() -> bytes:
+    if _multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_stats_collector)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def reset_multiprocess_metrics() -> None:
+    """Empty the multiprocess directory before workers start (samples of old runs would be summed too)."""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        return
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            os.remove(os.path.join(directory, name))
+
+
+def release_process_metrics() -> None:
+    """Drop this worker's live gauges when it exits."""
+    if _multiprocess():
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are not buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        # Read by the request dependency to time the upload (body parsing happens before it runs)
+        scope.setdefault("state", {})["started_at"] = start
+        status = {"code": 500}
+        received = {"bytes": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                received["bytes"] += len(message.get("body", b""))
+            return message
+
+        async def observing_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                route = _route(scope)
+                HTTP_LATENCY.labels(scope["method"], route).observe(time.perf_counter() - start)
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, counting_receive, observing_send)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = _route(scope)
+            HTTP_REQUESTS.labels(scope["method"], route, str(status["code"])).inc()
+            if received["bytes"]:
+                REQUEST_BYTES.labels(route).observe(received["bytes"])
+
+
+def _route(scope) -> str:
+    route = scope.get("route")
+    # Unmatched paths are not used as labels, to keep cardinality bounded
+    return getattr(route, "path", None) or "unmatched"
+
@@ -0,0 +1,88 @@
+"""
+Streaming JSON encoder for upstream request bodies.
+
+Services put raw image bytes or file objects (e.g. the SpooledTemporaryFile
+behind a FastAPI ``UploadFile``) straight into their payload dict. When the
+request is sent, those values are base64-encoded chunk by chunk directly into
+the outgoing body, so an upload is never held in memory as bytes, base64 text
+and serialized JSON at the same time.
+"""
+import base64
+import hashlib
+import json
+import os
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterator, Tuple, Union
+
+ImageInput = Union[bytes, BinaryIO]
+
+# Multiple of 3 so every chunk encodes without base64 padding
+CHUNK_SIZE = 3 * 256 * 1024
+
+
+def is_binary(value: Any) -> bool:
+    return isinstance(value, (bytes, bytearray, memoryview)) or hasattr(value, "read")
+
+
+def binary_size(value: ImageInput) -> int:
+    """Size in bytes of raw image data or of a seekable file object."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    value.seek(0, os.SEEK_END)
+    size = value.tell()
+    value.seek(0)
+    return size
+
+
+def iter_binary(value: ImageInput, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield raw chunks of an image; file objects are read from the start."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        view = memoryview(value)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+        return
+    value.seek(0)
+    while True:
+        chunk = value.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def binary_digest(value: ImageInput) -> str:
+    """SHA-256 of an image without loading a file object into memory."""
+    digest = hashlib.sha256()
+    for chunk in iter_binary(value):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _json_parts(data: Dict[str, Any]) -> Iterator[Tuple[bool, Any]]:
+    # (is_binary, part): JSON text as bytes, or a binary value still to be encoded
+    yield False, b"{"
+    for index, (key, value) in enumerate(data.items()):
+        prefix = b"," if index else b""
+        if is_binary(value):
+            yield False, prefix + json.dumps(key).encode("utf-8") + b':"'
+            yield True, value
+            yield False, b'"'
+        else:
+            yield False, prefix + json.dumps(key).encode("utf-8") + b":" + json.dumps(value).encode("utf-8")
+    yield False, b"}"
+
+
+def json_body_length(data: Dict[str, Any]) -> int:
+    """Exact length of the body ``iter_json_body`` will produce."""
+    total = 0
+    for binary, part in _json_parts(data):
+        total += 4 * ((binary_size(part) + 2) // 3) if binary else len(part)
+    return total
+
+
+async def iter_json_body(data: Dict[str, Any], chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Serialize ``data`` to JSON, base64-encoding binary values on the fly."""
+    for binary, part in _json_parts(data):
+        if binary:
+            for chunk in iter_binary(part, chunk_size):
+                yield base64.b64encode(chunk)
+        else:
+            yield part
@@ -0,0 +1,123 @@
+"""
+Token-bucket rate limiting per tenant and API endpoint.
+
+Each (tenant, endpoint) pair has a bucket that refills at ``rate`` tokens per
+second up to ``burst``; a request takes one token or is rejected with the
+number of seconds until one is available. Endpoint limits default to
+``RATE_LIMIT_RATE``/``RATE_LIMIT_BURST`` and can be overridden with ``RATE_LIMITS``.
+With a shared state backend the buckets live there, so the limit holds across
+all workers; the local buckets take over while the backend is unreachable.
+"""
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .config import RATE_LIMIT_BURST, RATE_LIMIT_ENABLED, RATE_LIMIT_RATE, RATE_LIMITS
+from .log import get_logger
+from .state import SharedState, StateError, shared_state
+
+logger = get_logger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Take a token; returns 0 on success, else the seconds until one is available."""
+        # A bucket created just after ``now`` was read must not start in debt
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated_at) * self.rate)
+        self.updated_at = max(now, self.updated_at)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+
+def _load_limits() -> Dict[str, Dict[str, float]]:
+    try:
+        limits = json.loads(RATE_LIMITS)
+    except ValueError:
+        logger.warning("ratelimit.bad_limits", value=RATE_LIMITS)
+        return {}
+    if not isinstance(limits, dict):
+        logger.warning("ratelimit.bad_limits", value=RATE_LIMITS)
+        return {}
+    return {path: limit for path, limit in limits.items() if isinstance(limit, dict)}
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        limits: Dict[str, Dict[str, float]],
+        enabled: bool = True,
+        shared: Optional[SharedState] = None
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits
+        self.enabled = enabled
+        self.shared = shared
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+        self.allowed = 0
+        self.rejected = 0
+
+    def _limit(self, endpoint: str) -> Tuple[float, float]:
+        limit = self.limits.get(endpoint, {})
+        return float(limit.get("rate", self.rate)), float(limit.get("burst", self.burst))
+
+    def _prune(self, now: float) -> None:
+        # Buckets that have been idle long enough to be full again carry no state
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        idle = [
+            key for key, bucket in self._buckets.items()
+            if bucket.rate > 0 and now - bucket.updated_at > bucket.burst / bucket.rate
+        ]
+        for key in idle:
+            del self._buckets[key]
+
+    async def check(self, tenant: str, endpoint: str) -> Optional[float]:
+        """Consume one request; None if allowed, else the Retry-After in seconds."""
+        if not self.enabled:
+            return None
+        wait = None
+        if self.shared is not None:
+            try:
+                wait = await self.shared.take_token(f"ratelimit:{tenant}:{endpoint}", *self._limit(endpoint))
+            except StateError as e:
+                logger.warning("ratelimit.shared_unavailable", error=str(e))
+        now = time.monotonic()
+        with self._lock:
+            if wait is None:
+                self._prune(now)
+                bucket = self._buckets.get((tenant, endpoint))
+                if bucket is None:
+                    bucket = self._buckets[(tenant, endpoint)] = TokenBucket(*self._limit(endpoint))
+                wait = bucket.take(now)
+            if wait == 0:
+                self.allowed += 1
+                return None
+            self.rejected += 1
+        logger.info("ratelimit.rejected", tenant=tenant, endpoint=endpoint, retry_after=round(wait, 2))
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"allowed": self.allowed, "rejected": self.rejected, "buckets": len(self._buckets)}
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_RATE, RATE_LIMIT_BURST, _load_limits(), RATE_LIMIT_ENABLED, shared_state)
@@ -0,0 +1,252 @@
+"""
+Retry, backoff and circuit breaking shared by all upstream calls.
+
+``call_with_retries`` wraps a single HTTP exchange:
+
+* 429 and 5xx responses and transport errors are retried with exponential
+  backoff and full jitter, honouring ``Retry-After`` when the upstream sends it;
+* a process-wide retry budget caps retries to a fraction of recent traffic,
+  so an upstream incident does not turn into a retry storm;
+* each endpoint has a circuit breaker that opens after consecutive failures
+  and fails fast until a trial request succeeds again.
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import httpx
+
+from .config import (
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_TIMEOUT,
+    RETRY_BASE_DELAY,
+    RETRY_BUDGET_MIN,
+    RETRY_BUDGET_RATIO,
+    RETRY_BUDGET_WINDOW,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+)
+from .log import get_logger
+from .metrics import UPSTREAM_RETRIES
+from .tracing import current_span
+
+logger = get_logger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header (delta or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """Full-jitter exponential backoff for the given (1-based) attempt."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+class RetryBudget:
+    """Allow retries up to ``ratio`` of the requests seen in a sliding window."""
+
+    def __init__(self, ratio: float, window: float, minimum: int):
+        self.ratio = ratio
+        self.window = window
+        self.minimum = minimum
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def record_request(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        """Reserve one retry; False when the budget is used up."""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = max(self.minimum, int(len(self._requests) * self.ratio))
+            if len(self._retries) >= allowed:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "requests": len(self._requests),
+                "retries": len(self._retries),
+                "exhausted": self.exhausted,
+            }
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open trial request."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self) -> None:
+        """Give up a trial that ended without an outcome (e.g. cancelled), so another call can try."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def retry_in(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("breaker.closed", endpoint=self.name)
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("breaker.opened", endpoint=self.name, failures=self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected,
+            "retry_in": round(self.retry_in(), 1) if self.state == "open" else 0.0,
+        }
+
+
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_WINDOW, RETRY_BUDGET_MIN)
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        return breaker
+
+
+def resilience_stats() -> Dict[str, Any]:
+    with _breakers_lock:
+        breakers = {name: breaker.stats() for name, breaker in _breakers.items()}
+    return {"retry_budget": retry_budget.stats(), "breakers": breakers}
+
+
+async def call_with_retries(
+    endpoint: str,
+    send: Callable[[], Awaitable[httpx.Response]],
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+) -> httpx.Response:
+    """
+    Run ``send`` under the endpoint's breaker, retrying transient failures.
+
+    ``send`` must build a fresh request on every call. The last response is
+    returned even when it is an error, so callers keep their own handling of
+    non-2xx statuses; transport errors are re-raised once retries run out.
+    """
+    breaker = breaker_for(endpoint)
+    attempt = 0
+    while True:
+        attempt += 1
+        if not breaker.allow():
+            raise CircuitOpenError(
+                f"Upstream endpoint {endpoint} is failing, retry in {breaker.retry_in():.0f}s"
+            )
+        if attempt == 1:
+            retry_budget.record_request()
+        current_span().set_attribute("upstream.attempts", attempt)
+
+        retry_after = None
+        try:
+            response = await send()
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            if attempt >= max_attempts or breaker.state == "open" or not retry_budget.try_spend():
+                raise
+            reason = type(e).__name__
+        except Exception:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled: says nothing about the upstream, but must not hold the half-open trial
+            breaker.release()
+            raise
+        else:
+            if response.status_code not in RETRYABLE_STATUSES:
+                breaker.record_success()
+                return response
+            # 429 is a quota signal for one key, not a sign the endpoint is down
+            if response.status_code == 429:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            if attempt >= max_attempts or breaker.state == "open" or not retry_budget.try_spend():
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            reason = response.status_code
+
+        delay = retry_after if retry_after is not None else backoff_delay(attempt)
+        delay = min(delay, RETRY_MAX_DELAY)
+        UPSTREAM_RETRIES.labels(endpoint, str(reason)).inc()
+        current_span().add_event("retry", {"attempt": attempt, "reason": str(reason), "delay_s": round(delay, 3)})
+        logger.warning("upstream.retry", endpoint=endpoint, reason=reason, attempt=attempt, delay_s=round(delay, 2))
+        await asyncio.sleep(delay)
@@ -0,0 +1,99 @@
+"""
+Helpers for reading result payloads returned by the Bria engine.
+
+The endpoints do not agree on a response shape (``result_url``, ``urls``,
+``result: [{"urls": [...]}]``, ``result: [[url, seed, sku]]``...), so these
+helpers walk the payload generically.
+"""
+import asyncio
+import base64
+import time
+from typing import Any, Callable, List, Tuple
+
+from .http import get_client
+
+
+def extract_result_urls(payload: Any, schemes: Tuple[str, ...] = ("http://", "https://")) -> List[str]:
+    """Return every http(s) URL (or URL with one of ``schemes``) found in a response payload, in order."""
+    urls: List[str] = []
+
+    def walk(value: Any) -> None:
+        if isinstance(value, str):
+            if value.startswith(schemes) and value not in urls:
+                urls.append(value)
+        elif isinstance(value, dict):
+            for item in value.values():
+                walk(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                walk(item)
+
+    walk(payload)
+    return urls
+
+
+def map_result_urls(payload: Any, fn: Callable[[str], str], schemes: Tuple[str, ...] = ("http://", "https://")) -> Any:
+    """Return a copy of a response payload with every URL replaced by ``fn(url)``."""
+    if isinstance(payload, str):
+        return fn(payload) if payload.startswith(schemes) else payload
+    if isinstance(payload, dict):
+        return {key: map_result_urls(item, fn, schemes) for key, item in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [map_result_urls(item, fn, schemes) for item in payload]
+    return payload
+
+
+class InlineImage(str):
+    """
+    A ``data:`` URL that keeps the bytes it was encoded from, so the image can
+    be stored or served again without decoding the base64. Everywhere else it
+    is the URL string; copies, JSON and pickles are plain strings.
+    """
+
+    def __new__(cls, data: bytes, content_type: str):
+        url = super().__new__(cls, b"data:%s;base64,%s" % (content_type.encode("ascii"), base64.b64encode(data)), "ascii")
+        url.data = data
+        url.content_type = content_type
+        return url
+
+    def __reduce__(self):
+        return str, (str(self),)
+
+
+def to_data_url(data: bytes, content_type: str) -> str:
+    """Inline an image produced locally, so it can be returned where a result URL is expected."""
+    return InlineImage(data, content_type)
+
+
+def from_data_url(url: str) -> bytes:
+    if isinstance(url, InlineImage):
+        return url.data
+    return base64.b64decode(url.partition(",")[2])
+
+
+async def wait_for_urls(urls: List[str], interval: float = 2.0, timeout: float = 300.0) -> None:
+    """
+    Poll result URLs until they are all reachable.
+
+    With ``sync=False`` the engine answers straight away with placeholder URLs
+    that return an error until the image has been rendered.
+    """
+    client = get_client()
+    deadline = time.monotonic() + timeout
+    pending = list(urls)
+    while pending:
+        still_pending = []
+        for url in pending:
+            try:
+                response = await client.head(url)
+                ready = response.is_success
+            except Exception:
+                ready = False
+            if not ready:
+                still_pending.append(url)
+        pending = still_pending
+        if not pending:
+            return
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"{len(pending)} result(s) not ready after {timeout:.0f}s")
+        await asyncio.sleep(interval)
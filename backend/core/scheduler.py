@@ -0,0 +1,189 @@
+"""
+Weighted fair queueing of upstream calls across tenants.
+
+At most ``SCHEDULER_MAX_CONCURRENCY`` upstream calls run at once, and at most
+``SCHEDULER_TENANT_CONCURRENCY`` of them for any single tenant. When calls
+have to wait, each (tenant, priority) flow is served in proportion to its
+weight: a queued call gets a virtual finish tag of
+``max(virtual_time, last_tag_of_flow) + 1 / weight`` and the smallest
+eligible tag runs next. Interactive calls therefore overtake bulk work
+without starving it, and one tenant's backlog cannot hold up the others.
+
+The tenant and priority of the current request travel in context
+variables, set once by the API layer (``scheduling``) and inherited by
+every task the request spawns.
+"""
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import itertools
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from .config import (
+    SCHEDULER_BATCH_WEIGHT,
+    SCHEDULER_INTERACTIVE_WEIGHT,
+    SCHEDULER_MAX_CONCURRENCY,
+    SCHEDULER_TENANT_CONCURRENCY,
+)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITY_WEIGHTS = {INTERACTIVE: SCHEDULER_INTERACTIVE_WEIGHT, BATCH: SCHEDULER_BATCH_WEIGHT}
+
+current_tenant: "contextvars.ContextVar[str]" = contextvars.ContextVar("tenant", default="anonymous")
+current_priority: "contextvars.ContextVar[str]" = contextvars.ContextVar("priority", default=INTERACTIVE)
+
+
+def tenant_id(api_key: Optional[str], client_host: Optional[str] = None) -> str:
+    """Stable, non-reversible tenant name for an API key (or a client host)."""
+    if api_key:
+        return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+    if client_host:
+        return f"host-{client_host}"
+    return "anonymous"
+
+
+@contextmanager
+def scheduling(tenant: str, priority: str = INTERACTIVE) -> Iterator[None]:
+    """Attribute the upstream calls made inside the block to a tenant and priority."""
+    tenant_token = current_tenant.set(tenant)
+    priority_token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(priority_token)
+        current_tenant.reset(tenant_token)
+
+
+class FairScheduler:
+    """Per-event-loop scheduler state; use ``slot()`` through ``upstream_slot``."""
+
+    def __init__(self, max_concurrency: int, tenant_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.tenant_concurrency = tenant_concurrency
+        self.in_flight = 0
+        self.tenant_in_flight: Dict[str, int] = {}
+        self.virtual_time = 0.0
+        self._last_tag: Dict[Tuple[str, str], float] = {}
+        self._queue: List[Tuple[float, int, str, str, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    def _can_run(self, tenant: str) -> bool:
+        return (
+            self.in_flight < self.max_concurrency
+            and self.tenant_in_flight.get(tenant, 0) < self.tenant_concurrency
+        )
+
+    def _start(self, tenant: str) -> None:
+        self.in_flight += 1
+        self.tenant_in_flight[tenant] = self.tenant_in_flight.get(tenant, 0) + 1
+
+    def _finish(self, tenant: str) -> None:
+        self.in_flight -= 1
+        remaining = self.tenant_in_flight.get(tenant, 1) - 1
+        if remaining:
+            self.tenant_in_flight[tenant] = remaining
+        else:
+            self.tenant_in_flight.pop(tenant, None)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        skipped = []
+        while self._queue and self.in_flight < self.max_concurrency:
+            entry = heapq.heappop(self._queue)
+            tag, _, tenant, _, waiter = entry
+            if waiter.done():
+                continue
+            if not self._can_run(tenant):
+                skipped.append(entry)
+                continue
+            self.virtual_time = max(self.virtual_time, tag)
+            self._start(tenant)
+            waiter.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        if not self._queue:
+            # Idle: forget old tags so flows start fresh
+            self._last_tag.clear()
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, priority: str) -> AsyncIterator[None]:
+        if not self._queue and self._can_run(tenant):
+            self._start(tenant)
+        else:
+            flow = (tenant, priority)
+            weight = PRIORITY_WEIGHTS.get(priority, 1.0) or 1.0
+            tag = max(self.virtual_time, self._last_tag.get(flow, 0.0)) + 1.0 / weight
+            self._last_tag[flow] = tag
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (tag, next(self._order), tenant, priority, waiter))
+            # Queued calls may all belong to capped tenants while this one can run
+            self._dispatch()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted just as we were cancelled: hand the slot on
+                    self._finish(tenant)
+                raise
+        try:
+            yield
+        finally:
+            self._finish(tenant)
+
+    def stats(self) -> Dict[str, Any]:
+        queued: Dict[str, int] = {}
+        queued_by_tenant: Dict[str, int] = {}
+        for _, _, tenant, priority, waiter in self._queue:
+            if not waiter.done():
+                queued[priority] = queued.get(priority, 0) + 1
+                queued_by_tenant[tenant] = queued_by_tenant.get(tenant, 0) + 1
+        return {
+            "in_flight": self.in_flight,
+            "queued": sum(queued.values()),
+            "queued_by_priority": queued,
+            "tenants": {
+                tenant: {"in_flight": self.tenant_in_flight.get(tenant, 0), "queued": queued_by_tenant.get(tenant, 0)}
+                for tenant in set(self.tenant_in_flight) | set(queued_by_tenant)
+            },
+        }
+
+
+_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, FairScheduler]" = weakref.WeakKeyDictionary()
+
+
+def _scheduler() -> FairScheduler:
+    loop = asyncio.get_running_loop()
+    scheduler = _schedulers.get(loop)
+    if scheduler is None:
+        scheduler = _schedulers[loop] = FairScheduler(SCHEDULER_MAX_CONCURRENCY, SCHEDULER_TENANT_CONCURRENCY)
+    return scheduler
+
+
+@asynccontextmanager
+async def upstream_slot() -> AsyncIterator[None]:
+    """Wait for the current tenant's turn to make an upstream call."""
+    if SCHEDULER_MAX_CONCURRENCY <= 0:
+        yield
+        return
+    async with _scheduler().slot(current_tenant.get(), current_priority.get()):
+        yield
+
+
+def scheduler_stats() -> Dict[str, Any]:
+    """Queue depth and in-flight calls, summed over all event loops."""
+    totals: Dict[str, Any] = {"in_flight": 0, "queued": 0, "queued_by_priority": {}, "tenants": {}}
+    for scheduler in list(_schedulers.values()):
+        stats = scheduler.stats()
+        totals["in_flight"] += stats["in_flight"]
+        totals["queued"] += stats["queued"]
+        for priority, count in stats["queued_by_priority"].items():
+            totals["queued_by_priority"][priority] = totals["queued_by_priority"].get(priority, 0) + count
+        for tenant, counts in stats["tenants"].items():
+            entry = totals["tenants"].setdefault(tenant, {"in_flight": 0, "queued": 0})
+            entry["in_flight"] += counts["in_flight"]
+            entry["queued"] += counts["queued"]
+    return totals
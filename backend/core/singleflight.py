@@ -0,0 +1,60 @@
+"""
+Coalescing of identical in-flight calls ("single-flight").
+
+When several coroutines ask for the same key at once, only the first one runs
+the call; the others wait for it and receive the same result or exception.
+The call runs in its own task, so a caller that goes away (a client that
+disconnects) does not cancel it for everyone else.
+"""
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        # Tasks are bound to their loop, so calls are only shared within one loop
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Task]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run ``fn()`` unless a call with ``key`` is already in flight, then share its outcome."""
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        task = calls.get(key)
+        if task is None:
+            task = loop.create_task(fn())
+            calls[key] = task
+            task.add_done_callback(lambda done: self._finished(calls, key, done))
+            with self._lock:
+                self.leaders += 1
+        else:
+            with self._lock:
+                self.followers += 1
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _finished(calls: Dict[Hashable, asyncio.Task], key: Hashable, task: asyncio.Task) -> None:
+        if calls.get(key) is task:
+            del calls[key]
+        # Mark the exception as retrieved in case every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.leaders + self.followers
+            return {
+                "calls": self.leaders,
+                "coalesced": self.followers,
+                "coalesced_ratio": round(self.followers / total, 4) if total else 0.0,
+                "in_flight": sum(len(calls) for calls in list(self._calls.values())),
+            }
+
+
+single_flight = SingleFlight()
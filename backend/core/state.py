@@ -0,0 +1,156 @@
+"""
+State shared between API worker processes.
+
+Each worker keeps its caches, job table and rate-limit buckets in memory.
+With several workers (``WEB_CONCURRENCY``), or several hosts, that state
+must also be visible to the other workers. With ``STATE_BACKEND=redis``
+those components read and write through ``shared_state``; with the default
+``memory`` backend ``shared_state`` is None and everything stays in-process.
+
+Shared-state calls are coroutines, short and bounded by ``STATE_TIMEOUT``.
+They raise ``StateError`` when the backend is unreachable; callers then fall
+back to their local state rather than failing the request. After a failure
+the backend is not contacted again for ``STATE_COOLDOWN`` seconds, so an
+outage costs one timeout rather than one per call.
+"""
+import abc
+import asyncio
+import time
+import weakref
+from typing import Optional
+
+from .config import REDIS_URL, STATE_BACKEND, STATE_COOLDOWN, STATE_KEY_PREFIX, STATE_TIMEOUT
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class StateError(Exception):
+    pass
+
+
+class SharedState(abc.ABC):
+    """Interface of a shared state backend; values are bytes, TTLs seconds."""
+
+    name = "shared"
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def take_token(self, key: str, rate: float, burst: float) -> float:
+        """Token-bucket take shared by all workers; 0 on success, else seconds to wait."""
+
+    async def close(self) -> None:
+        pass
+
+
+# Atomic token bucket: refill by elapsed time (server clock), take one token
+_TAKE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+elseif rate <= 0 then
+    wait = -1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+if rate > 0 then
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+end
+return tostring(wait)
+"""
+
+
+class RedisState(SharedState):
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "visionary:", timeout: float = 0.5, cooldown: float = 5.0):
+        import redis.asyncio
+
+        self.url = url
+        self.prefix = prefix
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self._redis = redis.asyncio
+        self._errors = (redis.RedisError, OSError, asyncio.TimeoutError)
+        # asyncio connections are bound to their loop, so each loop gets its own client
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+        self._down_until = 0.0
+        self.failures = 0
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(loop)
+        if entry is None:
+            client = self._redis.Redis.from_url(self.url, socket_timeout=self.timeout, socket_connect_timeout=self.timeout)
+            entry = self._clients.setdefault(loop, (client, client.register_script(_TAKE_TOKEN)))
+        return entry
+
+    async def _call(self, method, *args, **kwargs):
+        remaining = self._down_until - time.monotonic()
+        if remaining > 0:
+            raise StateError(f"{self.name} state backend unavailable, retrying in {remaining:.1f}s")
+        try:
+            return await method(*args, **kwargs)
+        except self._errors as e:
+            self.failures += 1
+            self._down_until = time.monotonic() + self.cooldown
+            logger.warning("state.backend_failed", backend=self.name, error=str(e), cooldown_s=self.cooldown)
+            raise StateError(f"{self.name} state backend unavailable: {e}") from e
+
+    async def get(self, key: str) -> Optional[bytes]:
+        client, _ = self._client()
+        return await self._call(client.get, self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        client, _ = self._client()
+        px = max(1, int(ttl * 1000)) if ttl else None
+        await self._call(client.set, self.prefix + key, value, px=px)
+
+    async def delete(self, key: str) -> None:
+        client, _ = self._client()
+        await self._call(client.delete, self.prefix + key)
+
+    async def take_token(self, key: str, rate: float, burst: float) -> float:
+        _, take_token = self._client()
+        wait = float(await self._call(take_token, keys=[self.prefix + key], args=[rate, burst]))
+        return float("inf") if wait < 0 else wait
+
+    async def close(self) -> None:
+        entry = self._clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
+
+
+def _create_state() -> Optional[SharedState]:
+    if STATE_BACKEND != "redis":
+        return None
+    try:
+        state = RedisState(REDIS_URL, STATE_KEY_PREFIX, STATE_TIMEOUT, STATE_COOLDOWN)
+    except ImportError as e:
+        logger.warning("state.unavailable", detail=f"STATE_BACKEND is redis but {e.name or e} is missing, state is per-process")
+        return None
+    logger.info("state.shared", backend=state.name)
+    return state
+
+
+shared_state = _create_state()
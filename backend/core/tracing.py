@@ -0,0 +1,199 @@
+"""
+Optional OpenTelemetry tracing.
+
+With ``TRACING_ENABLED`` and ``opentelemetry-sdk`` installed, each API request,
+service call, workflow step and upstream HTTP attempt becomes a span, so a
+slow request can be split into time spent here and time spent at Bria.
+Without them every helper here is a cheap no-op, and the rest of the code
+never has to check.
+
+    with span("workflow.step", step="packshot") as current:
+        current.set_attribute("result.count", 2)
+
+    @traced()
+    async def create_packshot_async(...): ...
+"""
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Optional, TypeVar
+
+from .config import (
+    TRACING_ENABLED,
+    TRACING_EXPORTER,
+    TRACING_FILE,
+    TRACING_SAMPLE_RATIO,
+    TRACING_SERVICE_NAME,
+)
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def add_event(self, name: str, attributes: Optional[dict] = None) -> None:
+        pass
+
+    def update_name(self, name: str) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_tracer = None
+_trace = None
+_propagate = None
+
+
+def _file_exporter(path: str):
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Line-buffered so a crash loses at most the span being written
+    out = open(path, "a", buffering=1)
+    return ConsoleSpanExporter(out=out, formatter=lambda s: s.to_json(indent=None) + "\n")
+
+
+def _create_exporter():
+    if TRACING_EXPORTER == "file":
+        return _file_exporter(TRACING_FILE)
+    if TRACING_EXPORTER == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter()
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    return OTLPSpanExporter()
+
+
+def _setup() -> None:
+    global _tracer, _trace, _propagate
+    if not TRACING_ENABLED:
+        return
+    try:
+        from opentelemetry import propagate, trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        exporter = _create_exporter()
+    except ImportError as e:
+        logger.warning("tracing.unavailable", detail=f"TRACING_ENABLED is set but {e.name or e} is missing, tracing is off")
+        return
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)),
+    )
+    # Spans are exported from a background thread, off the request path
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("visionary")
+    _trace = trace
+    _propagate = propagate
+    logger.info("tracing.enabled", exporter=TRACING_EXPORTER, sample_ratio=TRACING_SAMPLE_RATIO)
+
+
+_setup()
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Run the block in a child span of the current one; exceptions are recorded."""
+    if _tracer is None:
+        yield _NOOP_SPAN
+        return
+    with _tracer.start_as_current_span(name, attributes=_clean(attributes)) as current:
+        yield current
+
+
+def current_span() -> Any:
+    """The active span, for adding attributes or events from deeper code."""
+    if _trace is None:
+        return _NOOP_SPAN
+    return _trace.get_current_span()
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Wrap an async function in a span named ``name`` (default ``service.<function>``)."""
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        base = fn.__name__[:-len("_async")] if fn.__name__.endswith("_async") else fn.__name__
+        span_name = name or f"service.{base}"
+
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            if _tracer is None:
+                return await fn(*args, **kwargs)
+            with span(span_name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _clean(attributes: dict) -> dict:
+    # OpenTelemetry only accepts primitive attribute values
+    return {
+        key: value if isinstance(value, (str, bool, int, float)) else str(value)
+        for key, value in attributes.items() if value is not None
+    }
+
+
+class TracingMiddleware:
+    """
+    Pure ASGI middleware opening the server span of each request.
+
+    The span is renamed to the matched route once routing is done, and a
+    W3C ``traceparent`` header from the caller is honoured. Recent FastAPI
+    versions open a server span themselves; then this middleware steps aside.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if _tracer is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        from opentelemetry.trace import SpanKind, Status, StatusCode
+
+        outer = _trace.get_current_span()
+        if outer.is_recording() and getattr(outer, "kind", None) == SpanKind.SERVER:
+            await self.app(scope, receive, send)
+            return
+
+        carrier = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        context = _propagate.extract(carrier)
+        method = scope["method"]
+        start = time.perf_counter()
+        with _tracer.start_as_current_span(f"{method} {scope['path']}", context=context, kind=SpanKind.SERVER) as current:
+            current.set_attribute("http.request.method", method)
+
+            async def traced_send(message):
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    current.set_attribute("http.response.status_code", status)
+                    current.set_attribute("http.time_to_response_ms", round((time.perf_counter() - start) * 1000, 1))
+                    if status >= 500:
+                        current.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, traced_send)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    current.update_name(f"{method} {route}")
+                    current.set_attribute("http.route", route)
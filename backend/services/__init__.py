@@ -1,10 +1,32 @@
-from .lifestyle_shot import lifestyle_shot_by_text, lifestyle_shot_by_image
-from .shadow import add_shadow
-from .packshot import create_packshot
-from .prompt_enhancement import enhance_prompt
-from .generative_fill import generative_fill
-from .hd_image_generation import generate_hd_image
-from .erase_foreground import erase_foreground
+from .lifestyle_shot import (
+    lifestyle_shot_by_text,
+    lifestyle_shot_by_image,
+    lifestyle_shot_by_text_async,
+    lifestyle_shot_by_image_async
+)
+from .shadow import add_shadow, add_shadow_async
+from .packshot import create_packshot, create_packshot_async
+from .prompt_enhancement import (
+    enhance_prompt,
+    enhance_prompt_async,
+    warm_prompt_cache,
+    warm_prompt_cache_async
+)
+from .generative_fill import (
+    generative_expand,
+    generative_expand_async,
+    generative_fill,
+    generative_fill_async,
+    generative_fill_masked,
+    generative_fill_masked_async,
+    generative_fill_prepared,
+    generative_fill_prepared_async,
+    prepare_fill_async
+)
+from .hd_image_generation import generate_hd_image, generate_hd_image_async
+from .erase_foreground import erase_foreground, erase_foreground_async
+from .background import remove_background, remove_background_async
+from .variants import collect, fan_out
 
 __all__ = [
     'lifestyle_shot_by_text',
@@ -13,6 +35,27 @@ __all__ = [
     'create_packshot',
     'enhance_prompt',
     'generative_fill',
+    'generative_fill_masked',
+    'generative_fill_prepared',
+    'generative_expand',
     'generate_hd_image',
-    'erase_foreground'
-] 
\ No newline at end of file
+    'erase_foreground',
+    'remove_background',
+    'warm_prompt_cache',
+    'lifestyle_shot_by_text_async',
+    'lifestyle_shot_by_image_async',
+    'add_shadow_async',
+    'create_packshot_async',
+    'enhance_prompt_async',
+    'generative_fill_async',
+    'generative_fill_masked_async',
+    'generative_fill_prepared_async',
+    'prepare_fill_async',
+    'generative_expand_async',
+    'generate_hd_image_async',
+    'erase_foreground_async',
+    'remove_background_async',
+    'warm_prompt_cache_async',
+    'fan_out',
+    'collect'
+]
@@ -0,0 +1,276 @@
+from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import io
+import threading
+import time
+
+from PIL import Image
+
+from core.cache import DiskStore, request_key_async, result_cache
+from core.config import (
+    CUTOUT_CACHE_DIR,
+    CUTOUT_CACHE_ENABLED,
+    CUTOUT_CACHE_MAX_DISK_BYTES,
+    CUTOUT_CACHE_MAX_MEMORY_BYTES,
+    CUTOUT_CACHE_TTL,
+)
+from core.cpu import cpu_pool
+from core.http import bria_url, fetch_bytes, make_sync, parse_json, post_json
+from core.log import get_logger
+from core.payload import ImageInput, binary_digest
+from core.results import extract_result_urls
+from core.singleflight import SingleFlight
+from core.state import SharedState, StateError, shared_state
+from core.tracing import current_span, traced
+
+logger = get_logger(__name__)
+
+
+@traced()
+async def remove_background_async(
+    api_key: str,
+    image_data: Optional[ImageInput] = None,
+    image_url: str = None,
+    content_moderation: bool = False
+) -> Dict[str, Any]:
+    """
+    Remove the background of an image, leaving the foreground on transparency.
+
+    Args:
+        api_key: Bria AI API key
+        image_data: Image bytes or file object (optional if image_url provided)
+        image_url: URL of the image (optional if image_data provided)
+        content_moderation: Whether to enable content moderation
+    """
+    url = bria_url("/v1/background/remove")
+
+    # Prepare request data
+    data = {
+        'content_moderation': content_moderation
+    }
+
+    # Add image data
+    if image_url:
+        data['image_url'] = image_url
+    elif image_data:
+        # Base64-encoded while the request body is streamed
+        data['file'] = image_data
+    else:
+        raise ValueError("Either image_data or image_url must be provided")
+
+    # Same image and parameters always give the same result
+    cache_key = await request_key_async(url, data, api_key)
+    cached = await result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await post_json(url, api_key, data, coalesce_key=cache_key)
+        response.raise_for_status()
+
+        result = parse_json(response)
+        await result_cache.set(cache_key, result)
+        return result
+    except Exception as e:
+        raise Exception(f"Background removal failed: {str(e)}")
+
+
+class CutoutCache:
+    """
+    Background-removed cutouts (RGBA PNG bytes) keyed by the SHA-256 of the source image.
+
+    Result URLs expire, so the cutout itself is kept: in a memory LRU bounded
+    by bytes, in the shared state backend, if any, and as files on disk.
+    """
+
+    # Digests of recently seen images that have no cutout yet
+    MAX_SIGHTINGS = 10000
+
+    def __init__(
+        self,
+        max_memory_bytes: int,
+        ttl: float,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+        enabled: bool = True,
+        shared: Optional[SharedState] = None
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl = ttl
+        self.disk = DiskStore(disk_dir, ".png", max_disk_bytes) if disk_dir else None
+        self.enabled = enabled
+        self.shared = shared
+        self._memory: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._sightings: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.segmentations = 0
+
+    def _remember(self, digest: str, cutout: bytes, stored_at: float) -> None:
+        previous = self._memory.pop(digest, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous[1])
+        self._memory[digest] = (stored_at, cutout)
+        self._memory_bytes += len(cutout)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def sighted(self, digest: str) -> bool:
+        """Record that an image without a cutout was seen; True if it was seen within the TTL before."""
+        now = time.time()
+        with self._lock:
+            seen_at = self._sightings.pop(digest, None)
+            self._sightings[digest] = now
+            while len(self._sightings) > self.MAX_SIGHTINGS:
+                self._sightings.popitem(last=False)
+            return seen_at is not None and now - seen_at <= self.ttl
+
+    async def get(self, digest: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(digest)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(digest)
+                self.hits += 1
+                return entry[1]
+        cutout = None
+        stored_at = now
+        if self.shared is not None:
+            try:
+                cutout = await self.shared.get(f"cutout:{digest}")
+            except StateError as e:
+                logger.warning("cutout_cache.shared_unavailable", error=str(e))
+        if cutout is None and self.disk is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self.disk.read, digest, self.ttl, now)
+            if entry is not None:
+                stored_at, cutout = entry
+        with self._lock:
+            if cutout is None:
+                self.misses += 1
+            else:
+                self._remember(digest, cutout, stored_at)
+                self.hits += 1
+            return cutout
+
+    async def set(self, digest: str, cutout: bytes) -> None:
+        if not self.enabled:
+            return
+        if self.shared is not None:
+            try:
+                await self.shared.set(f"cutout:{digest}", cutout, self.ttl)
+            except StateError as e:
+                logger.warning("cutout_cache.shared_unavailable", error=str(e))
+        with self._lock:
+            self.segmentations += 1
+            self._remember(digest, cutout, time.time())
+        if self.disk is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.disk.write, digest, cutout)
+            except OSError as e:
+                logger.warning("cutout_cache.disk_write_failed", error=str(e))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "segmentations": self.segmentations,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self.disk.size if self.disk is not None else None,
+            }
+
+
+cutout_cache = CutoutCache(
+    max_memory_bytes=CUTOUT_CACHE_MAX_MEMORY_BYTES,
+    ttl=CUTOUT_CACHE_TTL,
+    disk_dir=CUTOUT_CACHE_DIR,
+    max_disk_bytes=CUTOUT_CACHE_MAX_DISK_BYTES,
+    enabled=CUTOUT_CACHE_ENABLED,
+    shared=shared_state,
+)
+# Packshot, shadow and lifestyle of one SKU often start together: segment it once
+_segmenting = SingleFlight()
+
+
+async def cutout_async(api_key: str, image_data: ImageInput) -> bytes:
+    """
+    Return the background-removed cutout of an image as RGBA PNG bytes.
+
+    Served from ``cutout_cache`` when this image was segmented before;
+    concurrent requests for the same image share one upstream call.
+    """
+    digest = await cpu_pool.run_thread(binary_digest, image_data)
+    cached = await cutout_cache.get(digest)
+    if cached is not None:
+        current_span().add_event("cutout_cache_hit")
+        return cached
+    return await _segment(api_key, image_data, digest)
+
+
+async def _segment(api_key: str, image_data: ImageInput, digest: str) -> bytes:
+    async def segment() -> bytes:
+        result = await remove_background_async(api_key, image_data=image_data)
+        urls = extract_result_urls(result)
+        if not urls:
+            raise Exception("Background removal returned no result URL")
+        cutout = await fetch_bytes(urls[0])
+        await cutout_cache.set(digest, cutout)
+        return cutout
+
+    return await _segmenting.do(digest, segment)
+
+
+def has_alpha(image_data: ImageInput) -> bool:
+    """Whether the image carries transparency (only the header is decoded)."""
+    source = io.BytesIO(image_data) if isinstance(image_data, (bytes, bytearray, memoryview)) else image_data
+    try:
+        source.seek(0)
+        with Image.open(source) as image:
+            return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return False
+    finally:
+        source.seek(0)
+
+
+async def segmented_input(api_key: str, image_data: Optional[ImageInput], force_rmbg: bool) -> Tuple[Optional[ImageInput], bool]:
+    """
+    The image and ``force_rmbg`` flag to send to a product endpoint.
+
+    Product endpoints remove the background of images without transparency
+    (or of any image with ``force_rmbg``) on every call. When that would
+    happen, the cached cutout is sent instead with ``force_rmbg=False``, so
+    each image is segmented once however many derivatives are made of it.
+    An image is only segmented ahead of the endpoint the second time it is
+    seen: for a one-off image the extra round trip would buy nothing.
+    If the cutout cannot be made the original request is sent as before.
+    """
+    if not CUTOUT_CACHE_ENABLED or image_data is None:
+        return image_data, force_rmbg
+    if not force_rmbg and has_alpha(image_data):
+        return image_data, force_rmbg
+    try:
+        digest = await cpu_pool.run_thread(binary_digest, image_data)
+        cached = await cutout_cache.get(digest)
+        if cached is not None:
+            current_span().add_event("cutout_cache_hit")
+            return cached, False
+        if not cutout_cache.sighted(digest):
+            return image_data, force_rmbg
+        return await _segment(api_key, image_data, digest), False
+    except Exception as e:
+        logger.warning("cutout.failed", error=str(e))
+        return image_data, force_rmbg
+
+
+remove_background = make_sync(remove_background_async)
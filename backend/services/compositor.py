@@ -0,0 +1,230 @@
+"""
+Local compositing engine for packshots and shadows.
+
+Once a product has been cut out (see ``services.background``), a packshot on
+a solid colour and a regular or float shadow are deterministic image
+operations. This engine renders them with Pillow and NumPy in tens of
+milliseconds instead of a round trip to Bria:
+
+* packshot: the cutout is trimmed to its alpha bounding box and centred on a
+  square canvas of ``background_color`` (or left transparent);
+* regular shadow: the product's alpha, offset and blurred, tinted with
+  ``shadow_color`` at ``shadow_intensity`` percent;
+* float shadow: a soft ellipse under the product, ``shadow_width`` percent
+  wider (or narrower) than the product and ``shadow_height`` percent of the
+  default height.
+
+Which engine runs is chosen per request with ``engine``: ``remote`` (Bria),
+``local``, or ``auto`` (local whenever the request can be rendered here).
+"""
+import io
+import re
+import threading
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from core.config import COMPOSITOR_ENGINE
+from core.cpu import cpu_pool
+from core.log import get_logger
+from core.payload import ImageInput, iter_binary
+from core.results import to_data_url
+from core.tracing import span
+
+logger = get_logger(__name__)
+
+ENGINES = ("local", "remote", "auto")
+
+# Product margin on each side of a packshot, as a fraction of the canvas
+PACKSHOT_MARGIN = 0.1
+# Float shadow height, as a fraction of the product width, at shadow_height=100
+FLOAT_SHADOW_DEPTH = 0.25
+OUTPUT_JPEG_QUALITY = 95
+
+_HEX_COLOR = re.compile(r"^#?([0-9a-fA-F]{3}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})$")
+
+
+def parse_color(value: Optional[str]) -> Optional[Tuple[int, int, int, int]]:
+    """RGBA of a ``#RGB``, ``#RRGGBB`` or ``#RRGGBBAA`` colour, ``(0, 0, 0, 0)`` for transparent, None otherwise."""
+    if value is None:
+        return None
+    if value.strip().lower() == "transparent":
+        return 0, 0, 0, 0
+    match = _HEX_COLOR.match(value.strip())
+    if match is None:
+        return None
+    digits = match.group(1)
+    if len(digits) == 3:
+        digits = "".join(digit * 2 for digit in digits)
+    if len(digits) == 6:
+        digits += "ff"
+    return tuple(int(digits[i:i + 2], 16) for i in range(0, 8, 2))
+
+
+def load_cutout(data: bytes) -> Image.Image:
+    """Decode a cutout as RGBA; raises ``ValueError`` if it carries no transparency."""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode not in ("RGBA", "LA", "PA") and "transparency" not in image.info:
+            raise ValueError("the local engine needs an image with an alpha channel")
+        return image.convert("RGBA")
+
+
+def _encode(image: Image.Image) -> Tuple[bytes, str]:
+    """Opaque results as high-quality JPEG, transparent ones as fast-compressed PNG."""
+    buffer = io.BytesIO()
+    if image.getchannel("A").getextrema()[0] == 255:
+        image.convert("RGB").save(buffer, format="JPEG", quality=OUTPUT_JPEG_QUALITY)
+        return buffer.getvalue(), "image/jpeg"
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue(), "image/png"
+
+
+def render_packshot(cutout: Image.Image, background_color: str) -> Tuple[bytes, str]:
+    """Centre the trimmed product on a square canvas of ``background_color``."""
+    color = parse_color(background_color)
+    if color is None:
+        raise ValueError(f"unsupported background_color for the local engine: {background_color!r}")
+    box = cutout.getchannel("A").getbbox()
+    product = cutout.crop(box) if box else cutout
+    side = int(round(max(product.size) / (1.0 - 2 * PACKSHOT_MARGIN)))
+    canvas = Image.new("RGBA", (side, side), color)
+    canvas.alpha_composite(product, ((side - product.width) // 2, (side - product.height) // 2))
+    return _encode(canvas)
+
+
+def _soft_blur(mask: Image.Image, radius: float) -> Image.Image:
+    """Gaussian blur; wide radii are blurred at reduced scale, which looks the same on a shadow."""
+    factor = max(1, min(4, int(radius // 3)))
+    if factor == 1:
+        return mask.filter(ImageFilter.GaussianBlur(radius))
+    small = mask.reduce(factor).filter(ImageFilter.GaussianBlur(radius / factor))
+    return small.resize(mask.size, Image.BILINEAR)
+
+
+def _float_shadow(alpha: Image.Image, dx: int, dy: int, width: float, height: float) -> Image.Image:
+    """Soft ellipse centred under the product's base, as an ``L`` mask."""
+    shadow = Image.new("L", alpha.size, 0)
+    box = alpha.point(lambda value: 255 if value > 127 else 0).getbbox()
+    if box is None:
+        return shadow
+    product_width = box[2] - box[0]
+    cx = (box[0] + box[2]) / 2.0 + dx
+    cy = box[3] - 1 + dy
+    rx = max(1.0, product_width / 2.0 * (1.0 + width / 100.0))
+    ry = max(1.0, product_width / 2.0 * FLOAT_SHADOW_DEPTH * height / 100.0)
+    # Only the ellipse's bounding box is computed
+    left, top = max(0, int(cx - rx)), max(0, int(cy - ry))
+    right, bottom = min(alpha.width, int(cx + rx) + 1), min(alpha.height, int(cy + ry) + 1)
+    if left >= right or top >= bottom:
+        return shadow
+    y, x = np.ogrid[top:bottom, left:right]
+    distance = ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2
+    falloff = np.clip(1.0 - distance, 0.0, 1.0) ** 1.5
+    shadow.paste(Image.fromarray((falloff * 255.0 + 0.5).astype(np.uint8)), (left, top))
+    return shadow
+
+
+def render_shadow(
+    cutout: Image.Image,
+    shadow_type: str = "regular",
+    background_color: Optional[str] = None,
+    shadow_color: str = "#000000",
+    shadow_offset: Sequence[float] = (0, 15),
+    shadow_intensity: float = 60,
+    shadow_blur: Optional[float] = None,
+    shadow_width: Optional[float] = None,
+    shadow_height: Optional[float] = 70
+) -> Tuple[bytes, str]:
+    """Draw the product over its shadow, on ``background_color`` or transparency."""
+    if shadow_type not in ("regular", "float"):
+        raise ValueError(f"unsupported shadow_type for the local engine: {shadow_type!r}")
+    tint = parse_color(shadow_color)
+    background = parse_color(background_color) if background_color else (0, 0, 0, 0)
+    if tint is None or background is None:
+        raise ValueError("unsupported colour for the local engine")
+
+    alpha = cutout.getchannel("A")
+    dx, dy = (int(round(value)) for value in shadow_offset)
+    if shadow_type == "regular":
+        shadow = Image.new("L", alpha.size, 0)
+        shadow.paste(alpha, (dx, dy))
+    else:
+        shadow = _float_shadow(alpha, dx, dy, shadow_width or 0.0, 70.0 if shadow_height is None else shadow_height)
+    # Bria's blur is the spread of the shadow edge, roughly twice a Gaussian sigma
+    blur = 15.0 if shadow_blur is None else float(shadow_blur)
+    if blur > 0:
+        shadow = _soft_blur(shadow, blur / 2.0)
+    opacity = max(0.0, min(1.0, float(shadow_intensity) / 100.0)) * tint[3] / 255.0
+    shadow = shadow.point(np.round(np.arange(256) * opacity).astype(np.uint8).tolist())
+
+    layer = Image.new("RGBA", cutout.size, tint[:3] + (0,))
+    layer.putalpha(shadow)
+    canvas = Image.new("RGBA", cutout.size, background)
+    canvas.alpha_composite(layer)
+    canvas.alpha_composite(cutout)
+    return _encode(canvas)
+
+
+def resolve_engine(engine: Optional[str]) -> str:
+    engine = (engine or COMPOSITOR_ENGINE).strip().lower()
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(ENGINES)}, not {engine!r}")
+    return engine
+
+
+def _render(render: Callable[..., Tuple[bytes, str]], data: ImageInput, params: Dict[str, Any]) -> Tuple[bytes, str]:
+    """Decode and render in one pool task, so only encoded images cross processes."""
+    return render(load_cutout(b"".join(iter_binary(data))), **params)
+
+
+async def render_locally(
+    engine: str,
+    image_data: Optional[ImageInput],
+    render: Callable[..., Tuple[bytes, str]],
+    blocker: Optional[str] = None,
+    **params: Any
+) -> Optional[Dict[str, Any]]:
+    """
+    Render a request with the local engine, as a Bria-shaped ``result_url`` payload.
+
+    Returns None when the remote engine should be used instead: always for
+    ``remote``, and for ``auto`` when the request cannot be done here
+    (``blocker`` names a reason known up front, e.g. content moderation).
+    With ``engine="local"`` those cases raise ``ValueError``.
+    """
+    if engine == "remote":
+        return None
+    if blocker is None and image_data is None:
+        blocker = "an uploaded image"
+    if blocker is not None:
+        if engine == "local":
+            raise ValueError(f"the local engine cannot handle {blocker}")
+        _count("fallbacks")
+        return None
+
+    try:
+        with span("compositor.render", operation=render.__name__):
+            output = await cpu_pool.run(_render, render, image_data, params)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        if engine == "local":
+            raise ValueError(f"Local engine failed: {e}")
+        logger.info("compositor.fallback", operation=render.__name__, reason=str(e))
+        _count("fallbacks")
+        return None
+    _count("rendered")
+    return {"result_url": to_data_url(*output)}
+
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"rendered": 0, "fallbacks": 0}
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def compositor_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return {"default_engine": COMPOSITOR_ENGINE, **_stats}
@@ -1,10 +1,13 @@
 from typing import Dict, Any, Optional
-import requests
-import base64
+from core.cache import request_key_async, result_cache
+from core.http import bria_url, make_sync, parse_json, post_json
+from core.payload import ImageInput
+from core.tracing import traced
 
-def erase_foreground(
+@traced()
+async def erase_foreground_async(
     api_key: str,
-    image_data: bytes = None,
+    image_data: Optional[ImageInput] = None,
     image_url: str = None,
     content_moderation: bool = False
 ) -> Dict[str, Any]:
@@ -13,17 +16,11 @@ def erase_foreground(
     
     Args:
         api_key: Bria AI API key
-        image_data: Image data in bytes (optional if image_url provided)
+        image_data: Image bytes or file object (optional if image_url provided)
         image_url: URL of the image (optional if image_data provided)
         content_moderation: Whether to enable content moderation
     """
-    url = "https://engine.prod.bria-api.com/v1/erase_foreground"
-    
-    headers = {
-        'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
+    url = bria_url("/v1/erase_foreground")
     
     # Prepare request data
     data = {
@@ -34,24 +31,28 @@ def erase_foreground(
     if image_url:
         data['image_url'] = image_url
     elif image_data:
-        data['file'] = base64.b64encode(image_data).decode('utf-8')
+        # Base64-encoded while the request body is streamed
+        data['file'] = image_data
     else:
         raise ValueError("Either image_data or image_url must be provided")
     
+    # Same image and parameters always give the same result
+    cache_key = await request_key_async(url, data, api_key)
+    cached = await result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        print(f"Making request to: {url}")
-        print(f"Headers: {headers}")
-        print(f"Data: {data}")
-        
-        response = requests.post(url, headers=headers, json=data)
+        response = await post_json(url, api_key, data, coalesce_key=cache_key)
         response.raise_for_status()
         
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        return response.json()
+        result = parse_json(response)
+        await result_cache.set(cache_key, result)
+        return result
     except Exception as e:
         raise Exception(f"Erase foreground failed: {str(e)}")
 
+erase_foreground = make_sync(erase_foreground_async)
+
 # Export the function
-__all__ = ['erase_foreground'] 
\ No newline at end of file
+__all__ = ['erase_foreground', 'erase_foreground_async'] 
\ No newline at end of file
@@ -1,11 +1,18 @@
 from typing import Dict, Any, Optional
-import requests
-import base64
+import asyncio
+from core.cache import request_key_async, result_cache
+from core.cpu import cpu_pool
+from core.http import bria_url, fetch_bytes, make_sync, parse_json, post_json
+from core.payload import ImageInput
+from core.results import extract_result_urls, map_result_urls, to_data_url
+from core.tracing import span, traced
+from .masks import FillPlan, Outpainting, Tile, composite, prepare_expand, prepare_fill
 
-def generative_fill(
+@traced()
+async def generative_fill_async(
     api_key: str,
-    image_data: bytes,
-    mask_data: bytes,
+    image_data: ImageInput,
+    mask_data: ImageInput,
     prompt: str,
     negative_prompt: Optional[str] = None,
     num_results: int = 4,
@@ -19,8 +26,8 @@ def generative_fill(
     
     Args:
         api_key: Bria AI API key
-        image_data: Image data in bytes
-        mask_data: Mask image data in bytes
+        image_data: Image bytes or file object
+        mask_data: Mask image bytes or file object
         prompt: Description of what to generate in the masked area
         negative_prompt: Description of what to avoid (optional)
         num_results: Number of variations to generate (1-4)
@@ -29,22 +36,12 @@ def generative_fill(
         content_moderation: Whether to enable content moderation
         mask_type: Type of mask ('manual' or 'automatic')
     """
-    url = "https://engine.prod.bria-api.com/v1/gen_fill"
+    url = bria_url("/v1/gen_fill")
     
-    headers = {
-        'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
-    
-    # Convert image and mask to base64
-    image_base64 = base64.b64encode(image_data).decode('utf-8')
-    mask_base64 = base64.b64encode(mask_data).decode('utf-8')
-    
-    # Prepare request data
+    # Prepare request data (image and mask are base64-encoded while the body is streamed)
     data = {
-        'file': image_base64,
-        'mask_file': mask_base64,
+        'file': image_data,
+        'mask_file': mask_data,
         'mask_type': mask_type,
         'prompt': prompt,
         'num_results': num_results,
@@ -58,17 +55,198 @@ def generative_fill(
     if seed is not None:
         data['seed'] = seed
     
+    # Only seeded generations are reproducible enough to cache
+    cache_key = await request_key_async(url, data, api_key) if seed is not None else None
+    if cache_key:
+        cached = await result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
     try:
-        print(f"Making request to: {url}")
-        print(f"Headers: {headers}")
-        print(f"Data: {data}")
-        
-        response = requests.post(url, headers=headers, json=data)
+        response = await post_json(url, api_key, data, coalesce_key=cache_key)
         response.raise_for_status()
         
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        return response.json()
+        result = parse_json(response)
+        if cache_key:
+            await result_cache.set(cache_key, result)
+        return result
+    except Exception as e:
+        raise Exception(f"Generative fill failed: {str(e)}")
+
+async def prepare_fill_async(image_data: ImageInput, mask_data: ImageInput, sync: bool = True) -> FillPlan:
+    """
+    Validate and clean up a fill mask, and crop around it when that pays off.
+
+    Raises ``services.masks.MaskError`` for empty or misaligned masks. The
+    plan can be filled any number of times with ``generative_fill_prepared_async``.
+    """
+    with span("masks.prepare") as current:
+        plan = await cpu_pool.run_thread(prepare_fill, image_data, mask_data, sync)
+        current.set_attribute("masks.cropped", plan.box is not None)
+        current.set_attribute("masks.sent_bytes", plan.sent_bytes)
+    return plan
+
+@traced()
+async def generative_fill_prepared_async(
+    api_key: str,
+    plan: FillPlan,
+    prompt: str,
+    negative_prompt: Optional[str] = None,
+    num_results: int = 4,
+    sync: bool = False,
+    seed: Optional[int] = None,
+    content_moderation: bool = False
+) -> Dict[str, Any]:
+    """
+    Generative fill of a plan from ``prepare_fill_async``.
+
+    A cropped plan sends only the crop, and the generated crops are blended
+    back into the full image; those results are returned inline as
+    ``data:`` URLs in place of the upstream ones.
+    """
+    result = await generative_fill_async(
+        api_key=api_key,
+        image_data=plan.image,
+        mask_data=plan.mask,
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        num_results=num_results,
+        sync=sync,
+        seed=seed,
+        content_moderation=content_moderation
+    )
+    if plan.box is None:
+        return result
+
+    try:
+        urls = extract_result_urls(result)
+        generated = await asyncio.gather(*(fetch_bytes(url) for url in urls))
+        with span("masks.composite", **{"masks.results": len(urls)}):
+            composited = await cpu_pool.run_thread(lambda: [composite(plan, image) for image in generated])
     except Exception as e:
-        raise Exception(f"Generative fill failed: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Generative fill failed: {str(e)}")
+    inlined = {url: to_data_url(*image) for url, image in zip(urls, composited)}
+    return map_result_urls(result, lambda url: inlined.get(url, url))
+
+@traced()
+async def generative_fill_masked_async(
+    api_key: str,
+    image_data: ImageInput,
+    mask_data: ImageInput,
+    prompt: str,
+    negative_prompt: Optional[str] = None,
+    num_results: int = 4,
+    sync: bool = False,
+    seed: Optional[int] = None,
+    content_moderation: bool = False
+) -> Dict[str, Any]:
+    """
+    Generative fill with the mask validated and cleaned up locally first.
+
+    Empty or misaligned masks raise ``services.masks.MaskError`` without any
+    upstream call. With ``sync=True`` and a mask that covers a small part of
+    the image, only a padded crop around the mask is sent, and the generated
+    crops are blended back into the full image; those results are returned
+    inline as ``data:`` URLs in place of the upstream ones.
+
+    Takes the same arguments as ``generative_fill``.
+    """
+    plan = await prepare_fill_async(image_data, mask_data, sync)
+    return await generative_fill_prepared_async(
+        api_key=api_key,
+        plan=plan,
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        num_results=num_results,
+        sync=sync,
+        seed=seed,
+        content_moderation=content_moderation
+    )
+
+@traced()
+async def generative_expand_async(
+    api_key: str,
+    image_data: ImageInput,
+    expansion_amount: int,
+    prompt: str,
+    mask_data: Optional[ImageInput] = None,
+    negative_prompt: Optional[str] = None,
+    num_results: int = 1,
+    seed: Optional[int] = None,
+    content_moderation: bool = False
+) -> Dict[str, Any]:
+    """
+    Outpaint: extend the image by ``expansion_amount`` pixels on every side.
+
+    The expanded canvas and its border mask are built locally, and an
+    optional painted ``mask_data`` is filled at the same time. Canvases up to
+    ``OUTPAINT_TILE_THRESHOLD`` go upstream in one call; larger ones are
+    filled in tiles, with the tiles of each checkerboard phase requested
+    concurrently, and come back as ``data:`` URLs under ``result_urls``. Tiled
+    results are generated one at a time, so at most one copy of the canvas
+    is in memory.
+
+    Raises ``services.masks.MaskError`` for expansions that cannot be done.
+    """
+    with span("masks.expand", **{"masks.expansion": expansion_amount}) as current:
+        plan = await cpu_pool.run_thread(prepare_expand, image_data, expansion_amount, mask_data)
+        current.set_attribute("masks.canvas", "%dx%d" % plan.size)
+        current.set_attribute("masks.tiles", len(plan.tiles))
+
+    if not plan.tiles:
+        image, mask = await cpu_pool.run_thread(lambda: (plan.image(), plan.mask()))
+        return await generative_fill_async(
+            api_key=api_key,
+            image_data=image,
+            mask_data=mask,
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            num_results=num_results,
+            sync=True,
+            seed=seed,
+            content_moderation=content_moderation
+        )
+
+    async def fill_tile(painting: Outpainting, tile: Tile, tile_seed: Optional[int]) -> None:
+        image, mask = await cpu_pool.run_thread(painting.request, tile)
+        result = await generative_fill_async(
+            api_key=api_key,
+            image_data=image,
+            mask_data=mask,
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            num_results=1,
+            sync=True,
+            seed=tile_seed,
+            content_moderation=content_moderation
+        )
+        try:
+            urls = extract_result_urls(result)
+            if not urls:
+                raise ValueError("no image returned for a tile")
+            generated = await fetch_bytes(urls[0])
+            await cpu_pool.run_thread(painting.paste, tile, generated)
+        except Exception as e:
+            raise Exception(f"Generative fill failed: {str(e)}")
+
+    async def outpaint(variant: int) -> str:
+        painting = Outpainting(plan)
+        # Second-phase tiles are generated against the finished first-phase ones
+        for phase in (0, 1):
+            await asyncio.gather(*(
+                fill_tile(painting, tile, None if seed is None else seed + variant * len(plan.tiles) + index)
+                for index, tile in enumerate(plan.tiles) if tile.phase == phase
+            ))
+        return to_data_url(*await cpu_pool.run_thread(painting.encode))
+
+    # Variants run one after another: each holds its own full copy of the canvas
+    result_urls = []
+    for variant in range(num_results):
+        result_urls.append(await outpaint(variant))
+    return {"result_urls": result_urls}
+
+generative_fill = make_sync(generative_fill_async)
+generative_fill_prepared = make_sync(generative_fill_prepared_async)
+generative_fill_masked = make_sync(generative_fill_masked_async)
+generative_expand = make_sync(generative_expand_async)
+ 
\ No newline at end of file
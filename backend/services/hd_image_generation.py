@@ -1,8 +1,12 @@
 from typing import Dict, Any, Optional, Union
-import requests
 import json
 
-def generate_hd_image(
+from core.cache import request_key_async, result_cache
+from core.http import bria_url, make_sync, parse_json, post_json
+from core.tracing import traced
+
+@traced()
+async def generate_hd_image_async(
     prompt: str,
     api_key: str,
     model_version: str = "2.2",
@@ -70,36 +74,26 @@ def generate_hd_image(
     if ip_signal:
         data["ip_signal"] = ip_signal
     
-    url = f"https://engine.prod.bria-api.com/v1/text-to-image/hd/{model_version}"
-    headers = {
-        'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
+    url = bria_url(f"/v1/text-to-image/hd/{model_version}")
+    
+    # Only seeded generations are reproducible enough to cache
+    cache_key = await request_key_async(url, data, api_key) if seed is not None else None
+    if cache_key:
+        cached = await result_cache.get(cache_key)
+        if cached is not None:
+            return cached
     
     try:
-        # print(f"Making request to: {url}")
-        # print(f"Headers: {headers}")
+        # Server errors are retried with backoff inside post_json
+        response = await post_json(url, api_key, data, coalesce_key=cache_key)
+        response.raise_for_status()
         
-        # Try request with retries for server errors
-        max_retries = 3
-        for attempt in range(max_retries):
-            response = requests.post(url, headers=headers, json=data)
-            
-            if response.status_code in [500, 502, 503, 504]:
-                if attempt < max_retries - 1:
-                    print(f"Server error {response.status_code}, retrying... ({attempt + 1}/{max_retries})")
-                    import time
-                    time.sleep(2)
-                    continue
-            
-            response.raise_for_status()
-            break
-            
-        print(f"Response status: {response.status_code}")
-        # print(f"Response body: {response.text}")
-        
-        return response.json()
+        result = parse_json(response)
+        if cache_key:
+            await result_cache.set(cache_key, result)
+        return result
         
     except Exception as e:
-        raise Exception(f"HD image generation failed: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"HD image generation failed: {str(e)}")
+
+generate_hd_image = make_sync(generate_hd_image_async) 
\ No newline at end of file
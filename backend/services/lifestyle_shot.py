@@ -1,10 +1,13 @@
 from typing import Dict, Any, Optional, List
-import requests
-import base64
+from core.http import bria_url, make_sync, parse_json, post_json
+from core.payload import ImageInput
+from core.tracing import traced
+from .background import segmented_input
 
-def lifestyle_shot_by_text(
+@traced()
+async def lifestyle_shot_by_text_async(
     api_key: str,
-    image_data: bytes,
+    image_data: ImageInput,
     scene_description: str,
     placement_type: str = "original",
     num_results: int = 4,
@@ -27,7 +30,7 @@ def lifestyle_shot_by_text(
     
     Args:
         api_key: Bria AI API key
-        image_data: Image data in bytes
+        image_data: Image bytes or file object
         scene_description: Text description of the new scene
         placement_type: How to position the product ("original", "automatic", "manual_placement", "manual_padding", "custom_coordinates")
         num_results: Number of results to generate
@@ -45,20 +48,14 @@ def lifestyle_shot_by_text(
         content_moderation: Whether to enable content moderation
         sku: Optional SKU identifier
     """
-    url = "https://engine.prod.bria-api.com/v1/product/lifestyle_shot_by_text"
+    url = bria_url("/v1/product/lifestyle_shot_by_text")
     
-    headers = {
-        'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
-    
-    # Convert image to base64
-    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    # Send the cached cutout rather than have the background removed again
+    image_data, force_rmbg = await segmented_input(api_key, image_data, force_rmbg)
     
-    # Prepare request data
+    # Prepare request data (the image is base64-encoded while the body is streamed)
     data = {
-        'file': image_base64,
+        'file': image_data,
         'scene_description': scene_description,
         'placement_type': placement_type,
         'num_results': num_results,
@@ -93,25 +90,22 @@ def lifestyle_shot_by_text(
         data['sku'] = sku
     
     try:
-        print(f"Making request to: {url}")
-        print(f"Headers: {headers}")
-        print(f"Data: {data}")
-        
-        response = requests.post(url, headers=headers, json=data)
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
+        response = await post_json(url, api_key, data)
         
-        if not response.ok:
+        if not response.is_success:
             raise Exception(f"API Error ({response.status_code}): {response.text}")
             
-        return response.json()
+        return parse_json(response)
     except Exception as e:
         raise Exception(f"Lifestyle shot generation failed: {str(e)}")
 
-def lifestyle_shot_by_image(
+lifestyle_shot_by_text = make_sync(lifestyle_shot_by_text_async)
+
+@traced()
+async def lifestyle_shot_by_image_async(
     api_key: str,
-    image_data: bytes,
-    reference_image: bytes,
+    image_data: ImageInput,
+    reference_image: ImageInput,
     placement_type: str = "original",
     num_results: int = 4,
     sync: bool = False,
@@ -130,22 +124,15 @@ def lifestyle_shot_by_image(
     """
     Generate a lifestyle shot using a reference image.
     """
-    url = "https://engine.prod.bria-api.com/v1/product/lifestyle_shot_by_image"
+    url = bria_url("/v1/product/lifestyle_shot_by_image")
     
-    headers = {
-        'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
+    # Send the cached cutout rather than have the background removed again
+    image_data, force_rmbg = await segmented_input(api_key, image_data, force_rmbg)
     
-    # Convert images to base64
-    image_base64 = base64.b64encode(image_data).decode('utf-8')
-    reference_base64 = base64.b64encode(reference_image).decode('utf-8')
-    
-    # Prepare request data
+    # Prepare request data (both images are base64-encoded while the body is streamed)
     data = {
-        'file': image_base64,
-        'ref_image_file': reference_base64,
+        'file': image_data,
+        'ref_image_file': reference_image,
         'placement_type': placement_type,
         'num_results': num_results,
         'sync': sync,
@@ -176,17 +163,13 @@ def lifestyle_shot_by_image(
         data['sku'] = sku
     
     try:
-        print(f"Making request to: {url}")
-        print(f"Headers: {headers}")
-        print(f"Data: {data}")
-        
-        response = requests.post(url, headers=headers, json=data)
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
+        response = await post_json(url, api_key, data)
         
-        if not response.ok:
+        if not response.is_success:
             raise Exception(f"API Error ({response.status_code}): {response.text}")
             
-        return response.json()
+        return parse_json(response)
     except Exception as e:
-        raise Exception(f"Lifestyle shot generation failed: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Lifestyle shot generation failed: {str(e)}")
+
+lifestyle_shot_by_image = make_sync(lifestyle_shot_by_image_async)
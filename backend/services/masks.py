@@ -0,0 +1,394 @@
+"""
+Local mask handling for generative fill and erase.
+
+The canvas in the frontend produces a PNG mask (white strokes on black) that
+used to be forwarded as-is, so an empty or misaligned mask cost a full
+upstream round trip before failing. Here the mask is:
+
+* decoded (alpha channel if it has transparency, luminance otherwise),
+  checked against the image's aspect ratio and resized to the image;
+* binarized, grown by ``MASK_DILATE`` pixels and rejected if empty;
+* reduced to its bounding box. When that box, padded with context, is small
+  compared to the image, only the crop is sent upstream and the generated
+  crop is blended back into the original over a feathered edge.
+
+Outpainting (``expansion_amount``) builds the mask itself: the image is
+padded onto a larger canvas and the new border is what gets generated. Large
+canvases are split into tiles generated in two checkerboard phases, so that
+every tile of the second phase sees finished neighbours as context.
+
+The array operations are vectorized NumPy (dilation is a windowed sum over an
+integral image, so its cost does not depend on the radius).
+"""
+import io
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from core.config import (
+    MASK_CROP_ENABLED,
+    MASK_CROP_MAX_AREA,
+    MASK_CROP_MIN_SIDE,
+    MASK_CROP_PADDING,
+    MASK_DILATE,
+    MASK_FEATHER,
+    OUTPAINT_MAX_SIDE,
+    OUTPAINT_TILE_CONTEXT,
+    OUTPAINT_TILE_SIZE,
+    OUTPAINT_TILE_THRESHOLD,
+)
+from core.payload import ImageInput
+
+Box = Tuple[int, int, int, int]
+
+# Masks drawn over a scaled preview may be off by a pixel or two, not more
+ASPECT_TOLERANCE = 0.02
+OUTPUT_JPEG_QUALITY = 95
+
+
+class MaskError(ValueError):
+    """The mask cannot be used with the image (empty, not the same shape, or an impossible expansion)."""
+
+
+def _read(data: ImageInput) -> bytes:
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    data.seek(0)
+    content = data.read()
+    data.seek(0)
+    return content
+
+
+def load_mask(data: ImageInput, size: Tuple[int, int]) -> np.ndarray:
+    """Decode a mask into a ``uint8`` coverage array of the image's ``size`` (width, height)."""
+    try:
+        mask = Image.open(io.BytesIO(_read(data)))
+        mask = ImageOps.exif_transpose(mask)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise MaskError(f"Mask is not a readable image: {e}")
+
+    width, height = size
+    mask_width, mask_height = mask.size
+    if abs(mask_width / mask_height - width / height) > ASPECT_TOLERANCE * (width / height):
+        raise MaskError(
+            f"Mask is {mask_width}x{mask_height} but the image is {width}x{height}; "
+            "draw the mask over the same image"
+        )
+
+    if mask.mode in ("RGBA", "LA") or (mask.mode == "P" and "transparency" in mask.info):
+        mask = mask.convert("RGBA") if mask.mode == "P" else mask
+        alpha = mask.getchannel("A")
+        # Strokes on a transparent background: coverage is the alpha channel
+        coverage = alpha if alpha.getextrema()[0] < 255 else mask.convert("L")
+    else:
+        coverage = mask.convert("L")
+    if coverage.size != size:
+        coverage = coverage.resize(size, Image.BILINEAR)
+    return np.asarray(coverage, dtype=np.uint8)
+
+
+def binarize(coverage: np.ndarray, threshold: int = 128) -> np.ndarray:
+    return coverage >= threshold
+
+
+def _window_sum(mask: np.ndarray, radius: int) -> np.ndarray:
+    """Sum of ``mask`` over the (2r+1)x(2r+1) window around every pixel."""
+    padded = np.pad(mask.astype(np.int32), radius)
+    table = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.int64)
+    table[1:, 1:] = padded.cumsum(axis=0).cumsum(axis=1)
+    k = 2 * radius + 1
+    return table[k:, k:] - table[:-k, k:] - table[k:, :-k] + table[:-k, :-k]
+
+
+def dilate(mask: np.ndarray, radius: int) -> np.ndarray:
+    """Grow a boolean mask by ``radius`` pixels (square structuring element)."""
+    if radius <= 0:
+        return mask
+    return _window_sum(mask, radius) > 0
+
+
+def feather(mask: np.ndarray, radius: float) -> np.ndarray:
+    """Soft ``float32`` alpha from a boolean mask: 1 inside, fading out over ``radius`` pixels."""
+    if radius <= 0:
+        return mask.astype(np.float32)
+    grown = dilate(mask, int(round(radius)))
+    blurred = Image.fromarray(grown.astype(np.uint8) * 255).filter(ImageFilter.GaussianBlur(radius / 2))
+    alpha = np.asarray(blurred, dtype=np.float32) / 255.0
+    # The masked area itself is always fully replaced
+    return np.maximum(alpha, mask.astype(np.float32))
+
+
+def bounding_box(mask: np.ndarray) -> Optional[Box]:
+    """``(left, top, right, bottom)`` of the set pixels (right/bottom exclusive), None if empty."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    columns = np.flatnonzero(mask.any(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def _span(start: int, end: int, length: int, limit: int) -> Tuple[int, int]:
+    # Grow [start, end) to ``length`` around its centre, shifted to stay inside [0, limit)
+    length = min(max(length, end - start), limit)
+    start = max(0, min((start + end - length) // 2, limit - length))
+    return start, start + length
+
+
+def crop_box(box: Box, size: Tuple[int, int], padding: float, min_side: int) -> Box:
+    """The region sent upstream: ``box`` plus context, at least ``min_side`` per side."""
+    left, top, right, bottom = box
+    pad = int(max(right - left, bottom - top) * padding)
+    width, height = size
+    x0, x1 = _span(left, right, max(right - left + 2 * pad, min_side), width)
+    y0, y1 = _span(top, bottom, max(bottom - top + 2 * pad, min_side), height)
+    return x0, y0, x1, y1
+
+
+def encode_mask(mask: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(mask.astype(np.uint8) * 255).convert("1").save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _encode(image: Image.Image, source_format: Optional[str]) -> Tuple[bytes, str]:
+    buffer = io.BytesIO()
+    if source_format == "JPEG" and image.mode in ("RGB", "L"):
+        image.save(buffer, format="JPEG", quality=OUTPUT_JPEG_QUALITY)
+        return buffer.getvalue(), "image/jpeg"
+    image.save(buffer, format="PNG", compress_level=6)
+    return buffer.getvalue(), "image/png"
+
+
+class FillPlan:
+    """What to send upstream for one fill, and how to put the result back."""
+
+    __slots__ = ("image", "mask", "box", "alpha", "original", "source_format", "original_bytes", "sent_bytes")
+
+    def __init__(self):
+        self.image: ImageInput = b""
+        self.mask: bytes = b""
+        # Crop sent upstream, None when the whole image is
+        self.box: Optional[Box] = None
+        self.alpha: Optional[np.ndarray] = None
+        self.original: Optional[Image.Image] = None
+        self.source_format: Optional[str] = None
+        self.original_bytes = 0
+        self.sent_bytes = 0
+
+
+def _open_image(raw: bytes) -> Tuple[Image.Image, Optional[str], int]:
+    """Decode an upload upright; returns the image, its format and its EXIF orientation."""
+    with Image.open(io.BytesIO(raw)) as opened:
+        source_format = opened.format
+        orientation = opened.getexif().get(0x0112, 1)
+        image = ImageOps.exif_transpose(opened) if orientation != 1 else opened.copy()
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    return image, source_format, orientation
+
+
+def prepare_fill(image_data: ImageInput, mask_data: ImageInput, allow_crop: bool = True) -> FillPlan:
+    """
+    Validate and clean up the mask for ``image_data`` and decide whether to crop.
+
+    Raises ``MaskError`` for masks that cannot work. Set ``allow_crop`` only
+    when the result will be available to composite (``sync=True``).
+    """
+    plan = FillPlan()
+    raw = _read(image_data)
+    plan.original_bytes = plan.sent_bytes = len(raw)
+    try:
+        image, plan.source_format, orientation = _open_image(raw)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Not something Pillow can read: let the upstream validate both files as before
+        plan.image, plan.mask = image_data, _read(mask_data)
+        return plan
+
+    _count("validated")
+    try:
+        mask = dilate(binarize(load_mask(mask_data, image.size)), MASK_DILATE)
+        box = bounding_box(mask)
+        if box is None:
+            raise MaskError("Mask is empty: paint over the area to fill")
+    except MaskError:
+        _count("rejected")
+        raise
+
+    region = crop_box(box, image.size, MASK_CROP_PADDING, MASK_CROP_MIN_SIDE)
+    region_area = (region[2] - region[0]) * (region[3] - region[1])
+    if allow_crop and MASK_CROP_ENABLED and region_area <= MASK_CROP_MAX_AREA * image.size[0] * image.size[1]:
+        left, top, right, bottom = region
+        plan.box = region
+        plan.original = image
+        plan.image, _ = _encode(image.crop(region), plan.source_format)
+        plan.mask = encode_mask(mask[top:bottom, left:right])
+        plan.alpha = feather(mask, MASK_FEATHER)[top:bottom, left:right]
+        _count("cropped")
+    else:
+        # Pixels must line up with the mask, so a rotated upload is sent rotated
+        plan.image = _encode(image, plan.source_format)[0] if orientation != 1 else image_data
+        plan.mask = encode_mask(mask)
+    plan.sent_bytes = len(plan.image) if isinstance(plan.image, (bytes, bytearray)) else len(raw)
+    plan.sent_bytes += len(plan.mask)
+    return plan
+
+
+def composite(plan: FillPlan, result: bytes) -> Tuple[bytes, str]:
+    """Blend a generated crop back into the original image; returns (bytes, content type)."""
+    left, top, right, bottom = plan.box
+    original = plan.original
+    with Image.open(io.BytesIO(result)) as generated:
+        generated = generated.convert(original.mode)
+        if generated.size != (right - left, bottom - top):
+            generated = generated.resize((right - left, bottom - top), Image.LANCZOS)
+        patch = np.asarray(generated, dtype=np.float32)
+    base = np.asarray(original.crop(plan.box), dtype=np.float32)
+    alpha = plan.alpha if patch.ndim == 2 else plan.alpha[..., None]
+    blended = np.clip(base + (patch - base) * alpha + 0.5, 0, 255).astype(np.uint8)
+    output = original.copy()
+    output.paste(Image.fromarray(blended, mode=original.mode), (left, top))
+    return _encode(output, plan.source_format)
+
+
+def expand_canvas(pixels: np.ndarray, amount: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Pad an image array by ``amount`` pixels per side; returns the canvas and its border mask."""
+    height, width = pixels.shape[:2]
+    pad = ((amount, amount), (amount, amount)) + ((0, 0),) * (pixels.ndim - 2)
+    # Edge colours stretched outwards give the model something to continue from
+    canvas = np.pad(pixels, pad, mode="edge")
+    border = np.ones(canvas.shape[:2], dtype=bool)
+    border[amount:amount + height, amount:amount + width] = False
+    return canvas, border
+
+
+class Tile(NamedTuple):
+    # Pixels this tile writes, pixels sent upstream (cell plus context), checkerboard phase
+    cell: Box
+    window: Box
+    phase: int
+
+
+def plan_tiles(mask: np.ndarray, tile_size: int, context: int) -> List[Tile]:
+    """Split a canvas into cells of at most ``tile_size`` and keep those with pixels to generate."""
+    height, width = mask.shape
+    xs = np.linspace(0, width, -(-width // tile_size) + 1).astype(int)
+    ys = np.linspace(0, height, -(-height // tile_size) + 1).astype(int)
+    # Any masked pixel per cell, reduced block-wise in one pass per axis
+    busy = np.logical_or.reduceat(np.logical_or.reduceat(mask, ys[:-1], axis=0), xs[:-1], axis=1)
+    tiles = []
+    for row, column in zip(*np.nonzero(busy)):
+        left, top, right, bottom = int(xs[column]), int(ys[row]), int(xs[column + 1]), int(ys[row + 1])
+        window = (max(0, left - context), max(0, top - context), min(width, right + context), min(height, bottom + context))
+        tiles.append(Tile((left, top, right, bottom), window, int(row + column) % 2))
+    return tiles
+
+
+class ExpandPlan:
+    """An expanded canvas, the area of it to generate, and the tiles to generate it in."""
+
+    __slots__ = ("pixels", "mode", "target", "tiles", "source_format")
+
+    def __init__(self, pixels: np.ndarray, mode: str, target: np.ndarray, tiles: List[Tile], source_format: Optional[str]):
+        self.pixels = pixels
+        self.mode = mode
+        self.target = target
+        # Empty when the whole canvas goes upstream in one call
+        self.tiles = tiles
+        self.source_format = source_format
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.target.shape[1], self.target.shape[0]
+
+    def image(self) -> bytes:
+        return _encode(Image.fromarray(self.pixels, mode=self.mode), self.source_format)[0]
+
+    def mask(self) -> bytes:
+        return encode_mask(self.target)
+
+
+def prepare_expand(image_data: ImageInput, amount: int, mask_data: Optional[ImageInput] = None) -> ExpandPlan:
+    """
+    Put the image on a canvas ``amount`` pixels larger on every side.
+
+    The border, grown inwards by ``MASK_DILATE`` so the seam is regenerated,
+    is the area to fill; a painted ``mask_data`` adds to it. Raises
+    ``MaskError`` for unreadable images and canvases above ``OUTPAINT_MAX_SIDE``.
+    """
+    if amount <= 0:
+        raise MaskError("expansion_amount must be a positive number of pixels")
+    try:
+        image, source_format, _ = _open_image(_read(image_data))
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise MaskError(f"Image is not readable, it cannot be expanded: {e}")
+    width, height = image.size[0] + 2 * amount, image.size[1] + 2 * amount
+    if max(width, height) > OUTPAINT_MAX_SIDE:
+        raise MaskError(f"Expanded image would be {width}x{height}, more than {OUTPAINT_MAX_SIDE} pixels per side")
+
+    pixels, border = expand_canvas(np.asarray(image), amount)
+    target = dilate(border, MASK_DILATE)
+    if mask_data is not None:
+        painted = dilate(binarize(load_mask(mask_data, image.size)), MASK_DILATE)
+        target[amount:amount + image.size[1], amount:amount + image.size[0]] |= painted
+    tiles = plan_tiles(target, OUTPAINT_TILE_SIZE, OUTPAINT_TILE_CONTEXT) if max(width, height) > OUTPAINT_TILE_THRESHOLD else []
+    _count("expanded")
+    return ExpandPlan(pixels, image.mode, target, tiles, source_format)
+
+
+class Outpainting:
+    """One result being generated tile by tile, on its own copy of the plan's canvas."""
+
+    __slots__ = ("plan", "pixels", "done")
+
+    def __init__(self, plan: ExpandPlan):
+        self.plan = plan
+        self.pixels = plan.pixels.copy()
+        self.done = np.zeros_like(plan.target)
+
+    def request(self, tile: Tile) -> Tuple[bytes, bytes]:
+        """Image and mask to send for ``tile``; finished neighbours are context, not masked."""
+        left, top, right, bottom = tile.window
+        window = Image.fromarray(self.pixels[top:bottom, left:right], mode=self.plan.mode)
+        image = _encode(window, self.plan.source_format)[0]
+        todo = self.plan.target[top:bottom, left:right] & ~self.done[top:bottom, left:right]
+        return image, encode_mask(todo)
+
+    def paste(self, tile: Tile, result: bytes) -> None:
+        """Blend a generated window in, over a feathered edge around the tile's cell."""
+        left, top, right, bottom = tile.window
+        with Image.open(io.BytesIO(result)) as generated:
+            generated = generated.convert(self.plan.mode)
+            if generated.size != (right - left, bottom - top):
+                generated = generated.resize((right - left, bottom - top), Image.LANCZOS)
+            # Only the cell and its feathered edge change; the rest of the window was context
+            reach = 2 * int(np.ceil(MASK_FEATHER))
+            x0, y0 = max(left, tile.cell[0] - reach), max(top, tile.cell[1] - reach)
+            x1, y1 = min(right, tile.cell[2] + reach), min(bottom, tile.cell[3] + reach)
+            patch = np.asarray(generated.crop((x0 - left, y0 - top, x1 - left, y1 - top)), dtype=np.float32)
+        cell = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        cell[tile.cell[1] - y0:tile.cell[3] - y0, tile.cell[0] - x0:tile.cell[2] - x0] = True
+        cell &= self.plan.target[y0:y1, x0:x1]
+        alpha = feather(cell, MASK_FEATHER)
+        alpha = alpha if patch.ndim == 2 else alpha[..., None]
+        base = self.pixels[y0:y1, x0:x1].astype(np.float32)
+        self.pixels[y0:y1, x0:x1] = np.clip(base + (patch - base) * alpha + 0.5, 0, 255).astype(np.uint8)
+        self.done[y0:y1, x0:x1] |= cell
+
+    def encode(self) -> Tuple[bytes, str]:
+        return _encode(Image.fromarray(self.pixels, mode=self.plan.mode), self.plan.source_format)
+
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"validated": 0, "rejected": 0, "cropped": 0, "expanded": 0}
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def mask_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return dict(_stats)
@@ -1,43 +1,54 @@
-from typing import Dict, Any
-import requests
-import base64
+from typing import Dict, Any, Optional
+from core.cache import request_key_async, result_cache
+from core.http import bria_url, make_sync, parse_json, post_json
+from core.payload import ImageInput
+from core.tracing import traced
+from .background import segmented_input
+from .compositor import render_locally, render_packshot, resolve_engine
 
-def create_packshot(
+@traced()
+async def create_packshot_async(
     api_key: str,
-    image_data: bytes,
+    image_data: ImageInput,
     background_color: str = "#FFFFFF",
     sku: str = None,
     force_rmbg: bool = False,
-    content_moderation: bool = False
+    content_moderation: bool = False,
+    engine: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Create a professional packshot from a product image.
     
     Args:
         api_key: Bria AI API key
-        image_data: Image data in bytes
+        image_data: Image bytes or file object
         background_color: Background color in hex format or 'transparent'
         sku: Optional SKU identifier for the product
         force_rmbg: Whether to force background removal even if alpha channel exists
         content_moderation: Whether to enable content moderation
+        engine: 'remote' (Bria), 'local' (compositor) or 'auto'; defaults to COMPOSITOR_ENGINE
     
     Returns:
         Dict containing the API response
     """
-    url = "https://engine.prod.bria-api.com/v1/product/packshot"
+    url = bria_url("/v1/product/packshot")
+    engine = resolve_engine(engine)
     
-    headers = {
-        'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
+    # Send the cached cutout rather than have the background removed again
+    image_data, force_rmbg = await segmented_input(api_key, image_data, force_rmbg)
     
-    # Convert image data to base64
-    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    # A cutout on a solid colour needs no round trip
+    local = await render_locally(
+        engine, image_data, render_packshot,
+        blocker="content moderation" if content_moderation else None,
+        background_color=background_color
+    )
+    if local is not None:
+        return local
     
-    # Prepare request data
+    # Prepare request data (the image is base64-encoded while the body is streamed)
     data = {
-        'file': image_base64,
+        'file': image_data,
         'background_color': background_color,
         'force_rmbg': force_rmbg,
         'content_moderation': content_moderation
@@ -47,17 +58,20 @@ def create_packshot(
     if sku:
         data['sku'] = sku
     
+    # Same image and parameters always give the same result
+    cache_key = await request_key_async(url, data, api_key)
+    cached = await result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        print(f"Making request to: {url}")
-        print(f"Headers: {headers}")
-        print(f"Data keys: {list(data.keys())}")
-        
-        response = requests.post(url, headers=headers, json=data)
+        response = await post_json(url, api_key, data, coalesce_key=cache_key)
         response.raise_for_status()
         
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        return response.json()
+        result = parse_json(response)
+        await result_cache.set(cache_key, result)
+        return result
     except Exception as e:
-        raise Exception(f"Packshot creation failed: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Packshot creation failed: {str(e)}")
+
+create_packshot = make_sync(create_packshot_async) 
\ No newline at end of file
@@ -0,0 +1,265 @@
+"""
+Pre-processing of uploaded images before they are sent to Bria.
+
+Phone photos are often 12-24 MP while the engine's outputs are much smaller,
+so uploads are shrunk before they are base64-encoded into the request:
+
+* the EXIF orientation is applied, then the image is downscaled so its longest
+  side fits the endpoint's ``max_side`` (JPEGs are decoded at reduced scale);
+* the result is re-encoded losslessly (WebP or PNG); JPEG uploads stay JPEG
+  under the default ``auto`` format, since a lossless copy of a photo is
+  larger than the photo, and are sent untouched unless they had to be
+  downscaled, rotated or converted. The re-encode is only sent if it is smaller;
+* masks are quantized to 1-bit PNG and resized along with the image.
+
+Every endpoint has a profile that can be overridden with ``PREPROCESS_PROFILES``.
+"""
+import io
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from core.config import (
+    PREPROCESS_ENABLED,
+    PREPROCESS_FORMAT,
+    PREPROCESS_JPEG_QUALITY,
+    PREPROCESS_MAX_SIDE,
+    PREPROCESS_PROFILES,
+)
+from core.cpu import cpu_pool
+from core.log import get_logger
+from core.metrics import STAGE_LATENCY
+from core.payload import ImageInput, binary_size, is_binary
+from core.tracing import span
+
+logger = get_logger(__name__)
+
+# format is one of auto, webp, png or jpeg
+DEFAULT_PROFILE = {"enabled": PREPROCESS_ENABLED, "max_side": PREPROCESS_MAX_SIDE, "format": PREPROCESS_FORMAT}
+
+# Endpoint specific defaults, merged over DEFAULT_PROFILE
+ENDPOINT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "packshot": {},
+    "shadow": {},
+    "lifestyle-text": {},
+    "lifestyle-image": {},
+    "generative-fill": {},
+    "erase": {},
+    "erase-foreground": {},
+    "remove-background": {},
+}
+
+
+def _load_overrides() -> Dict[str, Dict[str, Any]]:
+    try:
+        overrides = json.loads(PREPROCESS_PROFILES)
+    except ValueError:
+        logger.warning("preprocess.bad_profiles", value=PREPROCESS_PROFILES)
+        return {}
+    if not isinstance(overrides, dict):
+        logger.warning("preprocess.bad_profiles", value=PREPROCESS_PROFILES)
+        return {}
+    return {name: profile for name, profile in overrides.items() if isinstance(profile, dict)}
+
+
+_overrides = _load_overrides()
+
+
+def profile_for(endpoint: str) -> Dict[str, Any]:
+    """Effective pre-processing settings of an endpoint."""
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(ENDPOINT_PROFILES.get(endpoint, {}))
+    profile.update(_overrides.get(endpoint, {}))
+    return profile
+
+
+class _Totals:
+    """Process-wide counters behind ``preprocess_stats``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.processed = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.elapsed_ms = 0.0
+
+    def add(self, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self.uploads += 1
+            self.processed += 1 if report["processed"] else 0
+            self.original_bytes += report["original_bytes"]
+            self.sent_bytes += report["sent_bytes"]
+            self.elapsed_ms += report["elapsed_ms"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            saved = self.original_bytes - self.sent_bytes
+            return {
+                "uploads": self.uploads,
+                "processed": self.processed,
+                "original_bytes": self.original_bytes,
+                "sent_bytes": self.sent_bytes,
+                "saved_bytes": saved,
+                # Images travel base64-encoded, so each saved byte is 4/3 on the wire
+                "saved_wire_bytes": saved * 4 // 3,
+                "elapsed_ms": round(self.elapsed_ms, 1),
+            }
+
+
+_totals = _Totals()
+
+
+def preprocess_stats() -> Dict[str, Any]:
+    return _totals.stats()
+
+
+def _read(data: ImageInput) -> bytes:
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    data.seek(0)
+    content = data.read()
+    data.seek(0)
+    return content
+
+
+def _encode(image: Image.Image, fmt: str, source_format: Optional[str]) -> bytes:
+    if fmt == "auto":
+        fmt = "jpeg" if source_format == "JPEG" else "webp"
+    buffer = io.BytesIO()
+    if fmt == "jpeg" and image.mode in ("RGB", "L"):
+        image.save(buffer, format="JPEG", quality=PREPROCESS_JPEG_QUALITY)
+    elif fmt == "webp":
+        # quality is the compression effort in lossless mode; 50 is a good speed/size trade-off
+        image.save(buffer, format="WEBP", lossless=True, quality=50, method=4)
+    else:
+        image.save(buffer, format="PNG", optimize=False, compress_level=6)
+    return buffer.getvalue()
+
+
+def _prepare_image(data: ImageInput, max_side: int, fmt: str) -> Tuple[ImageInput, Optional[Tuple[int, int]]]:
+    """Return the bytes to send and, if those were re-encoded, their size."""
+    original = _read(data)
+    with Image.open(io.BytesIO(original)) as image:
+        source_format = image.format
+        if (
+            source_format == "JPEG" and fmt in ("auto", "jpeg") and image.mode in ("RGB", "L")
+            and not (max_side and max(image.size) > max_side) and image.getexif().get(0x0112, 1) == 1
+        ):
+            # Nothing to shrink or convert: another lossy encode would only cost time and quality
+            return data, None
+        if max_side and max(image.size) > max_side:
+            # JPEG only: let the decoder do most of the downscale via DCT scaling
+            image.draft(None, (max_side, max_side))
+        image.load()
+        orientation = image.getexif().get(0x0112, 1)
+        transposed = ImageOps.exif_transpose(image) if orientation != 1 else image
+        if max_side and max(transposed.size) > max_side:
+            transposed.thumbnail((max_side, max_side), Image.LANCZOS)
+        if transposed.mode not in ("RGB", "RGBA", "L", "LA"):
+            transposed = transposed.convert("RGBA" if "transparency" in transposed.info else "RGB")
+        encoded = _encode(transposed, fmt, source_format)
+
+    if len(encoded) < len(original):
+        return encoded, transposed.size
+    return data, None
+
+
+def _prepare_mask(data: ImageInput, size: Optional[Tuple[int, int]]) -> ImageInput:
+    original = _read(data)
+    with Image.open(io.BytesIO(original)) as mask:
+        mask = ImageOps.exif_transpose(mask).convert("L")
+        mask_size = mask.size
+        if size and mask.size != size:
+            mask = mask.resize(size, Image.NEAREST)
+        bitmap = mask.point(lambda value: 255 if value >= 128 else 0).convert("1")
+        buffer = io.BytesIO()
+        bitmap.save(buffer, format="PNG", optimize=True)
+    encoded = buffer.getvalue()
+    # A mask resized along with its image must be sent even if it got larger
+    if (size and size != mask_size) or len(encoded) < len(original):
+        return encoded
+    return data
+
+
+def _preprocess(
+    endpoint: str,
+    image: ImageInput,
+    mask: Optional[ImageInput],
+    profile: Dict[str, Any]
+) -> Tuple[ImageInput, Optional[ImageInput], Dict[str, Any]]:
+    start = time.perf_counter()
+    original_bytes = binary_size(image) + (binary_size(mask) if mask is not None else 0)
+    fmt = str(profile.get("format") or "auto").lower()
+    try:
+        new_image, new_size = _prepare_image(image, int(profile.get("max_side") or 0), fmt)
+        new_mask = _prepare_mask(mask, new_size) if mask is not None else None
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        # Not something Pillow can read: let the upstream validate it as before
+        logger.warning("preprocess.skipped", endpoint=endpoint, error=str(e))
+        new_image, new_mask, new_size = image, mask, None
+
+    sent_bytes = binary_size(new_image) + (binary_size(new_mask) if new_mask is not None else 0)
+    report = {
+        "endpoint": endpoint,
+        "processed": new_image is not image or (mask is not None and new_mask is not mask),
+        "original_bytes": original_bytes,
+        "sent_bytes": sent_bytes,
+        "saved_bytes": original_bytes - sent_bytes,
+        "size": list(new_size) if new_size else None,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    return new_image, new_mask, report
+
+
+def _preprocess_pooled(
+    endpoint: str,
+    image: ImageInput,
+    mask: Optional[ImageInput],
+    profile: Dict[str, Any]
+) -> Tuple[Optional[bytes], Optional[bytes], Dict[str, Any]]:
+    """``_preprocess`` for the CPU pool: an input left as is comes back as None, not as a copy."""
+    new_image, new_mask, report = _preprocess(endpoint, image, mask, profile)
+    return (None if new_image is image else new_image), (None if new_mask is mask else new_mask), report
+
+
+async def preprocess_upload(
+    endpoint: str,
+    image: ImageInput,
+    mask: Optional[ImageInput] = None
+) -> Tuple[ImageInput, Optional[ImageInput], Dict[str, Any]]:
+    """
+    Shrink an uploaded image (and its mask) according to the endpoint's profile.
+
+    Returns the image and mask to send, which are the inputs themselves when
+    nothing was gained, plus a report of the bytes and time involved. Decoding
+    and encoding run in the CPU pool to keep the event loop free.
+    """
+    profile = profile_for(endpoint)
+    if not profile.get("enabled", True) or not is_binary(image):
+        size = binary_size(image) + (binary_size(mask) if mask is not None else 0)
+        report = {"endpoint": endpoint, "processed": False, "original_bytes": size, "sent_bytes": size,
+                  "saved_bytes": 0, "size": None, "elapsed_ms": 0.0}
+    else:
+        with span("preprocess", endpoint=endpoint) as current:
+            new_image, new_mask, report = await cpu_pool.run(_preprocess_pooled, endpoint, image, mask, profile)
+            image = image if new_image is None else new_image
+            mask = mask if new_mask is None else new_mask
+            current.set_attribute("preprocess.original_bytes", report["original_bytes"])
+            current.set_attribute("preprocess.sent_bytes", report["sent_bytes"])
+        STAGE_LATENCY.labels("preprocess").observe(report["elapsed_ms"] / 1000)
+    _totals.add(report)
+    logger.info("preprocess.done", sample=True, **report)
+    return image, mask, report
+
+
+def report_headers(report: Dict[str, Any]) -> Dict[str, str]:
+    """Response headers describing what pre-processing saved for one request."""
+    return {
+        "X-Upload-Bytes": str(report["original_bytes"]),
+        "X-Upload-Bytes-Sent": str(report["sent_bytes"]),
+        "X-Preprocess-Ms": str(report["elapsed_ms"]),
+    }
@@ -1,48 +1,281 @@
-from typing import Dict, Any, Optional
-import requests
+from typing import Dict, Any, Iterable, Optional
+from collections import OrderedDict
+import asyncio
+import hashlib
 import json
+import os
+import re
+import sqlite3
+import threading
+import time
 
-def enhance_prompt(
+from core.cache import request_key
+from core.config import PROMPT_CACHE_ENABLED, PROMPT_CACHE_MAX_ENTRIES, PROMPT_CACHE_PATH, PROMPT_CACHE_TTL
+from core.http import bria_url, make_sync, parse_json, post_json
+from core.log import get_logger
+from core.state import SharedState, StateError, shared_state
+from core.tracing import traced
+
+logger = get_logger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, punctuation and whitespace so near-identical prompts share an entry."""
+    prompt = _PUNCTUATION.sub(" ", prompt.casefold())
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+class PromptCache:
+    """
+    Enhanced prompts keyed by normalized prompt (plus any extra API options).
+
+    Lookups are served from an in-memory LRU; every entry is also written to
+    a SQLite file so the cache survives restarts and can be pre-warmed, and
+    to the shared state backend, if any, so other hosts' workers see it.
+    Expired rows are deleted from the file by writes, at most once per
+    ``PURGE_INTERVAL`` seconds.
+    """
+
+    PURGE_INTERVAL = 600
+
+    def __init__(self, path: str, max_entries: int, ttl: float, shared: Optional[SharedState] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # SQLite work runs on executor threads, off the event loop
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_ready = False
+        self._last_purge = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.purged = 0
+
+    @staticmethod
+    def key(prompt: str, options: Dict[str, Any]) -> str:
+        key = normalize_prompt(prompt)
+        if options:
+            key += "\x00" + json.dumps(options, sort_keys=True, default=str)
+        return key
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        # Opened lazily so importing the services never touches the filesystem
+        if not self._db_ready:
+            self._db_ready = True
+            if self.path:
+                try:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.execute("PRAGMA synchronous=NORMAL")
+                    db.execute(
+                        "CREATE TABLE IF NOT EXISTS prompts ("
+                        "key TEXT PRIMARY KEY, enhanced TEXT NOT NULL, stored_at REAL NOT NULL)"
+                    )
+                    db.execute("CREATE INDEX IF NOT EXISTS prompts_stored_at ON prompts (stored_at)")
+                    self._db = db
+                except sqlite3.Error as e:
+                    logger.warning("prompt_cache.unavailable", path=self.path, error=str(e))
+        return self._db
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - stored_at > self.ttl
+
+    def _remember(self, key: str, enhanced: Any, stored_at: float) -> None:
+        self._memory[key] = (enhanced, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _shared_key(self, key: str) -> str:
+        return "prompt:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    async def _shared_get(self, key: str) -> Optional[tuple]:
+        try:
+            raw = await self.shared.get(self._shared_key(key))
+        except StateError as e:
+            logger.warning("prompt_cache.shared_unavailable", error=str(e))
+            return None
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry["enhanced"], entry["stored_at"]
+
+    def _read(self, key: str) -> Optional[tuple]:
+        # Runs on an executor thread; the connection is shared between threads
+        with self._db_lock:
+            db = self._connection()
+            if db is None:
+                return None
+            try:
+                row = db.execute("SELECT enhanced, stored_at FROM prompts WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("prompt_cache.read_failed", error=str(e))
+                return None
+        return None if row is None else (json.loads(row[0]), row[1])
+
+    def _write(self, key: str, enhanced: Any, now: float) -> None:
+        with self._db_lock:
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.execute("INSERT OR REPLACE INTO prompts (key, enhanced, stored_at) VALUES (?, ?, ?)", (key, json.dumps(enhanced), now))
+                if self.ttl > 0 and now - self._last_purge >= self.PURGE_INTERVAL:
+                    self._last_purge = now
+                    self.purged += db.execute("DELETE FROM prompts WHERE stored_at < ?", (now - self.ttl,)).rowcount
+            except sqlite3.Error as e:
+                logger.warning("prompt_cache.write_failed", error=str(e))
+
+    async def get(self, prompt: str, options: Dict[str, Any]) -> Optional[Any]:
+        key = self.key(prompt, options)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is None and self.shared is not None:
+            entry = await self._shared_get(key)
+        if entry is None and self.path:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+        with self._lock:
+            if entry is None or self._expired(entry[1], now):
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+            self._remember(key, entry[0], entry[1])
+            self.hits += 1
+            return entry[0]
+
+    async def set(self, prompt: str, options: Dict[str, Any], enhanced: Any) -> None:
+        key = self.key(prompt, options)
+        now = time.time()
+        if self.shared is not None:
+            try:
+                await self.shared.set(self._shared_key(key), json.dumps({"enhanced": enhanced, "stored_at": now}).encode("utf-8"),
+                                self.ttl if self.ttl > 0 else None)
+            except StateError as e:
+                logger.warning("prompt_cache.shared_unavailable", error=str(e))
+        with self._lock:
+            self._remember(key, enhanced, now)
+        if self.path:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, key, enhanced, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "memory_entries": len(self._memory),
+                "purged": self.purged,
+            }
+
+
+prompt_cache = PromptCache(PROMPT_CACHE_PATH, PROMPT_CACHE_MAX_ENTRIES, PROMPT_CACHE_TTL, shared_state)
+
+
+async def _request_enhancement(api_key: str, prompt: str, options: Dict[str, Any]) -> Optional[Any]:
+    """Ask the upstream for an enhancement; None if it did not return one."""
+    url = bria_url("/v1/prompt_enhancer")
+
+    data = {
+        'prompt': prompt,
+        **options
+    }
+
+    # Identical prompts in flight at the same time share one upstream call
+    response = await post_json(url, api_key, data, coalesce_key=request_key(url, data, api_key))
+    response.raise_for_status()
+
+    result = parse_json(response)
+    return result.get("prompt variations")
+
+@traced()
+async def enhance_prompt_async(
     api_key: str,
     prompt: str,
     **kwargs
 ) -> str:
     """
     Enhance a prompt using Bria AI's prompt enhancement service.
-    
+
     Args:
         api_key: Bria AI API key
         prompt: Original prompt to enhance
         **kwargs: Additional parameters for the API
-    
+
     Returns:
         Enhanced prompt string
     """
-    url = "https://engine.prod.bria-api.com/v1/prompt_enhancer"
-    
-    headers = {
-        'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
-    
-    data = {
-        'prompt': prompt,
-        **kwargs
-    }
-    
+    if PROMPT_CACHE_ENABLED:
+        cached = await prompt_cache.get(prompt, kwargs)
+        if cached is not None:
+            return cached
+
     try:
-        print(f"Making request to: {url}")
-        print(f"Headers: {headers}")
-        
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        result = response.json()
-        return result.get("prompt variations", prompt)  # Return original prompt if enhancement fails
+        enhanced = await _request_enhancement(api_key, prompt, kwargs)
     except Exception as e:
-        print(f"Error enhancing prompt: {str(e)}")
-        return prompt  # Return original prompt on error 
\ No newline at end of file
+        logger.warning("prompt_enhancement.failed", error=str(e))
+        return prompt  # Return original prompt on error
+
+    if enhanced is None:
+        return prompt  # Return original prompt if enhancement fails
+    if PROMPT_CACHE_ENABLED:
+        await prompt_cache.set(prompt, kwargs, enhanced)
+    return enhanced
+
+@traced()
+async def warm_prompt_cache_async(
+    api_key: str,
+    prompts: Iterable[str],
+    concurrency: int = 8,
+    **kwargs
+) -> Dict[str, int]:
+    """
+    Pre-compute enhancements for a list of prompts.
+
+    Prompts that are already cached (after normalization) are skipped.
+
+    Returns:
+        Counts of prompts that were already cached, newly enhanced or failed
+    """
+    counts = {"cached": 0, "enhanced": 0, "failed": 0}
+    pending = {}
+    for prompt in prompts:
+        prompt = prompt.strip()
+        if not prompt:
+            continue
+        if await prompt_cache.get(prompt, kwargs) is not None:
+            counts["cached"] += 1
+        else:
+            # Several spellings of one prompt only need a single call
+            pending.setdefault(prompt_cache.key(prompt, kwargs), prompt)
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def warm(prompt: str) -> None:
+        async with semaphore:
+            try:
+                enhanced = await _request_enhancement(api_key, prompt, kwargs)
+            except Exception as e:
+                logger.warning("prompt_enhancement.failed", error=str(e))
+                enhanced = None
+        if enhanced is None:
+            counts["failed"] += 1
+        else:
+            await prompt_cache.set(prompt, kwargs, enhanced)
+            counts["enhanced"] += 1
+
+    await asyncio.gather(*(warm(prompt) for prompt in pending.values()))
+    return counts
+
+enhance_prompt = make_sync(enhance_prompt_async)
+warm_prompt_cache = make_sync(warm_prompt_cache_async)
@@ -1,10 +1,15 @@
 from typing import Dict, Any, List, Optional
-import requests
-import base64
+from core.cache import request_key_async, result_cache
+from core.http import bria_url, make_sync, parse_json, post_json
+from core.payload import ImageInput
+from core.tracing import traced
+from .background import segmented_input
+from .compositor import render_locally, render_shadow, resolve_engine
 
-def add_shadow(
+@traced()
+async def add_shadow_async(
     api_key: str,
-    image_data: bytes = None,
+    image_data: Optional[ImageInput] = None,
     image_url: str = None,
     shadow_type: str = "regular",
     background_color: Optional[str] = None,
@@ -16,14 +21,15 @@ def add_shadow(
     shadow_height: Optional[int] = 70,
     sku: Optional[str] = None,
     force_rmbg: bool = False,
-    content_moderation: bool = False
+    content_moderation: bool = False,
+    engine: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Add shadow to an image.
     
     Args:
         api_key: Bria AI API key
-        image_data: Image data in bytes (optional if image_url provided)
+        image_data: Image bytes or file object (optional if image_url provided)
         image_url: URL of the image (optional if image_data provided)
         shadow_type: Type of shadow ("regular" or "float")
         background_color: Optional background color in hex format
@@ -36,17 +42,33 @@ def add_shadow(
         sku: Optional SKU identifier
         force_rmbg: Whether to force background removal
         content_moderation: Whether to enable content moderation
+        engine: 'remote' (Bria), 'local' (compositor) or 'auto'; defaults to COMPOSITOR_ENGINE
     
     Returns:
         Dict containing the API response
     """
-    url = "https://engine.prod.bria-api.com/v1/product/shadow"
+    url = bria_url("/v1/product/shadow")
+    engine = resolve_engine(engine)
     
-    headers = {
-        'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
+    # Send the cached cutout rather than have the background removed again
+    if not image_url:
+        image_data, force_rmbg = await segmented_input(api_key, image_data, force_rmbg)
+    
+    # Regular and float shadows are drawn from the cutout's alpha without a round trip
+    blocker = "image_url" if image_url else "content moderation" if content_moderation else None
+    local = await render_locally(
+        engine, image_data, render_shadow, blocker=blocker,
+        shadow_type=shadow_type,
+        background_color=background_color,
+        shadow_color=shadow_color,
+        shadow_offset=shadow_offset,
+        shadow_intensity=shadow_intensity,
+        shadow_blur=shadow_blur,
+        shadow_width=shadow_width,
+        shadow_height=shadow_height
+    )
+    if local is not None:
+        return local
     
     # Prepare request data
     data = {
@@ -62,7 +84,8 @@ def add_shadow(
     if image_url:
         data['image_url'] = image_url
     elif image_data:
-        data['file'] = base64.b64encode(image_data).decode('utf-8')
+        # Base64-encoded while the request body is streamed
+        data['file'] = image_data
     else:
         raise ValueError("Either image_data or image_url must be provided")
     
@@ -78,18 +101,22 @@ def add_shadow(
     if sku:
         data['sku'] = sku
     
+    # Same image and parameters always give the same result
+    cache_key = await request_key_async(url, data, api_key)
+    cached = await result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        print(f"Making request to: {url}")
-        print(f"Headers: {headers}")
-        print(f"Data: {data}")
+        response = await post_json(url, api_key, data, coalesce_key=cache_key)
         
-        response = requests.post(url, headers=headers, json=data)
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        if not response.ok:
+        if not response.is_success:
             raise Exception(f"API Error ({response.status_code}): {response.text}")
             
-        return response.json()
+        result = parse_json(response)
+        await result_cache.set(cache_key, result)
+        return result
     except Exception as e:
-        raise Exception(f"Shadow addition failed: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Shadow addition failed: {str(e)}")
+
+add_shadow = make_sync(add_shadow_async) 
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Fan-out of large ``num_results`` requests.
+
+Bria returns at most four images per call, and a call for four images takes
+longer than a call for one. ``fan_out`` splits a request for up to
+``FANOUT_MAX_RESULTS`` images into concurrent upstream calls of ``per_call``
+images each, every call with its own seed, and yields each image as soon as
+its call returns: the first image is ready after a single generation rather
+than after the whole set.
+"""
+import asyncio
+import random
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core.config import FANOUT_MAX_RESULTS
+from core.log import get_logger
+from core.results import extract_result_urls
+
+logger = get_logger(__name__)
+
+# Most images Bria generates in one call
+MAX_RESULTS_PER_CALL = 4
+# Local results (crop composites, tiled outpainting) come back inline
+RESULT_SCHEMES = ("http://", "https://", "data:")
+
+# generate(num_results, seed) -> upstream-shaped payload
+Generate = Callable[[int, Optional[int]], Awaitable[Dict[str, Any]]]
+
+
+def plan_calls(num_results: int, per_call: int, seed: Optional[int]) -> List[Tuple[int, int, Optional[int]]]:
+    """``(first_index, num_results, seed)`` of each upstream call; seeds are ``seed``, ``seed + 1``..."""
+    per_call = max(1, min(per_call, MAX_RESULTS_PER_CALL))
+    calls = []
+    for number, start in enumerate(range(0, num_results, per_call)):
+        calls.append((start, min(per_call, num_results - start), None if seed is None else seed + number))
+    return calls
+
+
+def random_seed(num_results: int) -> int:
+    """A base seed that leaves room for one seed per call below 2**31."""
+    return random.randrange(2 ** 31 - FANOUT_MAX_RESULTS - num_results)
+
+
+async def fan_out(
+    generate: Generate,
+    num_results: int,
+    per_call: int = MAX_RESULTS_PER_CALL,
+    seed: Optional[int] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run the upstream calls of a ``num_results`` request concurrently and
+    yield one record per image, in completion order.
+
+    Records are ``{"index", "seed", "result_url"}``, or ``{"index", "seed",
+    "error"}`` for an image whose call failed; ``index`` is the image's
+    position in the requested set. Calls still running when the consumer
+    stops iterating are cancelled.
+    """
+    async def call(start: int, count: int, call_seed: Optional[int]) -> List[Dict[str, Any]]:
+        try:
+            urls = extract_result_urls(await generate(count, call_seed), RESULT_SCHEMES)[:count]
+            error = "no image returned"
+        except Exception as e:
+            logger.warning("fanout.call_failed", index=start, results=count, error=str(e))
+            urls, error = [], str(e)
+        records = [{"index": start + offset, "seed": call_seed, "result_url": url} for offset, url in enumerate(urls)]
+        records += [{"index": start + offset, "seed": call_seed, "error": error} for offset in range(len(urls), count)]
+        return records
+
+    tasks = [asyncio.ensure_future(call(*planned)) for planned in plan_calls(num_results, per_call, seed)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            for record in await finished:
+                yield record
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def collect(records: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Gather fanned-out records into one ``{"result_urls": [...]}`` payload, in
+    requested order. Failed images are listed under ``errors``; if every
+    image failed, the first error is raised.
+    """
+    results: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    async for record in records:
+        (errors if "error" in record else results).append(record)
+    if not results:
+        raise Exception(errors[0]["error"] if errors else "no image returned")
+    results.sort(key=lambda record: record["index"])
+    payload = {"result_urls": [record["result_url"] for record in results],
+               "seeds": [record["seed"] for record in results]}
+    if errors:
+        payload["errors"] = sorted(errors, key=lambda record: record["index"])
+    return payload
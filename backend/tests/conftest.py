@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Settings are read at import time: point every on-disk cache at a scratch directory
+_scratch = tempfile.mkdtemp(prefix="visionary-tests-")
+os.environ.setdefault("CPU_POOL_MODE", "thread")
+os.environ.setdefault("STATE_BACKEND", "memory")
+os.environ.setdefault("RESULT_CACHE_DIR", os.path.join(_scratch, "results"))
+os.environ.setdefault("PROMPT_CACHE_PATH", os.path.join(_scratch, "prompts.sqlite3"))
+os.environ.setdefault("CUTOUT_CACHE_DIR", os.path.join(_scratch, "cutouts"))
+os.environ.setdefault("JOB_SPOOL_DIR", os.path.join(_scratch, "jobs"))
+os.environ.setdefault("BATCH_CHECKPOINT_DIR", os.path.join(_scratch, "batches"))
+os.environ.setdefault("ASSET_STORE_DIR", os.path.join(_scratch, "assets"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core.ratelimit import RateLimiter, TokenBucket
+from core.scheduler import BATCH, INTERACTIVE, FairScheduler, tenant_id
+
+
+def test_bucket_allows_burst_then_refills():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated_at
+    assert [bucket.take(now) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(now) == pytest.approx(0.5)
+    assert bucket.take(now + 0.5) == 0.0
+
+
+def test_zero_rate_bucket_never_refills():
+    bucket = TokenBucket(rate=0, burst=1)
+    assert bucket.take(bucket.updated_at) == 0.0
+    assert bucket.take(bucket.updated_at + 60) == float("inf")
+
+
+def test_limits_are_per_tenant_and_endpoint():
+    limiter = RateLimiter(rate=1, burst=1, limits={"/slow": {"rate": 1, "burst": 2}})
+
+    async def main():
+        return [
+            await limiter.check("a", "/fast"),
+            await limiter.check("a", "/fast"),
+            await limiter.check("b", "/fast"),
+            await limiter.check("a", "/slow"),
+            await limiter.check("a", "/slow"),
+        ]
+
+    results = asyncio.run(main())
+    assert results[0] is None and results[1] > 0
+    assert results[2] is None
+    assert results[3] is None and results[4] is None
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_disabled_limiter_admits_everything():
+    limiter = RateLimiter(rate=0, burst=0, limits={}, enabled=False)
+    assert asyncio.run(limiter.check("a", "/x")) is None
+
+
+def test_zero_rate_limit_answers_429_with_bounded_retry_after(monkeypatch):
+    import api
+
+    monkeypatch.setattr(api.rate_limiter, "enabled", True)
+    monkeypatch.setattr(api.rate_limiter, "limits", {"/enhance-prompt": {"rate": 0, "burst": 0}})
+    response = TestClient(api.app).post("/enhance-prompt", data={"prompt": "cat", "api_key": "rate-limit-test"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(api.MAX_RETRY_AFTER)
+
+
+def test_tenants_are_keyed_on_api_key_before_host():
+    assert tenant_id("secret", "10.0.0.1") == tenant_id("secret", "10.0.0.2")
+    assert tenant_id(None, "10.0.0.1") == "host-10.0.0.1"
+    assert tenant_id(None) == "anonymous"
+
+
+def run_scheduled(scheduler, calls, hold=0.01):
+    """Run ``(tenant, priority, name)`` calls through the scheduler; returns names in start order."""
+    started = []
+
+    async def call(tenant, priority, name):
+        async with scheduler.slot(tenant, priority):
+            started.append(name)
+            await asyncio.sleep(hold)
+
+    async def main():
+        tasks = []
+        for tenant, priority, name in calls:
+            tasks.append(asyncio.ensure_future(call(tenant, priority, name)))
+            # Queue in submission order
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return started
+
+
+def test_interactive_calls_overtake_queued_batch_work():
+    scheduler = FairScheduler(max_concurrency=1, tenant_concurrency=1)
+    calls = [("bulk", BATCH, f"batch-{i}") for i in range(4)] + [("user", INTERACTIVE, "interactive")]
+    started = run_scheduled(scheduler, calls)
+    assert started.index("interactive") <= 1
+    assert scheduler.in_flight == 0 and not scheduler.tenant_in_flight
+
+
+def test_tenant_cap_lets_other_tenants_through():
+    scheduler = FairScheduler(max_concurrency=2, tenant_concurrency=1)
+    calls = [("a", INTERACTIVE, f"a-{i}") for i in range(3)] + [("b", INTERACTIVE, "b-0")]
+    started = run_scheduled(scheduler, calls)
+    assert started.index("b-0") == 1
+
+
+def test_cancelled_waiter_does_not_leak_its_slot():
+    scheduler = FairScheduler(max_concurrency=1, tenant_concurrency=1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot("a", INTERACTIVE):
+                await release.wait()
+
+        first = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await first
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    asyncio.run(main())
+    assert scheduler.in_flight == 0
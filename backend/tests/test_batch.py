@@ -0,0 +1,51 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+import api
+
+
+def test_catalog_concurrency_is_clamped_and_spool_removed(monkeypatch):
+    seen = {}
+
+    async def run_catalog_batch(**kwargs):
+        seen.update(kwargs)
+        seen["spooled"] = os.path.exists(kwargs["source_path"])
+        yield {"sku": "a", "status": "succeeded"}
+
+    monkeypatch.setattr(api, "run_catalog_batch", run_catalog_batch)
+    response = TestClient(api.app).post(
+        "/batch/catalog",
+        data={"api_key": "batch-test", "concurrency": "100000"},
+        files={"file": ("catalog.ndjson", b'{"sku": "a", "image_url": "https://x/a.png"}\n', "application/x-ndjson")},
+    )
+    assert response.status_code == 200
+    assert response.text.strip() == '{"sku": "a", "status": "succeeded"}'
+    assert seen["concurrency"] == api.BATCH_MAX_CONCURRENCY
+    assert seen["spooled"] and not os.path.exists(seen["source_path"])
+
+
+def test_spooled_file_is_removed_when_client_leaves_before_streaming():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    started = []
+
+    async def body():
+        started.append(True)
+        yield b"never sent"
+
+    async def send(message):
+        raise OSError("client went away")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    response = api._SpooledStreamingResponse(body(), path)
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(response(scope, receive, send))
+    assert not started and not os.path.exists(path)
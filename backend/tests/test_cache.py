@@ -0,0 +1,158 @@
+import asyncio
+import importlib
+import io
+import os
+import types
+
+import fakeredis
+import httpx
+import pytest
+
+from core import cache as cache_module
+from core.cache import DiskStore, ResultCache, request_key, request_key_async
+from core.state import RedisState
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_request_key_ignores_image_container_and_float_form():
+    image = b"\x89PNG" + os.urandom(1024)
+    key = request_key("https://x/y", {"file": image, "scale": 60, "seed": None}, "key")
+    assert key == request_key("https://x/y", {"file": io.BytesIO(image), "scale": 60.0}, "key")
+    assert key != request_key("https://x/z", {"file": image, "scale": 60}, "key")
+    assert key != request_key("https://x/y", {"file": image, "scale": 60}, "other")
+    assert run(request_key_async("https://x/y", {"file": io.BytesIO(image), "scale": 60}, "key")) == key
+
+
+def test_cached_results_are_not_served_to_other_api_keys(monkeypatch):
+    erase_foreground = importlib.import_module("services.erase_foreground")
+    keys = []
+
+    async def post_json(url, api_key, data, coalesce_key=None):
+        keys.append(api_key)
+        if api_key != "paid":
+            return httpx.Response(401, request=httpx.Request("POST", url))
+        return httpx.Response(200, json={"result_url": "https://cdn/r.png"}, request=httpx.Request("POST", url))
+
+    monkeypatch.setattr(erase_foreground, "result_cache", ResultCache(ttl=10))
+    monkeypatch.setattr(erase_foreground, "post_json", post_json)
+    image = os.urandom(64)
+
+    assert run(erase_foreground.erase_foreground_async("paid", image)) == {"result_url": "https://cdn/r.png"}
+    assert run(erase_foreground.erase_foreground_async("paid", image)) == {"result_url": "https://cdn/r.png"}
+    with pytest.raises(Exception, match="401"):
+        run(erase_foreground.erase_foreground_async("invalid", image))
+    assert keys == ["paid", "invalid"]
+
+
+def test_memory_tier_hits_and_expires(monkeypatch):
+    cache = ResultCache(max_entries=2, ttl=10)
+    run(cache.set("a", {"url": "1"}))
+    assert run(cache.get("a")) == {"url": "1"}
+    assert run(cache.get("missing")) is None
+    later = cache_module.time.time() + 11
+    monkeypatch.setattr(cache_module.time, "time", lambda: later)
+    assert run(cache.get("a")) is None
+    assert cache.stats()["memory_hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_memory_tier_is_lru_bounded():
+    cache = ResultCache(max_entries=2, ttl=10)
+    for key in "abc":
+        run(cache.set(key, key))
+    assert run(cache.get("a")) is None
+    assert run(cache.get("c")) == "c"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    run(ResultCache(ttl=10, disk_dir=str(tmp_path)).set("k" * 64, {"url": "1"}))
+    fresh = ResultCache(ttl=10, disk_dir=str(tmp_path))
+    assert run(fresh.get("k" * 64)) == {"url": "1"}
+    assert fresh.stats()["disk_hits"] == 1
+    # Promoted to memory
+    assert run(fresh.get("k" * 64)) == {"url": "1"}
+    assert fresh.stats()["memory_hits"] == 1
+
+
+def test_shared_tier_is_seen_by_other_workers():
+    state = RedisState("redis://localhost:6379/0")
+    state._redis = types.SimpleNamespace(Redis=fakeredis.FakeAsyncRedis)
+    writer = ResultCache(ttl=10, shared=state)
+    reader = ResultCache(ttl=10, shared=state)
+
+    async def main():
+        await writer.set("k", ["url"])
+        return await reader.get("k")
+
+    assert run(main()) == ["url"]
+    assert reader.stats()["shared_hits"] == 1
+
+
+def test_disk_store_trims_oldest_without_rescanning(tmp_path, monkeypatch):
+    store = DiskStore(str(tmp_path), ".bin", max_bytes=1000)
+    store.write("aa01", b"x" * 400)
+
+    def no_walk(*args, **kwargs):
+        raise AssertionError("rescanned the cache directory")
+
+    monkeypatch.setattr(os, "walk", no_walk)
+    store.write("aa02", b"x" * 400)
+    store.write("aa03", b"x" * 400)
+    assert store.size == 800
+    assert store.evictions == 1
+    assert not os.path.exists(store.path("aa01"))
+    assert os.path.exists(store.path("aa03"))
+    # Rewriting a key replaces its size rather than adding to it
+    store.write("aa03", b"x" * 100)
+    assert store.size == 500
+
+
+def test_disk_store_indexes_existing_files_once(tmp_path):
+    DiskStore(str(tmp_path), ".bin", max_bytes=10_000).write("bb01", b"x" * 300)
+    store = DiskStore(str(tmp_path), ".bin", max_bytes=10_000)
+    assert store.size is None
+    store.write("bb02", b"x" * 200)
+    assert store.size == 500
+    store.clear()
+    assert store.size == 0 and not os.path.exists(store.path("bb01"))
+
+
+def test_cutout_cache_reads_back_from_disk(tmp_path):
+    from services.background import CutoutCache
+
+    digest = "c" * 64
+    run(CutoutCache(max_memory_bytes=1024, ttl=10, disk_dir=str(tmp_path)).set(digest, b"png"))
+    fresh = CutoutCache(max_memory_bytes=1024, ttl=10, disk_dir=str(tmp_path))
+    assert run(fresh.get(digest)) == b"png"
+    assert run(fresh.get("d" * 64)) is None
+    assert fresh.stats()["hits"] == 1 and fresh.stats()["disk_bytes"] is None
+
+
+def test_images_are_segmented_ahead_only_from_their_second_use(monkeypatch):
+    from services import background
+
+    calls = []
+
+    async def remove_background_async(api_key, image_data):
+        calls.append(image_data)
+        return {"result_url": "https://cdn/cutout.png"}
+
+    async def fetch_bytes(url):
+        return b"cutout"
+
+    monkeypatch.setattr(background, "CUTOUT_CACHE_ENABLED", True)
+    monkeypatch.setattr(background, "cutout_cache", background.CutoutCache(max_memory_bytes=1024, ttl=60))
+    monkeypatch.setattr(background, "remove_background_async", remove_background_async)
+    monkeypatch.setattr(background, "fetch_bytes", fetch_bytes)
+    image = b"not a png" + os.urandom(64)
+
+    async def main():
+        return [await background.segmented_input("key", image, True) for _ in range(3)]
+
+    first, second, third = run(main())
+    assert first == (image, True)
+    assert second == (b"cutout", False) and third == (b"cutout", False)
+    assert len(calls) == 1
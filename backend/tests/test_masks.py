@@ -0,0 +1,225 @@
+import asyncio
+import base64
+import importlib
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from core.config import MASK_DILATE, MASK_FEATHER, OUTPAINT_MAX_SIDE
+from services.masks import (
+    ExpandPlan,
+    MaskError,
+    Outpainting,
+    bounding_box,
+    composite,
+    crop_box,
+    dilate,
+    expand_canvas,
+    load_mask,
+    plan_tiles,
+    prepare_expand,
+    prepare_fill,
+)
+
+
+def png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def photo(width, height):
+    # Non-uniform, so a wrong crop or offset shows up in the pixels
+    x = np.arange(width, dtype=np.uint8)[None, :].repeat(height, axis=0)
+    y = np.arange(height, dtype=np.uint8)[:, None].repeat(width, axis=1)
+    return Image.fromarray(np.dstack([x, y, x ^ y]), mode="RGB")
+
+
+def stroke(size, box, background="black"):
+    mask = Image.new("L", size, background)
+    mask.paste(255, box)
+    return mask
+
+
+def test_dilate_matches_a_naive_square_dilation():
+    rng = np.random.default_rng(1)
+    mask = rng.random((40, 50)) > 0.97
+    radius = 3
+    expected = np.zeros_like(mask)
+    for y, x in zip(*np.nonzero(mask)):
+        expected[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1] = True
+    assert np.array_equal(dilate(mask, radius), expected)
+    assert dilate(mask, 0) is mask
+
+
+def test_transparent_strokes_are_read_from_alpha():
+    mask = Image.new("RGBA", (100, 50), (0, 0, 0, 0))
+    mask.paste((255, 255, 255, 255), (10, 10, 20, 20))
+    coverage = load_mask(png(mask), (200, 100))
+    assert coverage.shape == (100, 200)
+    assert bounding_box(coverage >= 128) == (20, 20, 40, 40)
+
+
+def test_unusable_masks_are_rejected_before_any_upstream_call():
+    image = png(photo(400, 300))
+    with pytest.raises(MaskError, match="empty"):
+        prepare_fill(image, png(Image.new("L", (400, 300))))
+    with pytest.raises(MaskError, match="same image"):
+        prepare_fill(image, png(stroke((300, 300), (10, 10, 50, 50))))
+    with pytest.raises(MaskError, match="readable"):
+        prepare_fill(image, b"not an image")
+
+
+def test_crop_box_keeps_context_and_stays_inside_the_image():
+    assert crop_box((10, 10, 30, 30), (1000, 800), padding=0.5, min_side=512) == (0, 0, 512, 512)
+    assert crop_box((900, 700, 990, 790), (1000, 800), padding=0.5, min_side=64) == (820, 620, 1000, 800)
+
+
+def test_small_mask_sends_a_crop_and_composites_it_back():
+    original = photo(2000, 1500)
+    plan = prepare_fill(png(original), png(stroke((2000, 1500), (1000, 700, 1040, 740))))
+    left, top, right, bottom = plan.box
+    assert (right - left, bottom - top) == (512, 512)
+    assert left <= 996 and right >= 1044 and top <= 696 and bottom >= 744
+    assert plan.sent_bytes < plan.original_bytes
+    with Image.open(io.BytesIO(plan.image)) as sent:
+        assert sent.size == (512, 512)
+
+    generated = Image.new("RGB", (512, 512), (255, 0, 0))
+    output, content_type = composite(plan, png(generated))
+    assert content_type == "image/png"
+    with Image.open(io.BytesIO(output)) as result:
+        pixels = np.asarray(result)
+    assert pixels.shape == (1500, 2000, 3)
+    assert tuple(pixels[720, 1020]) == (255, 0, 0)
+    # Outside the crop nothing changed, inside it only around the mask
+    assert np.array_equal(pixels[:top], np.asarray(original)[:top])
+    assert np.array_equal(pixels[top + 5, left + 5], np.asarray(original)[top + 5, left + 5])
+
+
+def test_large_mask_or_async_fill_sends_the_whole_image():
+    image = png(photo(600, 400))
+    plan = prepare_fill(image, png(stroke((600, 400), (0, 0, 500, 400))))
+    assert plan.box is None and plan.image == image
+    plan = prepare_fill(png(photo(2000, 1500)), png(stroke((2000, 1500), (1000, 700, 1040, 740))), allow_crop=False)
+    assert plan.box is None
+    with Image.open(io.BytesIO(plan.mask)) as mask:
+        assert mask.size == (2000, 1500)
+
+
+def test_expanded_canvas_masks_only_the_new_border():
+    pixels = np.asarray(photo(30, 20))
+    canvas, border = expand_canvas(pixels, 5)
+    assert canvas.shape == (30, 40, 3) and border.shape == (30, 40)
+    assert np.array_equal(canvas[5:25, 5:35], pixels)
+    assert border.sum() == 40 * 30 - 30 * 20
+    assert not border[5:25, 5:35].any()
+
+
+def test_tiles_cover_the_mask_in_a_checkerboard():
+    mask = np.zeros((2500, 3000), dtype=bool)
+    mask[:100] = mask[-100:] = True
+    mask[:, :100] = mask[:, -100:] = True
+    tiles = plan_tiles(mask, tile_size=1024, context=256)
+    covered = np.zeros_like(mask)
+    for tile in tiles:
+        left, top, right, bottom = tile.cell
+        assert right - left <= 1024 and bottom - top <= 1024
+        covered[top:bottom, left:right] = True
+        w_left, w_top, w_right, w_bottom = tile.window
+        assert w_left == max(0, left - 256) and w_bottom == min(2500, bottom + 256)
+    assert covered[mask].all()
+    # 3x3 grid: the centre cell has nothing to generate
+    assert len(tiles) == 8
+    phases = {tile.cell[:2]: tile.phase for tile in tiles}
+    assert phases[(0, 0)] == 0 and phases[(1000, 0)] == 1 and phases[(0, 833)] == 1
+
+
+def test_expansion_limits():
+    with pytest.raises(MaskError):
+        prepare_expand(png(photo(100, 100)), 0)
+    with pytest.raises(MaskError, match="pixels per side"):
+        prepare_expand(png(photo(100, 100)), OUTPAINT_MAX_SIDE)
+    plan = prepare_expand(png(photo(100, 80)), 50)
+    assert plan.size == (200, 180) and plan.tiles == []
+
+
+def test_tiled_outpainting_fills_the_whole_border(monkeypatch):
+    # The services package re-exports a function under the module's name
+    fill_module = importlib.import_module("services.generative_fill")
+
+    requests = []
+    generated = {}
+
+    async def generative_fill_async(image_data, mask_data, seed=None, **kwargs):
+        with Image.open(io.BytesIO(image_data)) as window, Image.open(io.BytesIO(mask_data)) as todo:
+            requests.append((window.size, int(np.asarray(todo).sum())))
+            url = f"https://cdn/{len(requests)}.png"
+            generated[url] = png(Image.new("RGB", window.size, (0, 255, 0)))
+        return {"result_url": url}
+
+    async def fetch_bytes(url):
+        return generated[url]
+
+    monkeypatch.setattr(fill_module, "generative_fill_async", generative_fill_async)
+    monkeypatch.setattr(fill_module, "fetch_bytes", fetch_bytes)
+    original = photo(2000, 1800)
+    result = asyncio.run(fill_module.generative_expand_async("key", png(original), 100, "beach"))
+
+    plan = prepare_expand(png(original), 100)
+    assert len(requests) == len(plan.tiles) > 1
+    _, encoded = result["result_urls"][0].split(",", 1)
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as output:
+        pixels = np.asarray(output)
+    assert pixels.shape == (2000, 2200, 3)
+    assert tuple(pixels[0, 0]) == (0, 255, 0) and tuple(pixels[-1, -1]) == (0, 255, 0)
+    # The source image is only touched along the regenerated seam
+    inner = 100 + MASK_DILATE + 3 * int(np.ceil(MASK_FEATHER))
+    assert np.array_equal(pixels[inner:-inner, inner:-inner], np.asarray(original)[inner - 100:100 - inner, inner - 100:100 - inner])
+
+
+def test_tiled_results_hold_one_canvas_at_a_time(monkeypatch):
+    fill_module = importlib.import_module("services.generative_fill")
+    events = []
+
+    class Tracked(Outpainting):
+        __slots__ = ()
+
+        def __init__(self, plan):
+            events.append("copy")
+            super().__init__(plan)
+
+        def encode(self):
+            events.append("done")
+            return super().encode()
+
+    async def generative_fill_async(image_data, mask_data, seed=None, **kwargs):
+        return {"result_url": "https://cdn/tile.png"}
+
+    async def fetch_bytes(url):
+        return png(Image.new("RGB", (8, 8), (0, 255, 0)))
+
+    monkeypatch.setattr(fill_module, "Outpainting", Tracked)
+    monkeypatch.setattr(fill_module, "generative_fill_async", generative_fill_async)
+    monkeypatch.setattr(fill_module, "fetch_bytes", fetch_bytes)
+    result = asyncio.run(fill_module.generative_expand_async("key", png(photo(2000, 1800)), 100, "beach", num_results=3))
+    assert len(result["result_urls"]) == 3
+    assert events == ["copy", "done"] * 3
+
+
+def test_second_phase_tiles_see_finished_neighbours_as_context():
+    canvas = np.zeros((300, 300), dtype=bool)
+    canvas[:, :] = True
+    plan = ExpandPlan(np.zeros((300, 300, 3), dtype=np.uint8), "RGB", canvas,
+                      plan_tiles(canvas, tile_size=150, context=50), "PNG")
+    painting = Outpainting(plan)
+    first = next(tile for tile in plan.tiles if tile.phase == 0)
+    second = next(tile for tile in plan.tiles if tile.phase == 1 and tile.window[0] < first.cell[2])
+    _, before = painting.request(second)
+    painting.paste(first, png(Image.new("RGB", (first.window[2] - first.window[0], first.window[3] - first.window[1]), "white")))
+    _, after = painting.request(second)
+    with Image.open(io.BytesIO(before)) as before, Image.open(io.BytesIO(after)) as after:
+        assert np.asarray(after).sum() < np.asarray(before).sum()
+    assert painting.pixels[first.cell[1]:first.cell[3], first.cell[0]:first.cell[2]].min() == 255
@@ -0,0 +1,35 @@
+import io
+
+from PIL import Image
+
+from services.preprocess import _prepare_image
+
+
+def jpeg(size, mode="RGB", **save):
+    buffer = io.BytesIO()
+    Image.new(mode, size, "white" if mode != "CMYK" else (0, 0, 0, 0)).save(buffer, format="JPEG", quality=80, **save)
+    return buffer.getvalue()
+
+
+def test_small_jpeg_is_sent_untouched():
+    data = jpeg((800, 600))
+    sent, size = _prepare_image(data, 2048, "auto")
+    assert sent is data and size is None
+
+
+def test_large_jpeg_is_downscaled():
+    sent, size = _prepare_image(jpeg((4000, 3000)), 2048, "auto")
+    assert size == (2048, 1536)
+    with Image.open(io.BytesIO(sent)) as image:
+        assert image.format == "JPEG" and image.size == (2048, 1536)
+
+
+def test_rotated_or_cmyk_jpeg_is_converted():
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    sent, size = _prepare_image(jpeg((800, 600), exif=exif.tobytes()), 2048, "auto")
+    assert size == (600, 800)
+    sent, size = _prepare_image(jpeg((800, 600), mode="CMYK"), 2048, "auto")
+    assert size == (800, 600)
+    with Image.open(io.BytesIO(sent)) as image:
+        assert image.mode == "RGB"
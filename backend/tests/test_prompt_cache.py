@@ -0,0 +1,56 @@
+import asyncio
+import sqlite3
+import threading
+
+from services import prompt_enhancement
+from services.prompt_enhancement import PromptCache
+
+
+def rows(path):
+    with sqlite3.connect(path) as db:
+        return [key for key, in db.execute("SELECT key FROM prompts ORDER BY key")]
+
+
+def test_normalized_prompts_share_an_entry(tmp_path):
+    cache = PromptCache(str(tmp_path / "prompts.sqlite3"), max_entries=10, ttl=60)
+    asyncio.run(cache.set("A cat, in space!", {}, "enhanced"))
+    assert asyncio.run(cache.get("a cat in space", {})) == "enhanced"
+    assert asyncio.run(cache.get("a cat in space", {"style": "x"})) is None
+
+
+def test_writes_purge_expired_rows(tmp_path, monkeypatch):
+    path = str(tmp_path / "prompts.sqlite3")
+    clock = [1_000_000.0]
+    monkeypatch.setattr(prompt_enhancement.time, "time", lambda: clock[0])
+    cache = PromptCache(path, max_entries=10, ttl=60)
+    asyncio.run(cache.set("old", {}, "old enhanced"))
+    clock[0] += PromptCache.PURGE_INTERVAL
+    asyncio.run(cache.set("new", {}, "new enhanced"))
+    assert rows(path) == ["new"]
+    assert cache.stats()["purged"] == 1
+    # Survives a restart through the file
+    assert asyncio.run(PromptCache(path, max_entries=10, ttl=60).get("new", {})) == "new enhanced"
+
+
+def test_sqlite_work_runs_off_the_event_loop(tmp_path, monkeypatch):
+    path = str(tmp_path / "prompts.sqlite3")
+    cache = PromptCache(path, max_entries=10, ttl=60)
+    threads = []
+    for name in ("_read", "_write"):
+        method = getattr(cache, name)
+
+        def record(*args, method=method):
+            threads.append(threading.get_ident())
+            return method(*args)
+
+        monkeypatch.setattr(cache, name, record)
+
+    async def main():
+        await cache.set("a cat", {}, "enhanced")
+        # Served from the file, not memory
+        cache._memory.clear()
+        return await cache.get("a cat", {}), threading.get_ident()
+
+    enhanced, loop_thread = asyncio.run(main())
+    assert enhanced == "enhanced"
+    assert len(threads) == 2 and loop_thread not in threads
@@ -0,0 +1,82 @@
+import asyncio
+
+import httpx
+import pytest
+
+from core import resilience
+from core.resilience import CircuitBreaker, CircuitOpenError, call_with_retries
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    monkeypatch.setitem(resilience._breakers, "test", breaker)
+    return breaker
+
+
+def ok():
+    return httpx.Response(200, json={"ok": True})
+
+
+def test_breaker_opens_after_consecutive_failures(breaker):
+    async def fail():
+        return httpx.Response(500)
+
+    for _ in range(2):
+        response = asyncio.run(call_with_retries("test", fail, max_attempts=1))
+        assert response.status_code == 500
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(call_with_retries("test", fail, max_attempts=1))
+
+
+def test_half_open_admits_a_single_trial(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.opened_at -= 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_cancelled_trial_does_not_wedge_the_breaker(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.opened_at -= 1
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def main():
+        trial = asyncio.ensure_future(call_with_retries("test", hang))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        async def send():
+            return ok()
+
+        return await call_with_retries("test", send)
+
+    assert asyncio.run(main()).status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_unexpected_error_in_trial_reopens_the_breaker(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.opened_at -= 1
+
+    async def broken():
+        raise ValueError("bad request body")
+
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_retries("test", broken))
+    assert breaker.state == "open"
+    breaker.opened_at -= 1
+    assert breaker.allow()
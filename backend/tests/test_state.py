@@ -0,0 +1,75 @@
+import asyncio
+import types
+
+import fakeredis
+import pytest
+
+from core.ratelimit import RateLimiter
+from core.state import RedisState, SharedState, StateError
+
+
+def fake_state(**kwargs):
+    state = RedisState("redis://localhost:6379/0", **kwargs)
+    state._redis = types.SimpleNamespace(Redis=fakeredis.FakeAsyncRedis)
+    return state
+
+
+def test_values_and_tokens_round_trip():
+    state = fake_state()
+
+    async def main():
+        await state.set("key", b"value", ttl=10)
+        assert await state.get("key") == b"value"
+        await state.delete("key")
+        assert await state.get("key") is None
+        waits = [await state.take_token("bucket", 1, 2) for _ in range(3)]
+        await state.close()
+        return waits
+
+    waits = asyncio.run(main())
+    assert waits[:2] == [0.0, 0.0]
+    assert 0 < waits[2] <= 1
+
+
+def test_each_event_loop_gets_its_own_client():
+    state = fake_state()
+
+    async def main():
+        await state.set("key", b"value")
+        return state._client()[0]
+
+    assert asyncio.run(main()) is not asyncio.run(main())
+
+
+def test_unreachable_backend_is_skipped_during_cooldown():
+    # Nothing listens on port 1: the first call fails, the next ones do not even try
+    state = RedisState("redis://127.0.0.1:1/0", timeout=0.2, cooldown=60)
+
+    async def main():
+        for _ in range(3):
+            with pytest.raises(StateError):
+                await state.get("key")
+
+    asyncio.run(main())
+    assert state.failures == 1
+
+
+def test_rate_limiter_falls_back_to_local_buckets():
+    state = RedisState("redis://127.0.0.1:1/0", timeout=0.2, cooldown=60)
+    limiter = RateLimiter(rate=1, burst=2, limits={}, shared=state)
+
+    async def main():
+        return [await limiter.check("tenant", "/generate") for _ in range(3)]
+
+    first, second, third = asyncio.run(main())
+    assert first is None and second is None
+    assert third is not None and third > 0
+
+
+def test_incomplete_backends_cannot_be_created():
+    class GetOnly(SharedState):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError, match="take_token"):
+        GetOnly()
@@ -0,0 +1,126 @@
+import asyncio
+import base64
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from core.payload import CHUNK_SIZE, iter_json_body, json_body_length
+from services.variants import collect, fan_out, plan_calls
+
+
+def test_calls_are_split_with_consecutive_seeds():
+    assert plan_calls(7, 3, 100) == [(0, 3, 100), (3, 3, 101), (6, 1, 102)]
+    assert plan_calls(5, 10, None) == [(0, 4, None), (4, 1, None)]
+    assert plan_calls(2, 0, 1) == [(0, 1, 1), (1, 1, 2)]
+
+
+def test_images_stream_in_completion_order_and_collect_in_request_order():
+    async def generate(count, seed):
+        # Later seeds finish first
+        await asyncio.sleep(0.01 * (10 - seed))
+        return {"result_urls": [f"https://cdn/{seed}-{i}.png" for i in range(count)]}
+
+    async def main():
+        streamed = [record async for record in fan_out(generate, 4, per_call=1, seed=5)]
+        collected = await collect(fan_out(generate, 4, per_call=1, seed=5))
+        return streamed, collected
+
+    streamed, collected = asyncio.run(main())
+    assert [record["index"] for record in streamed] == [3, 2, 1, 0]
+    assert collected == {
+        "result_urls": [f"https://cdn/{seed}-0.png" for seed in (5, 6, 7, 8)],
+        "seeds": [5, 6, 7, 8],
+    }
+
+
+def test_failed_calls_are_reported_per_image():
+    async def generate(count, seed):
+        if seed == 1:
+            raise Exception("upstream 500")
+        if seed == 2:
+            return {"result_urls": ["https://cdn/short.png"]}
+        return {"result_urls": [f"https://cdn/{seed}-{i}.png" for i in range(count)]}
+
+    payload = asyncio.run(collect(fan_out(generate, 6, per_call=2, seed=0)))
+    assert payload["result_urls"] == ["https://cdn/0-0.png", "https://cdn/0-1.png", "https://cdn/short.png"]
+    assert [(error["index"], error["error"]) for error in payload["errors"]] == [
+        (2, "upstream 500"), (3, "upstream 500"), (5, "no image returned"),
+    ]
+
+
+def test_all_failed_raises():
+    async def generate(count, seed):
+        raise Exception("quota exceeded")
+
+    with pytest.raises(Exception, match="quota exceeded"):
+        asyncio.run(collect(fan_out(generate, 3, per_call=1)))
+
+
+def test_stopping_early_cancels_outstanding_calls():
+    cancelled = []
+
+    async def generate(count, seed):
+        try:
+            await asyncio.sleep(0 if seed == 0 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(seed)
+            raise
+        return {"result_urls": ["https://cdn/first.png"]}
+
+    async def main():
+        records = fan_out(generate, 4, per_call=1, seed=0)
+        first = await records.__anext__()
+        await records.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    assert asyncio.run(main())["result_url"] == "https://cdn/first.png"
+    assert sorted(cancelled) == [1, 2, 3]
+
+
+def test_generate_image_streams_ndjson_and_sse(monkeypatch):
+    async def generate_hd_image_async(num_results, seed, **kwargs):
+        return {"result_urls": [f"https://cdn/{seed}-{i}.png" for i in range(num_results)]}
+
+    monkeypatch.setattr(api, "generate_hd_image_async", generate_hd_image_async)
+    client = TestClient(api.app)
+    form = {"prompt": "a bottle", "api_key": "stream-test", "num_results": "3", "seed": "10", "stream": "true"}
+
+    response = client.post("/generate-image", data=form)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["seed"] for line in lines[:-1]) == [10, 11, 12]
+    assert lines[-1] == {"done": True, "results": 3, "errors": 0}
+
+    response = client.post("/generate-image", data=form, headers={"Accept": "text/event-stream"})
+    events = [block.split("\n")[0] for block in response.text.strip().split("\n\n")]
+    assert events == ["event: result"] * 3 + ["event: done"]
+
+
+def test_fanned_out_calls_each_read_the_whole_upload(monkeypatch):
+    upload = os.urandom(2 * CHUNK_SIZE + 123)
+    bodies = []
+
+    async def lifestyle_shot_by_text_async(image_data, num_results, **kwargs):
+        # Stream the body the way post_json does, yielding to the other calls between chunks
+        payload = {"file": image_data}
+        body = b""
+        async for chunk in iter_json_body(payload):
+            body += chunk
+            await asyncio.sleep(0)
+        assert len(body) == json_body_length(payload)
+        bodies.append(body)
+        return {"result_urls": [f"https://cdn/{len(bodies)}.png"]}
+
+    monkeypatch.setattr(api, "lifestyle_shot_by_text_async", lifestyle_shot_by_text_async)
+    response = TestClient(api.app).post(
+        "/product/lifestyle-text",
+        data={"api_key": "fanout-test", "scene_description": "kitchen", "num_results": "3", "stream": "true"},
+        files={"file": ("product.bin", upload, "application/octet-stream")},
+    )
+    assert json.loads(response.text.splitlines()[-1]) == {"done": True, "results": 3, "errors": 0}
+    assert len(bodies) == 3
+    assert all(json.loads(body)["file"] == base64.b64encode(upload).decode() for body in bodies)
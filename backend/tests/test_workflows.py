@@ -0,0 +1,22 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+
+
+@pytest.mark.parametrize("config", [
+    {"max_concurrency": "four"},
+    {"max_concurrency": 2.5},
+    {"max_concurrency": 0},
+    {"max_concurrency": True},
+    {"step_timeout": "soon"},
+    {"step_timeout": -1},
+])
+def test_ad_set_rejects_bad_workflow_settings(config):
+    response = TestClient(api.app).post(
+        "/workflows/ad-set", data={"prompt": "a bottle", "api_key": "workflow-test", "config": json.dumps(config)}
+    )
+    assert response.status_code == 400
+    assert next(iter(config)) in response.json()["detail"]
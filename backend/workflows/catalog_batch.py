@@ -0,0 +1,239 @@
+"""
+Batch processing of whole product catalogs.
+
+A batch is either a zip of product images (the file name without extension
+is used as the SKU) or an NDJSON manifest with one item per line:
+
+    {"sku": "SKU-1", "image_url": "https://..."}
+    {"sku": "SKU-2", "image_base64": "...", "params": {"background_color": "#F0F0F0"}}
+
+Items are read lazily from a spooled copy of the upload and fanned out to a
+bounded number of workers; results are yielded as soon as each item finishes.
+Every finished item is appended to a checkpoint file named after the batch,
+so re-submitting the same ``batch_id`` after a crash skips the SKUs that have
+already succeeded and replays their stored results.
+"""
+import asyncio
+import base64
+import json
+import os
+import re
+import time
+import zipfile
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Set
+
+from services import (
+    add_shadow_async,
+    create_packshot_async,
+    lifestyle_shot_by_text_async
+)
+from core.config import BATCH_CHECKPOINT_DIR, BATCH_CONCURRENCY
+from core.http import fetch_bytes
+from core.tracing import span
+
+BATCH_OPERATIONS = {
+    "packshot": create_packshot_async,
+    "shadow": add_shadow_async,
+    "lifestyle-text": lifestyle_shot_by_text_async,
+}
+
+# Defaults applied before the caller's params, per operation
+OPERATION_DEFAULTS = {
+    "lifestyle-text": {"num_results": 1, "sync": True},
+}
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def checkpoint_path(batch_id: str) -> str:
+    if not re.fullmatch(r"[A-Za-z0-9_.-]{1,128}", batch_id):
+        raise ValueError("batch_id may only contain letters, digits, '.', '_' and '-'")
+    return os.path.join(BATCH_CHECKPOINT_DIR, f"{batch_id}.ndjson")
+
+
+def load_checkpoint(path: str) -> Dict[str, Dict[str, Any]]:
+    """Return the stored record of every item that already succeeded."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash can leave a half-written last line behind
+                continue
+            if record.get("status") == "succeeded":
+                done[record["id"]] = record
+    return done
+
+
+def iter_zip_items(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield one item per image in the zip; the bytes are read on demand."""
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if os.path.basename(name).startswith("."):
+                continue
+            sku = os.path.splitext(os.path.basename(name))[0]
+            yield {"id": name, "sku": sku, "zip_path": path, "zip_member": name}
+
+
+def iter_ndjson_items(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                yield {"id": f"line-{line_number}", "error": "Invalid JSON"}
+                continue
+            if not isinstance(item, dict):
+                yield {"id": f"line-{line_number}", "error": "Each line must be a JSON object"}
+                continue
+            item.setdefault("id", item.get("sku") or f"line-{line_number}")
+            yield item
+
+
+def _read_zip_member(path: str, member: str) -> bytes:
+    with zipfile.ZipFile(path) as archive:
+        return archive.read(member)
+
+
+async def _load_image(item: Dict[str, Any]) -> bytes:
+    if "zip_member" in item:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, _read_zip_member, item["zip_path"], item["zip_member"])
+    if item.get("image_base64"):
+        return base64.b64decode(item["image_base64"])
+    if item.get("image_url"):
+        return await fetch_bytes(item["image_url"])
+    raise ValueError("Item has no image_base64 or image_url")
+
+
+async def run_catalog_batch(
+    api_key: str,
+    source_path: str,
+    source_format: str,
+    operation: str,
+    params: Optional[Dict[str, Any]] = None,
+    batch_id: Optional[str] = None,
+    concurrency: int = BATCH_CONCURRENCY
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Process every item of a catalog and yield one record per item as it finishes.
+
+    Args:
+        api_key: Bria AI API key
+        source_path: Path of the spooled zip or NDJSON upload
+        source_format: "zip" or "ndjson"
+        operation: One of ``BATCH_OPERATIONS``
+        params: Parameters shared by all items, passed to the service function
+        batch_id: Enables checkpointing and resuming under this name
+        concurrency: Maximum number of items processed at once
+
+    Yields:
+        ``{"id", "sku", "status", "result" | "error", "duration_ms"}`` per item,
+        then a final ``{"summary": {...}}`` record
+    """
+    if operation not in BATCH_OPERATIONS:
+        raise ValueError(f"Unknown operation '{operation}'. Expected one of: {', '.join(BATCH_OPERATIONS)}")
+    service = BATCH_OPERATIONS[operation]
+    shared_params = {**OPERATION_DEFAULTS.get(operation, {}), **(params or {})}
+    items = iter_zip_items(source_path) if source_format == "zip" else iter_ndjson_items(source_path)
+
+    checkpoint = None
+    done: Dict[str, Dict[str, Any]] = {}
+    if batch_id:
+        path = checkpoint_path(batch_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        done = load_checkpoint(path)
+        checkpoint = open(path, "a", encoding="utf-8")
+
+    started = time.perf_counter()
+    counts = {"total": 0, "succeeded": 0, "failed": 0, "resumed": 0}
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    finished: asyncio.Queue = asyncio.Queue()
+    seen_ids: Set[str] = set()
+
+    async def process(item: Dict[str, Any]) -> Dict[str, Any]:
+        record = {"id": item["id"], "sku": item.get("sku")}
+        item_start = time.perf_counter()
+        with span("batch.item", **{"batch.operation": operation, "batch.sku": item.get("sku")}) as current:
+            try:
+                if item.get("error"):
+                    raise ValueError(item["error"])
+                image_data = await _load_image(item)
+                call_params = {**shared_params, **item.get("params", {})}
+                if item.get("sku"):
+                    call_params["sku"] = item["sku"]
+                record["result"] = await service(api_key=api_key, image_data=image_data, **call_params)
+                record["status"] = "succeeded"
+            except Exception as e:
+                record["status"] = "failed"
+                record["error"] = str(e)
+            current.set_attribute("batch.item.status", record["status"])
+        record["duration_ms"] = round((time.perf_counter() - item_start) * 1000, 1)
+        return record
+
+    async def producer() -> None:
+        # Runs the (blocking) iterators off the loop one item at a time
+        loop = asyncio.get_running_loop()
+        iterator = iter(items)
+        while True:
+            item = await loop.run_in_executor(None, next, iterator, None)
+            if item is None:
+                break
+            if item["id"] in seen_ids:
+                item = {**item, "id": f"{item['id']}#{len(seen_ids)}"}
+            seen_ids.add(item["id"])
+            if item["id"] in done:
+                await finished.put({**done[item["id"]], "resumed": True})
+                continue
+            await pending.put(item)
+        for _ in range(concurrency):
+            await pending.put(None)
+
+    async def worker() -> None:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            await finished.put(await process(item))
+
+    tasks = [asyncio.create_task(producer())]
+    tasks += [asyncio.create_task(worker()) for _ in range(concurrency)]
+    all_done = asyncio.gather(*tasks)
+    all_done.add_done_callback(lambda _: finished.put_nowait(None))
+
+    try:
+        while True:
+            record = await finished.get()
+            if record is None:
+                break
+            counts["total"] += 1
+            if record.get("resumed"):
+                counts["resumed"] += 1
+            else:
+                counts[record["status"]] += 1
+                if checkpoint is not None:
+                    checkpoint.write(json.dumps(record) + "\n")
+                    checkpoint.flush()
+            yield record
+        try:
+            await all_done
+        except Exception as e:
+            # e.g. a corrupt zip or an unreadable manifest
+            counts["error"] = str(e)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if checkpoint is not None:
+            checkpoint.close()
+
+    counts["elapsed_s"] = round(time.perf_counter() - started, 2)
+    yield {"summary": counts}
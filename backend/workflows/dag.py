@@ -0,0 +1,111 @@
+"""
+Small dependency-graph executor for multi-step workflows.
+
+Steps whose dependencies have finished run concurrently (up to a cap), each
+with its own timeout. A failing step only takes down the steps that depend on
+it, so callers always get back whatever could be produced, plus timings.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core.tracing import span
+
+StepFunc = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class Step:
+    def __init__(
+        self,
+        name: str,
+        func: StepFunc,
+        depends_on: Optional[List[str]] = None,
+        timeout: Optional[float] = None
+    ):
+        """
+        Args:
+            name: Unique step name, also the key of its result
+            func: Coroutine function called with the results of its dependencies
+            depends_on: Names of the steps that must succeed first
+            timeout: Seconds before the step is cancelled (None uses the run default)
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = depends_on or []
+        self.timeout = timeout
+
+
+async def run_dag(
+    steps: List[Step],
+    max_concurrency: int = 4,
+    default_timeout: Optional[float] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Run the steps respecting their dependencies.
+
+    Returns a dict keyed by step name with ``status`` ("succeeded", "failed",
+    "timeout" or "skipped"), ``result``, ``error`` and ``duration_ms``.
+    """
+    by_name = {step.name: step for step in steps}
+    if len(by_name) != len(steps):
+        raise ValueError("Step names must be unique")
+    for step in steps:
+        unknown = [dep for dep in step.depends_on if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Step '{step.name}' depends on unknown step(s): {', '.join(unknown)}")
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    outcomes: Dict[str, Dict[str, Any]] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+    visiting = set()
+
+    async def run_step(step: Step) -> None:
+        if step.depends_on:
+            await asyncio.gather(*(tasks[dep] for dep in step.depends_on))
+        failed_deps = [dep for dep in step.depends_on if outcomes[dep]["status"] != "succeeded"]
+        if failed_deps:
+            outcomes[step.name] = {
+                "status": "skipped",
+                "result": None,
+                "error": f"Dependency failed: {', '.join(failed_deps)}",
+                "duration_ms": 0.0
+            }
+            return
+
+        inputs = {dep: outcomes[dep]["result"] for dep in step.depends_on}
+        timeout = step.timeout if step.timeout is not None else default_timeout
+        async with semaphore:
+            start = time.perf_counter()
+            with span("workflow.step", **{"workflow.step": step.name}) as current:
+                try:
+                    result = await asyncio.wait_for(step.func(inputs), timeout)
+                    outcome = {"status": "succeeded", "result": result, "error": None}
+                except asyncio.TimeoutError:
+                    outcome = {"status": "timeout", "result": None, "error": f"Timed out after {timeout}s"}
+                except Exception as e:
+                    outcome = {"status": "failed", "result": None, "error": str(e)}
+                current.set_attribute("workflow.step.status", outcome["status"])
+            outcome["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        outcomes[step.name] = outcome
+
+    def schedule(step: Step) -> asyncio.Task:
+        # Create dependency tasks first so run_step can await them
+        if step.name in tasks:
+            return tasks[step.name]
+        if step.name in visiting:
+            raise ValueError(f"Dependency cycle detected at step '{step.name}'")
+        visiting.add(step.name)
+        for dep in step.depends_on:
+            schedule(by_name[dep])
+        tasks[step.name] = asyncio.create_task(run_step(step))
+        return tasks[step.name]
+
+    try:
+        for step in steps:
+            schedule(step)
+    except ValueError:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    await asyncio.gather(*tasks.values())
+    return outcomes
@@ -1,12 +1,18 @@
 from typing import Dict, Any, Optional
 from services import (
-    lifestyle_shot_by_text,
-    add_shadow,
-    create_packshot,
-    generate_hd_image
+    lifestyle_shot_by_text_async,
+    add_shadow_async,
+    create_packshot_async,
+    generate_hd_image_async
 )
+from core.config import WORKFLOW_MAX_CONCURRENCY, WORKFLOW_STEP_TIMEOUT
+from core.http import fetch_bytes, make_sync
+from core.results import extract_result_urls
+from core.tracing import traced
+from workflows.dag import Step, run_dag
 
-def generate_ad_set(
+@traced("workflow.ad_set")
+async def generate_ad_set_async(
     api_key: str,
     image: Optional[bytes] = None,
     prompt: Optional[str] = None,
@@ -14,50 +20,108 @@ def generate_ad_set(
 ) -> Dict[str, Any]:
     """
     Generate a set of product ads based on configuration.
+
+    Packshot, shadow and lifestyle only depend on the source image, so they
+    run concurrently once it is available; the set takes as long as its
+    slowest branch. Failed or timed-out steps are reported in ``steps``
+    without discarding the results of the others.
+
+    Args:
+        api_key: Bria AI API key
+        image: Source product image in bytes (optional if prompt provided)
+        prompt: Prompt to generate the source image from when no image is given
+        config: Which derivatives to create and their parameters, plus
+            ``max_concurrency`` and ``step_timeout`` overrides
+
+    Returns:
+        Dict with one entry per successful step and a ``steps`` summary
+        holding status, error and duration of every step
     """
     if not config:
         config = {}
-    
-    result = {}
-    
+
+    steps = []
+
     # Generate HD image if prompt provided
     if prompt and not image:
-        hd_response = generate_hd_image(
-            api_key=api_key,
-            prompt=prompt,
-            num_results=config.get("num_results", 1),
-            aspect_ratio=config.get("aspect_ratio", "1:1"),
-            sync=config.get("sync", True)
-        )
-        result["hd_image"] = hd_response
-        image = hd_response.get("result_url")
-    
+        async def hd_image_step(inputs):
+            return await generate_hd_image_async(
+                api_key=api_key,
+                prompt=prompt,
+                num_results=config.get("num_results", 1),
+                aspect_ratio=config.get("aspect_ratio", "1:1"),
+                # The downstream steps need the finished image, not a placeholder
+                sync=True
+            )
+
+        async def source_step(inputs):
+            urls = extract_result_urls(inputs["hd_image"])
+            if not urls:
+                raise Exception("HD image generation returned no result URL")
+            return await fetch_bytes(urls[0])
+
+        steps.append(Step("hd_image", hd_image_step))
+        steps.append(Step("source", source_step, depends_on=["hd_image"]))
+    elif image:
+        async def source_step(inputs):
+            return image
+
+        steps.append(Step("source", source_step))
+    else:
+        return {"steps": {}}
+
     # Create packshot if requested
-    if config.get("create_packshot", False) and image:
-        packshot_response = create_packshot(
-            api_key=api_key,
-            image_data=image,
-            background_color=config.get("background_color", "#FFFFFF")
-        )
-        result["packshot"] = packshot_response
-    
+    if config.get("create_packshot", False):
+        async def packshot_step(inputs):
+            return await create_packshot_async(
+                api_key=api_key,
+                image_data=inputs["source"],
+                background_color=config.get("background_color", "#FFFFFF"),
+                engine=config.get("engine")
+            )
+
+        steps.append(Step("packshot", packshot_step, depends_on=["source"]))
+
     # Add shadow if requested
-    if config.get("add_shadow", False) and image:
-        shadow_response = add_shadow(
-            api_key=api_key,
-            image_data=image,
-            shadow_type=config.get("shadow_type", "natural")
-        )
-        result["shadow"] = shadow_response
-    
+    if config.get("add_shadow", False):
+        async def shadow_step(inputs):
+            return await add_shadow_async(
+                api_key=api_key,
+                image_data=inputs["source"],
+                shadow_type=config.get("shadow_type", "regular"),
+                engine=config.get("engine")
+            )
+
+        steps.append(Step("shadow", shadow_step, depends_on=["source"]))
+
     # Create lifestyle shot if requested
-    if config.get("lifestyle_shot", False) and image:
-        lifestyle_response = lifestyle_shot_by_text(
-            api_key=api_key,
-            image_data=image,
-            scene_description=config.get("scene_description", ""),
-            num_results=config.get("num_results", 1)
-        )
-        result["lifestyle"] = lifestyle_response
-    
-    return result 
\ No newline at end of file
+    if config.get("lifestyle_shot", False):
+        async def lifestyle_step(inputs):
+            return await lifestyle_shot_by_text_async(
+                api_key=api_key,
+                image_data=inputs["source"],
+                scene_description=config.get("scene_description", ""),
+                num_results=config.get("num_results", 1),
+                sync=True
+            )
+
+        steps.append(Step("lifestyle", lifestyle_step, depends_on=["source"]))
+
+    outcomes = await run_dag(
+        steps,
+        max_concurrency=config.get("max_concurrency") or WORKFLOW_MAX_CONCURRENCY,
+        default_timeout=config.get("step_timeout") or WORKFLOW_STEP_TIMEOUT
+    )
+
+    result = {}
+    for name, outcome in outcomes.items():
+        # The downloaded source bytes are an internal hand-off, not a result
+        if name != "source" and outcome["status"] == "succeeded":
+            result[name] = outcome["result"]
+    result["steps"] = {
+        name: {key: value for key, value in outcome.items() if key != "result"}
+        for name, outcome in outcomes.items()
+    }
+    return result
+
+generate_ad_set = make_sync(generate_ad_set_async)
@@ -65,6 +65,8 @@ const ImageGenerator = () => {
             formData.append('num_results', numImages);
             formData.append('aspect_ratio', aspectRatio);
             formData.append('style', style);
+            // Each image is sent as an NDJSON line as soon as it is ready
+            formData.append('stream', 'true');
 
             const response = await fetch(url, {
                 method: 'POST',
@@ -78,21 +80,32 @@ const ImageGenerator = () => {
                 throw new Error(errData.detail || `HTTP ${response.status}`);
             }
 
-            const data = await response.json();
-            console.log('✅ Generate Data:', data);
-
-            // Normalize response
-            let urls = [];
-            if (data.result_url) urls.push(data.result_url);
-            else if (data.result_urls) urls = data.result_urls;
-            else if (data.result && Array.isArray(data.result)) {
-                data.result.forEach(item => {
-                    if (item.urls) urls.push(...item.urls);
-                    else if (typeof item === 'string') urls.push(item);
-                });
+            const urls = [];
+            let lastError = '';
+            setResult([]);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const record = JSON.parse(line);
+                    if (record.result_url) {
+                        urls[record.index] = record.result_url;
+                        setResult(urls.filter(Boolean));
+                    } else if (record.error) {
+                        lastError = record.error;
+                    } else if (record.done) {
+                        console.log('✅ Generate Done:', record);
+                        if (!record.results) throw new Error(lastError || 'No image was generated');
+                    }
+                }
             }
-
-            setResult(urls);
         } catch (err) {
             console.error('❌ Generate Error:', err);
             setError(err.message);
@@ -230,7 +243,7 @@ const ImageGenerator = () => {
                         <label style={{ display: 'block', marginBottom: '0.5rem', fontSize: '0.9rem', color: 'var(--color-text-muted)' }}>Number of Images: {numImages}</label>
                         <input
                             type="range"
-                            min="1" max="4"
+                            min="1" max="16"
                             value={numImages}
                             onChange={(e) => setNumImages(e.target.value)}
                             style={{ width: '100%', accentColor: 'var(--color-primary)' }}